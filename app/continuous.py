@@ -0,0 +1,198 @@
+import os
+import socket
+import threading
+import uuid
+import time as time_module
+import pytz
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import crud, database, metrics, models
+from .report_generation import (
+    DEFAULT_WINDOWS, calculate_uptime_downtime, compute_report_rows, parse_timestamp_str, report_fieldnames
+)
+from .schedule import compile_schedule
+
+CONTINUOUS_REPORTING = os.getenv("CONTINUOUS_REPORTING", "false").lower() in ("1", "true", "yes")
+CONTINUOUS_REPORT_INTERVAL_SECONDS = float(os.getenv("CONTINUOUS_REPORT_INTERVAL_SECONDS", "30"))
+# Every API process starts a reporter, but only the holder of this lease refreshes; the others take over
+# once it stops renewing. It must outlast the interval, or the lease changes hands between refreshes.
+CONTINUOUS_REPORT_LEASE_SECONDS = float(
+    os.getenv("CONTINUOUS_REPORT_LEASE_SECONDS", str(max(120.0, 4 * CONTINUOUS_REPORT_INTERVAL_SECONDS)))
+)
+CONTINUOUS_REPORT_LEASE = "continuous_reporter"
+LATEST_REPORT_CHUNK_SIZE = 500
+
+# The latest_report table holds one row per store at the as-of time in latest_report_state. A refresh
+# recomputes only the stores whose rows can differ at the new as-of time: stores marked dirty by an ingest,
+# stores not in the table yet, and stores whose windows slid over something that matters (see
+# _slid_store_ids). The rest keep their rows, which are exactly what a full recomputation would give.
+
+
+def _as_naive(instant: datetime) -> datetime:
+    return instant.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _slid_store_ids(db: Session, store_ids, previous_as_of: datetime, as_of: datetime, timezones, business_hours):
+    # Moving the as-of time from previous_as_of to as_of leaves a store's results unchanged when, for every
+    # window, no business time falls in the part that slid out or the part that slid in, and no poll slid
+    # out (that would move the window's first poll). A clean store has no polls after previous_as_of.
+    if as_of == previous_as_of:
+        return set()
+    slid = set()
+    for window in DEFAULT_WINDOWS:
+        slid.update(crud.get_all_store_status_in_window(db, previous_as_of - window.duration, as_of - window.duration))
+    horizon_start_utc = previous_as_of - max(window.duration for window in DEFAULT_WINDOWS)
+    for store_id in store_ids:
+        if store_id in slid:
+            continue
+        schedule = compile_schedule(
+            store_id, timezones.get(store_id, crud.DEFAULT_TIMEZONE), business_hours.get(store_id, []),
+            horizon_start_utc, as_of
+        )
+        if schedule.business_seconds(previous_as_of, as_of) > 0 or any(
+            schedule.business_seconds(previous_as_of - window.duration, as_of - window.duration) > 0
+            for window in DEFAULT_WINDOWS
+        ):
+            slid.add(store_id)
+    return slid
+
+
+def _compute_rows(db: Session, store_ids, as_of: datetime, all_store_count: int, timezones, business_hours):
+    if len(store_ids) * 4 >= all_store_count:
+        return compute_report_rows(db, store_ids, as_of)
+    # A small share of the fleet is cheaper to compute with per-store queries than with a fleet preload.
+    return (
+        calculate_uptime_downtime(
+            store_id, as_of, db,
+            timezone_str=timezones.get(store_id, crud.DEFAULT_TIMEZONE),
+            business_hours_records=business_hours.get(store_id, [])
+        )
+        for store_id in store_ids
+    )
+
+
+def _replace_latest_rows(db: Session, store_ids: list, report_rows: list):
+    table = models.LatestReportRow.__table__
+    for i in range(0, len(store_ids), LATEST_REPORT_CHUNK_SIZE):
+        db.execute(table.delete().where(table.c.store_id.in_(store_ids[i:i + LATEST_REPORT_CHUNK_SIZE])))
+    for i in range(0, len(report_rows), LATEST_REPORT_CHUNK_SIZE):
+        db.execute(table.insert(), report_rows[i:i + LATEST_REPORT_CHUNK_SIZE])
+
+
+def _claim_state(db: Session, previous, as_of: datetime, data_version: int) -> bool:
+    # Moves latest_report_state from what this refresh started from to its new as-of time and data version,
+    # unless another refresh got there first. It is the first write of the refresh, so the rows it replaces
+    # next are covered by the same write lock.
+    table = models.LatestReportState.__table__
+    values = {"as_of": _as_naive(as_of), "data_version": data_version}
+    if previous is None:
+        try:
+            db.execute(table.insert().values(id=1, **values))
+        except IntegrityError:
+            return False
+        return True
+    result = db.execute(
+        table.update().
+        where(table.c.id == 1).
+        where(table.c.as_of == previous[0]).
+        where(table.c.data_version == previous[1]).
+        values(**values)
+    )
+    return result.rowcount == 1
+
+
+def refresh_latest_report(db: Session) -> int:
+    # Brings latest_report up to the newest poll and returns how many stores were recomputed.
+    started = time_module.perf_counter()
+    data_version = crud.get_data_version(db)
+    dirty_store_ids = crud.get_dirty_store_ids(db)
+    max_timestamp_str = crud.get_max_timestamp(db)
+    if not max_timestamp_str:
+        return 0
+    as_of = parse_timestamp_str(max_timestamp_str)
+    state = db.query(models.LatestReportState).filter(models.LatestReportState.id == 1).first()
+    if state is not None and state.as_of == _as_naive(as_of) and state.data_version == data_version and not dirty_store_ids:
+        return 0
+
+    # Kept as values: the ORM state would reload whatever another process wrote by the time it is compared.
+    previous = None if state is None else (state.as_of, state.data_version)
+
+    store_ids = crud.get_all_store_ids(db)
+    materialized = {row[0] for row in db.query(models.LatestReportRow.store_id).all()}
+    timezones = crud.get_all_store_timezones(db)
+    business_hours = crud.get_all_business_hours(db)
+    if state is None or state.as_of is None or pytz.utc.localize(state.as_of) > as_of:
+        recompute = set(store_ids)
+    else:
+        clean = [store_id for store_id in store_ids if store_id in materialized and store_id not in dirty_store_ids]
+        recompute = set(store_ids) - set(clean)
+        recompute |= _slid_store_ids(db, clean, pytz.utc.localize(state.as_of), as_of, timezones, business_hours)
+    recompute = sorted(recompute)
+    # Computed before any write, so the table is only locked for the replacement itself.
+    report_rows = list(_compute_rows(db, recompute, as_of, len(store_ids), timezones, business_hours))
+
+    if not _claim_state(db, previous, as_of, data_version):
+        db.rollback()
+        print(f"Skipped refreshing the latest report at {max_timestamp_str}: another process refreshed it first")
+        return 0
+    _replace_latest_rows(db, sorted(materialized - set(store_ids)) + recompute, report_rows)
+    crud.clear_dirty_stores(db, data_version)
+    db.commit()
+
+    elapsed = time_module.perf_counter() - started
+    metrics.inc("latest_report_stores_recomputed_total", len(recompute))
+    metrics.observe("latest_report_refresh_seconds", elapsed)
+    print(f"Refreshed the latest report at {max_timestamp_str}: {len(recompute)} of {len(store_ids)} stores recomputed in {elapsed:.2f}s")
+    return len(recompute)
+
+
+def current_latest_rows(db: Session, as_of: datetime):
+    # Report rows from latest_report when it is up to date for as_of and the current data, else None.
+    state = db.query(models.LatestReportState).filter(models.LatestReportState.id == 1).first()
+    if state is None or state.as_of != _as_naive(as_of) or state.data_version != crud.get_data_version(db):
+        return None
+    # Fetched up front: writing the report commits on this session while the rows are consumed.
+    fieldnames = report_fieldnames()
+    rows = db.query(*(getattr(models.LatestReportRow, name) for name in fieldnames)).\
+        order_by(models.LatestReportRow.store_id).all()
+    return iter([dict(row._mapping) for row in rows])
+
+
+class ContinuousReporter:
+    # Refreshes latest_report every interval on a daemon thread of the API process, while it holds the
+    # CONTINUOUS_REPORT_LEASE lease.
+
+    def __init__(self, interval_seconds: float = None, lease_seconds: float = None):
+        self.interval_seconds = interval_seconds or CONTINUOUS_REPORT_INTERVAL_SECONDS
+        self.lease_seconds = lease_seconds or CONTINUOUS_REPORT_LEASE_SECONDS
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="continuous-reporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        db = next(database.get_db())
+        try:
+            crud.release_lease(db, CONTINUOUS_REPORT_LEASE, self.holder)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = next(database.get_db())
+            try:
+                if crud.try_acquire_lease(db, CONTINUOUS_REPORT_LEASE, self.holder, self.lease_seconds):
+                    refresh_latest_report(db)
+            except Exception as e:
+                db.rollback()
+                print(f"Error refreshing the latest report: {e}")
+            finally:
+                db.close()
+            self._stop.wait(self.interval_seconds)
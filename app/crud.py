@@ -1,12 +1,18 @@
 \
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
-from . import models
+from sqlalchemy import bindparam, func, inspect, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import metrics, models
 import csv
-import pytz
+import hashlib
+import os
 from datetime import datetime, timedelta, time
 
 DEFAULT_TIMEZONE = "America/Chicago"
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "10000"))
+REPORT_DATA_CHUNK_SIZE = int(os.getenv("REPORT_DATA_CHUNK_SIZE", "1000"))
+INGEST_FINGERPRINT_BYTES = 64 * 1024
 
 def get_max_timestamp(db: Session):
     max_ts = db.query(func.max(models.StoreStatus.timestamp_utc)).scalar()
@@ -16,6 +22,24 @@ def get_max_timestamp(db: Session):
         return str(max_ts) 
     return None
 
+def get_timestamp_range(db: Session):
+    return db.query(func.min(models.StoreStatus.timestamp_utc), func.max(models.StoreStatus.timestamp_utc)).one()
+
+# database url -> (data_version, max timestamp); MAX(timestamp_utc) only changes when data is ingested,
+# and every ingest bumps the data version, so a primary-key lookup tells whether the cached value holds.
+_max_timestamp_cache = {}
+
+def get_max_timestamp_cached(db: Session):
+    database_url = str(db.get_bind().url)
+    data_version = get_data_version(db)
+    cached = _max_timestamp_cache.get(database_url)
+    if cached is not None and cached[0] == data_version:
+        return cached[1]
+    max_timestamp = get_max_timestamp(db)
+    if max_timestamp is not None:
+        _max_timestamp_cache[database_url] = (data_version, max_timestamp)
+    return max_timestamp
+
 
 def get_store_timezone_str(db: Session, store_id: str) -> str:
     tz_entry = db.query(models.StoreTimezone.timezone_str).filter(models.StoreTimezone.store_id == store_id).first()
@@ -31,80 +55,371 @@ def get_store_status_in_window(db: Session, store_id: str, start_utc: datetime,
         filter(models.StoreStatus.timestamp_utc <= end_utc).\
         order_by(models.StoreStatus.timestamp_utc).all()
 
+def store_has_polls(db: Session, store_id: str) -> bool:
+    return db.query(models.StoreStatus.store_id).filter(models.StoreStatus.store_id == store_id).first() is not None
+
 def get_all_store_ids(db: Session):
     return [item[0] for item in db.query(models.StoreStatus.store_id).distinct().all()]
 
+def get_all_store_timezones(db: Session) -> dict:
+    rows = db.query(models.StoreTimezone.store_id, models.StoreTimezone.timezone_str).all()
+    return {row.store_id: row.timezone_str or DEFAULT_TIMEZONE for row in rows}
 
-def bulk_insert_store_status(db: Session, file_path: str):
-    with open(file_path, 'r') as f:
-        reader = csv.DictReader(f)
-        objects = []
-        for row in reader:
-       
-            if not row.get('store_id') or not row.get('timestamp_utc') or not row.get('status'):
-                print(f"Skipping malformed row: {row}")
-                continue
-            try:
-      
-                ts_str = row['timestamp_utc'].replace(" UTC", "")
-
-                try:
-                    dt_obj = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S.%f')
-                except ValueError:
-                    dt_obj = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S')
-                
-                objects.append(models.StoreStatus(
-                    store_id=row['store_id'],
-                    timestamp_utc=dt_obj,
-                    status=row['status']
-                ))
-            except ValueError as e:
-                print(f"Skipping row due to parsing error for timestamp_utc '{row['timestamp_utc']}': {e} in row {row}")
-                continue
-        db.bulk_save_objects(objects)
+def get_all_business_hours(db: Session) -> dict:
+    rows = db.query(
+        models.BusinessHours.store_id,
+        models.BusinessHours.day_of_week,
+        models.BusinessHours.start_time_local,
+        models.BusinessHours.end_time_local
+    ).all()
+    business_hours_by_store = {}
+    for row in rows:
+        business_hours_by_store.setdefault(row.store_id, []).append(row)
+    return business_hours_by_store
+
+def get_all_store_status_in_window(db: Session, start_utc: datetime, end_utc: datetime) -> dict:
+    rows = db.query(models.StoreStatus.store_id, models.StoreStatus.timestamp_utc, models.StoreStatus.status).\
+        filter(models.StoreStatus.timestamp_utc >= start_utc).\
+        filter(models.StoreStatus.timestamp_utc <= end_utc).\
+        order_by(models.StoreStatus.store_id, models.StoreStatus.timestamp_utc).all()
+    polls_by_store = {}
+    for row in rows:
+        polls_by_store.setdefault(row.store_id, []).append(row)
+    return polls_by_store
+
+def get_hourly_rollup_in_window(db: Session, start_utc: datetime, end_utc: datetime) -> dict:
+    # Column rows keyed by naive UTC hour: building an ORM object per store-hour would cost more than the
+    # raw polls the rollup replaces.
+    Rollup = models.StoreHourlyRollup
+    rows = db.query(
+        Rollup.store_id, Rollup.hour_utc, Rollup.uptime_seconds, Rollup.start_status, Rollup.end_status,
+        Rollup.first_poll_utc, Rollup.first_status
+    ).\
+        filter(Rollup.hour_utc >= start_utc).\
+        filter(Rollup.hour_utc < end_utc).all()
+    rows_by_store = {}
+    for row in rows:
+        rows_by_store.setdefault(row.store_id, {})[row.hour_utc] = row
+    return rows_by_store
+
+def get_all_status_runs_in_window(db: Session, start_utc: datetime, end_utc: datetime):
+    Run = models.StoreStatusRun
+    return db.query(Run.store_id, Run.start_utc, Run.end_utc, Run.status).\
+        filter(Run.end_utc >= start_utc).\
+        filter(Run.start_utc <= end_utc).all()
+
+
+def _insert_statement(db: Session, table, ignore_duplicates: bool = False):
+    if not ignore_duplicates:
+        return table.insert()
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "sqlite":
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        return postgresql_insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with("IGNORE")
+
+def _insert_in_batches(db: Session, table, rows, chunk_size: int = None, ignore_duplicates: bool = False) -> int:
+    # Core executemany per chunk with a commit per batch: memory stays flat and no ORM objects are built.
+    chunk_size = chunk_size or INGEST_CHUNK_SIZE
+    statement = _insert_statement(db, table, ignore_duplicates)
+    inserted = 0
+    batch = []
+
+    def flush():
+        result = db.execute(statement, batch)
         db.commit()
+        return result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(batch)
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            inserted += flush()
+            batch = []
+    if batch:
+        inserted += flush()
+    return inserted
+
+def _ingest_in_batches(db: Session, table, rows, chunk_size: int = None, ignore_duplicates: bool = False) -> int:
+    # The CSV loads: rows come straight from the file, so the timer measures parsing and inserting alone.
+    with metrics.timer("ingest_seconds", table=table.name):
+        inserted = _insert_in_batches(db, table, rows, chunk_size, ignore_duplicates)
+    metrics.inc("ingest_rows_total", inserted, table=table.name)
+    return inserted
+
+def _parse_timestamp_utc(value: str) -> datetime:
+    ts_str = value.replace(" UTC", "")
+    try:
+        return datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError:
+        return datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S')
+
+def _iter_store_status_rows(reader):
+    for row in reader:
+        if not row.get('store_id') or not row.get('timestamp_utc') or not row.get('status'):
+            print(f"Skipping malformed row: {row}")
+            continue
+        try:
+            dt_obj = _parse_timestamp_utc(row['timestamp_utc'])
+        except ValueError as e:
+            print(f"Skipping row due to parsing error for timestamp_utc '{row['timestamp_utc']}': {e} in row {row}")
+            continue
+        yield {"store_id": row['store_id'], "timestamp_utc": dt_obj, "status": row['status']}
+
+def _iter_business_hours_rows(reader):
+    for row in reader:
+        if not row.get('store_id') or row.get('dayOfWeek') is None or not row.get('start_time_local') or not row.get('end_time_local'):
+            print(f"Skipping malformed business hours row: {row}")
+            continue
+        try:
+            start_time = datetime.strptime(row['start_time_local'], '%H:%M:%S').time()
+            end_time = datetime.strptime(row['end_time_local'], '%H:%M:%S').time()
+            yield {
+                "store_id": row['store_id'],
+                "day_of_week": int(row['dayOfWeek']),
+                "start_time_local": start_time,
+                "end_time_local": end_time
+            }
+        except ValueError as e:
+            print(f"Skipping row due to parsing error: {e} in row {row}")
+            continue
+
+def _iter_store_timezone_rows(reader):
+    for row in reader:
+        yield {"store_id": row['store_id'], "timezone_str": row.get('timezone_str') or DEFAULT_TIMEZONE}
+
+def _track_ingested_polls(rows, state: dict):
+    # Records the newest timestamp overall and the earliest one per store, for the rollup refresh.
+    touched_stores = state["touched_stores"]
+    for row in rows:
+        if state["high_water_mark"] is None or row["timestamp_utc"] > state["high_water_mark"]:
+            state["high_water_mark"] = row["timestamp_utc"]
+        earliest = touched_stores.get(row["store_id"])
+        if earliest is None or row["timestamp_utc"] < earliest:
+            touched_stores[row["store_id"]] = row["timestamp_utc"]
+        yield row
+
+def _after_ingest(db: Session, touched_stores: dict, polls_changed: bool = False):
+    if not touched_stores:
+        return
+    from .rollup import refresh_hourly_rollup_after_ingest
+    from .runs import refresh_status_runs_after_ingest
+    refresh_hourly_rollup_after_ingest(db, touched_stores)
+    refresh_status_runs_after_ingest(db, touched_stores, polls_changed)
+    mark_stores_dirty(db, list(touched_stores), get_data_version(db) + 1)
+    bump_data_version(db)
+
+def _iter_appended_lines(f, offset: int, state: dict):
+    # Binary reads keep byte offsets exact; a trailing line without a newline is still being written.
+    f.seek(offset)
+    for raw_line in f:
+        if not raw_line.endswith(b"\n"):
+            break
+        state["file_offset"] += len(raw_line)
+        yield raw_line.decode("utf-8")
+
+def mark_stores_dirty(db: Session, store_ids: list, data_version: int):
+    # Committed together with the data version bump that follows it.
+    table = models.DirtyStore.__table__
+    for i in range(0, len(store_ids), 500):
+        chunk = store_ids[i:i + 500]
+        db.execute(table.delete().where(table.c.store_id.in_(chunk)))
+        db.execute(table.insert(), [{"store_id": store_id, "data_version": data_version} for store_id in chunk])
+
+def get_dirty_store_ids(db: Session) -> set:
+    return {row[0] for row in db.query(models.DirtyStore.store_id).all()}
+
+def clear_dirty_stores(db: Session, up_to_version: int):
+    # Stores marked by a later ingest stay dirty for the next refresh.
+    db.query(models.DirtyStore).filter(models.DirtyStore.data_version <= up_to_version).delete(synchronize_session=False)
+
+def try_acquire_lease(db: Session, name: str, holder: str, ttl_seconds: float) -> bool:
+    # Takes or renews the lease when it is free, expired or already ours; the row update is atomic, so
+    # only one holder wins however many processes ask at once.
+    now = datetime.utcnow()
+    table = models.Lease.__table__
+    values = {"holder": holder, "expires_at": now + timedelta(seconds=ttl_seconds)}
+    result = db.execute(
+        table.update().
+        where(table.c.name == name).
+        where((table.c.holder == holder) | (table.c.expires_at < now)).
+        values(**values)
+    )
+    if result.rowcount == 0:
+        result = db.execute(_insert_statement(db, table, ignore_duplicates=True), {"name": name, **values})
+    db.commit()
+    return result.rowcount == 1
+
+def release_lease(db: Session, name: str, holder: str):
+    db.query(models.Lease).filter(models.Lease.name == name).filter(models.Lease.holder == holder).\
+        delete(synchronize_session=False)
+    db.commit()
 
-def bulk_insert_business_hours(db: Session, file_path: str):
+def get_data_version(db: Session) -> int:
+    row = db.query(models.DataVersion).filter(models.DataVersion.id == 1).first()
+    return row.version if row else 0
+
+def get_cleared_version(db: Session) -> int:
+    row = db.query(models.DataVersion).filter(models.DataVersion.id == 1).first()
+    return (row.cleared_version or 0) if row else 0
+
+def bump_data_version(db: Session) -> int:
+    # Any change to polls, business hours or timezones invalidates cached reports.
+    row = db.query(models.DataVersion).filter(models.DataVersion.id == 1).first()
+    if row is None:
+        row = models.DataVersion(id=1, version=0)
+        db.add(row)
+    row.version += 1
+    db.commit()
+    return row.version
+
+def get_ingest_state(db: Session, source: str):
+    return db.query(models.IngestState).filter(models.IngestState.source == source).first()
+
+def save_ingest_state(db: Session, source: str, high_water_mark: datetime = None, file_offset: int = None,
+                      file_fingerprint: str = None):
+    state = get_ingest_state(db, source)
+    if state is None:
+        state = models.IngestState(source=source, file_offset=0)
+        db.add(state)
+    if high_water_mark is not None and (state.high_water_mark is None or high_water_mark > state.high_water_mark):
+        state.high_water_mark = high_water_mark
+    if file_offset is not None:
+        state.file_offset = file_offset
+        state.file_fingerprint = file_fingerprint
+    db.commit()
+
+def _prefix_fingerprint(f, length: int) -> str:
+    # Hashes the length and the first and last INGEST_FINGERPRINT_BYTES of the first `length` bytes of a
+    # binary file. A file that only had lines appended keeps the fingerprint of what was already read;
+    # one rewritten in another order does not. Reads a bounded amount however large the file is.
+    digest = hashlib.sha256(str(length).encode())
+    f.seek(0)
+    digest.update(f.read(min(length, INGEST_FINGERPRINT_BYTES)))
+    tail_start = max(INGEST_FINGERPRINT_BYTES, length - INGEST_FINGERPRINT_BYTES)
+    if tail_start < length:
+        f.seek(tail_start)
+        digest.update(f.read(length - tail_start))
+    return digest.hexdigest()
+
+def _require_poll_key_index(db: Session):
+    # Polls already stored are skipped by ON CONFLICT DO NOTHING against this index. Without it, e.g. when
+    # database.create_indexes could not build it, a rescan would insert every poll again.
+    index_name = "ix_store_status_store_id_timestamp_utc"
+    indexes = {index["name"] for index in inspect(db.connection()).get_indexes(models.StoreStatus.__tablename__)}
+    if index_name not in indexes:
+        raise RuntimeError(
+            f"store_status has no {index_name} index, so ingest cannot skip polls that are already stored; "
+            "run database.create_indexes and resolve its warnings first"
+        )
+
+def bulk_insert_store_status(db: Session, file_path: str, chunk_size: int = None) -> int:
+    _require_poll_key_index(db)
+    state = {"high_water_mark": None, "touched_stores": {}}
     with open(file_path, 'r') as f:
-        reader = csv.DictReader(f)
-        objects = []
-        for row in reader:
-            if not row.get('store_id') or row.get('dayOfWeek') is None or not row.get('start_time_local') or not row.get('end_time_local'):
-                print(f"Skipping malformed business hours row: {row}")
-                continue
-            try:
-                start_time = datetime.strptime(row['start_time_local'], '%H:%M:%S').time()
-                end_time = datetime.strptime(row['end_time_local'], '%H:%M:%S').time()
-                objects.append(models.BusinessHours(
-                    store_id=row['store_id'],
-                    day_of_week=int(row['dayOfWeek']),
-                    start_time_local=start_time,
-                    end_time_local=end_time
-                ))
-            except ValueError as e:
-                print(f"Skipping row due to parsing error: {e} in row {row}")
-                continue
-        db.bulk_save_objects(objects)
-        db.commit()
+        rows = _track_ingested_polls(_iter_store_status_rows(csv.DictReader(f)), state)
+        inserted = _ingest_in_batches(db, models.StoreStatus.__table__, rows, chunk_size, ignore_duplicates=True)
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        fingerprint = _prefix_fingerprint(f, file_size)
+    save_ingest_state(db, models.StoreStatus.__tablename__, state["high_water_mark"], file_size, fingerprint)
+    _after_ingest(db, state["touched_stores"], polls_changed=True)
+    return inserted
 
-def bulk_insert_store_timezones(db: Session, file_path: str):
+def _track_store_ids(rows, store_ids: set):
+    for row in rows:
+        store_ids.add(row["store_id"])
+        yield row
+
+def bulk_insert_business_hours(db: Session, file_path: str, chunk_size: int = None) -> int:
+    store_ids = set()
     with open(file_path, 'r') as f:
-        reader = csv.DictReader(f)
-        objects = []
-        for row in reader:
-            if not row.get('store_id') or not row.get('timezone_str'):
-        
-                 objects.append(models.StoreTimezone(
-                    store_id=row['store_id'],
-                    timezone_str=DEFAULT_TIMEZONE 
-                ))
-                 continue
-            objects.append(models.StoreTimezone(
-                store_id=row['store_id'],
-                timezone_str=row['timezone_str'] if row['timezone_str'] else DEFAULT_TIMEZONE
-            ))
-        db.bulk_save_objects(objects)
+        rows = _track_store_ids(_iter_business_hours_rows(csv.DictReader(f)), store_ids)
+        inserted = _ingest_in_batches(db, models.BusinessHours.__table__, rows, chunk_size)
+    _after_ingest(db, dict.fromkeys(store_ids))
+    return inserted
+
+def bulk_insert_store_timezones(db: Session, file_path: str, chunk_size: int = None) -> int:
+    store_ids = set()
+    with open(file_path, 'r') as f:
+        rows = _track_store_ids(_iter_store_timezone_rows(csv.DictReader(f)), store_ids)
+        inserted = _ingest_in_batches(db, models.StoreTimezone.__table__, rows, chunk_size)
+    _after_ingest(db, dict.fromkeys(store_ids))
+    return inserted
+
+def incremental_insert_store_status(db: Session, file_path: str, chunk_size: int = None) -> int:
+    # Resumes from the byte offset of the previous ingest when the bytes before it are unchanged, i.e. the
+    # file only had lines appended; a file that was rewritten, even into a larger one, is rescanned from
+    # the header. Either way (store_id, timestamp_utc) pairs that are already stored are skipped.
+    _require_poll_key_index(db)
+    source = models.StoreStatus.__tablename__
+    ingest_state = get_ingest_state(db, source)
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        offset = len(header)
+        if ingest_state and ingest_state.file_offset and offset <= ingest_state.file_offset <= file_size:
+            if ingest_state.file_fingerprint == _prefix_fingerprint(f, ingest_state.file_offset):
+                offset = ingest_state.file_offset
+            else:
+                print(f"{file_path} was rewritten since the last ingest; rescanning it")
+        state = {"high_water_mark": None, "file_offset": offset, "touched_stores": {}}
+        fieldnames = next(csv.reader([header.decode("utf-8")]))
+        reader = csv.DictReader(_iter_appended_lines(f, offset, state), fieldnames=fieldnames)
+        rows = _track_ingested_polls(_iter_store_status_rows(reader), state)
+        inserted = _ingest_in_batches(db, models.StoreStatus.__table__, rows, chunk_size, ignore_duplicates=True)
+        fingerprint = _prefix_fingerprint(f, state["file_offset"])
+    save_ingest_state(db, source, state["high_water_mark"], state["file_offset"], fingerprint)
+    _after_ingest(db, state["touched_stores"], polls_changed=True)
+    return inserted
+
+def upsert_business_hours(db: Session, file_path: str, chunk_size: int = None) -> int:
+    # Business hours have no natural key, so a store's rows are replaced as a set when they change.
+    with open(file_path, 'r') as f:
+        incoming = {}
+        for row in _iter_business_hours_rows(csv.DictReader(f)):
+            incoming.setdefault(row["store_id"], set()).add(
+                (row["day_of_week"], row["start_time_local"], row["end_time_local"])
+            )
+    existing = {
+        store_id: {(row.day_of_week, row.start_time_local, row.end_time_local) for row in rows}
+        for store_id, rows in get_all_business_hours(db).items()
+    }
+    changed_store_ids = [store_id for store_id, hours in incoming.items() if hours != existing.get(store_id)]
+    table = models.BusinessHours.__table__
+    for i in range(0, len(changed_store_ids), 500):
+        db.execute(table.delete().where(table.c.store_id.in_(changed_store_ids[i:i + 500])))
+    db.commit()
+    rows = (
+        {"store_id": store_id, "day_of_week": day_of_week, "start_time_local": start_time, "end_time_local": end_time}
+        for store_id in changed_store_ids
+        for day_of_week, start_time, end_time in sorted(incoming[store_id])
+    )
+    _ingest_in_batches(db, table, rows, chunk_size)
+    _after_ingest(db, dict.fromkeys(changed_store_ids))
+    return len(changed_store_ids)
+
+def upsert_store_timezones(db: Session, file_path: str, chunk_size: int = None) -> int:
+    with open(file_path, 'r') as f:
+        incoming = {row["store_id"]: row["timezone_str"] for row in _iter_store_timezone_rows(csv.DictReader(f))}
+    existing = get_all_store_timezones(db)
+    table = models.StoreTimezone.__table__
+    changed = [
+        {"b_store_id": store_id, "b_timezone_str": timezone_str}
+        for store_id, timezone_str in incoming.items()
+        if store_id in existing and existing[store_id] != timezone_str
+    ]
+    if changed:
+        db.execute(
+            table.update().where(table.c.store_id == bindparam("b_store_id")).values(timezone_str=bindparam("b_timezone_str")),
+            changed
+        )
         db.commit()
+    new_store_ids = [store_id for store_id in incoming if store_id not in existing]
+    new_rows = ({"store_id": store_id, "timezone_str": incoming[store_id]} for store_id in new_store_ids)
+    inserted = _ingest_in_batches(db, table, new_rows, chunk_size)
+    _after_ingest(db, dict.fromkeys([row["b_store_id"] for row in changed] + new_store_ids))
+    return len(changed) + inserted
 
 def clear_data(db: Session):
     db.execute(text(f"DELETE FROM {models.ReportData.__tablename__}"))
@@ -112,22 +427,38 @@ def clear_data(db: Session):
     db.execute(text(f"DELETE FROM {models.StoreStatus.__tablename__}"))
     db.execute(text(f"DELETE FROM {models.BusinessHours.__tablename__}"))
     db.execute(text(f"DELETE FROM {models.StoreTimezone.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.IngestState.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.StoreHourlyRollup.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.HourlyRollupState.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.StoreStatusRun.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.StatusRunsState.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.DirtyStore.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.LatestReportRow.__tablename__}"))
+    db.execute(text(f"DELETE FROM {models.LatestReportState.__tablename__}"))
     db.commit()
+    version = bump_data_version(db)
+    db.query(models.DataVersion).filter(models.DataVersion.id == 1).update({"cleared_version": version})
+    db.commit()
+
+def save_report_data(db: Session, report_id: str, report_rows, chunk_size: int = None) -> int:
+    # report_rows may be a generator; rows are inserted in batches as they arrive.
+    columns = [column.name for column in models.ReportData.__table__.columns if column.name not in ("id", "report_id")]
+    rows = ({"report_id": report_id, **{column: data[column] for column in columns}} for data in report_rows)
+    return _insert_in_batches(db, models.ReportData.__table__, rows, chunk_size or REPORT_DATA_CHUNK_SIZE)
+
+def get_report_data_page(db: Session, report_id: str, after: str = None, store_ids: list = None, limit: int = 100):
+    # Keyset pagination over (report_id, store_id): each page is one index range scan, however large the report.
+    query = db.query(models.ReportData).filter(models.ReportData.report_id == report_id)
+    if after is not None:
+        query = query.filter(models.ReportData.store_id > after)
+    if store_ids:
+        query = query.filter(models.ReportData.store_id.in_(store_ids))
+    rows = query.order_by(models.ReportData.store_id).limit(limit + 1).all()
+    next_after = rows[limit - 1].store_id if len(rows) > limit else None
+    return rows[:limit], next_after
 
-def save_report_data(db: Session, report_id: str, report_data_list: list[dict]):
-    objects = []
-    for data in report_data_list:
-        objects.append(models.ReportData(
-            report_id=report_id,
-            store_id=data['store_id'],
-            uptime_last_hour=data['uptime_last_hour'],
-            uptime_last_day=data['uptime_last_day'],
-            uptime_last_week=data['uptime_last_week'],
-            downtime_last_hour=data['downtime_last_hour'],
-            downtime_last_day=data['downtime_last_day'],
-            downtime_last_week=data['downtime_last_week']
-        ))
-    db.bulk_save_objects(objects)
+def delete_report_data(db: Session, report_id: str):
+    db.query(models.ReportData).filter(models.ReportData.report_id == report_id).delete(synchronize_session=False)
     db.commit()
 
 def update_report_status(db: Session, report_id: str, status: str, file_path: str = None):
@@ -136,14 +467,48 @@ def update_report_status(db: Session, report_id: str, status: str, file_path: st
         report.status = status
         if file_path:
             report.file_path = file_path
+        if status in ("Complete", "Error"):
+            report.finished_at = datetime.utcnow()
         db.commit()
     else: # Create if not exists (e.g. if trigger_report doesn't create it in DB)
         new_report = models.Report(id=report_id, status=status, file_path=file_path)
         db.add(new_report)
         db.commit()
 
-def create_report_entry(db: Session, report_id: str):
-    new_report = models.Report(id=report_id, status="Running")
+def mark_report_started(db: Session, report_id: str):
+    db.query(models.Report).filter(models.Report.id == report_id).update(
+        {"started_at": datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
+
+def create_report_entry(db: Session, report_id: str, cache_key: str = None):
+    new_report = models.Report(id=report_id, status="Running", cache_key=cache_key)
     db.add(new_report)
     db.commit()
 
+def get_report(db: Session, report_id: str):
+    return db.query(models.Report).filter(models.Report.id == report_id).first()
+
+def get_cached_report(db: Session, cache_key: str):
+    return db.query(models.Report).\
+        filter(models.Report.cache_key == cache_key).\
+        filter(models.Report.status == "Complete").\
+        order_by(models.Report.created_at.desc()).first()
+
+def evict_reports(db: Session, keep: int) -> list:
+    # Keeps the newest `keep` finished reports; running ones are never evicted.
+    evicted = db.query(models.Report.id, models.Report.file_path).\
+        filter(models.Report.status != "Running").\
+        order_by(models.Report.created_at.desc()).\
+        offset(keep).all()
+    report_ids = [report.id for report in evicted]
+    for i in range(0, len(report_ids), 500):
+        batch = report_ids[i:i + 500]
+        db.query(models.ReportData).filter(models.ReportData.report_id.in_(batch)).delete(synchronize_session=False)
+        db.query(models.Report).filter(models.Report.id.in_(batch)).delete(synchronize_session=False)
+    db.commit()
+    return evicted
+
+def get_report_ids(db: Session) -> set:
+    return {item[0] for item in db.query(models.Report.id).all()}
+
@@ -1,15 +1,144 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./store_monitoring.db")
-connect_args={"check_same_thread": False}
+# "tuned" applies the per-backend settings below; "plain" is a bare engine, as before.
+DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "tuned")
+DATABASE_PROFILES = ("tuned", "plain")
 
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args=connect_args
-)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+
+# Indexes older models created that are now prefixes of composite ones; create_indexes drops them so
+# ingest stops paying to maintain them.
+RETIRED_INDEXES = {
+    "store_status": ("ix_store_status_store_id", "ix_store_status_timestamp_utc"),
+}
+
+
+def _is_sqlite_memory(url) -> bool:
+    return url.database in (None, "", ":memory:") or url.database.startswith("file::memory:")
+
+
+def _apply_sqlite_pragmas(engine):
+    # WAL lets report writes proceed while the API reads; the rest trades durability on power loss
+    # (never corruption) and memory for fewer syscalls on the large scans reports do.
+    use_wal = not _is_sqlite_memory(engine.url)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if use_wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+
+def make_engine(database_url: str = None, profile: str = None):
+    database_url = database_url or DATABASE_URL
+    profile = profile or DATABASE_PROFILE
+    if profile not in DATABASE_PROFILES:
+        raise ValueError(f"Unknown database profile '{profile}', expected one of {DATABASE_PROFILES}")
+
+    is_sqlite = database_url.startswith("sqlite")
+    kwargs = {}
+    if is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    elif profile == "tuned":
+        kwargs.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=DB_POOL_RECYCLE_SECONDS
+        )
+
+    new_engine = create_engine(database_url, **kwargs)
+    if is_sqlite and profile == "tuned":
+        _apply_sqlite_pragmas(new_engine)
+    return new_engine
+
+
+def add_missing_columns(bind):
+    # create_all never alters a table that already exists, so columns added to a model since the table was
+    # created are added here. They are all nullable, so rows written before read back as NULL.
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                print(f"Added missing column {table.name}.{column.name}")
+
+
+def _delete_duplicate_keys(connection, table, index):
+    # Keeps the first row (lowest id) of every key the unique index is about to enforce. Rows with a NULL key
+    # column never collide in a unique index, so they are left alone.
+    columns = [column.name for column in index.columns]
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+    result = connection.execute(text(
+        f"DELETE FROM {table.name} WHERE {not_null} AND id NOT IN "
+        f"(SELECT MIN(id) FROM {table.name} GROUP BY {', '.join(columns)})"
+    ))
+    if result.rowcount:
+        print(f"Deleted {result.rowcount} rows of {table.name} duplicating ({', '.join(columns)}) before indexing it")
+
+
+def create_indexes(bind):
+    # create_all only indexes tables it creates; this adds indexes introduced since to existing tables.
+    # Their columns must exist first (see add_missing_columns). Rows that would violate a new unique index
+    # are deleted first. Retired indexes are dropped only once every index of their table exists, so a
+    # failed build never leaves a table without the index its queries use.
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    incomplete_tables = set()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                with bind.begin() as connection:
+                    if index.unique and "id" in table.columns:
+                        _delete_duplicate_keys(connection, table, index)
+                    index.create(bind=connection)
+            except SQLAlchemyError as e:
+                print(f"Warning: could not create index {index.name} on {table.name}: {e}")
+                incomplete_tables.add(table.name)
+
+    with bind.begin() as connection:
+        for table_name, index_names in RETIRED_INDEXES.items():
+            if table_name not in existing_tables:
+                continue
+            existing_indexes = {index["name"] for index in inspect(connection).get_indexes(table_name)}
+            retired = [index_name for index_name in index_names if index_name in existing_indexes]
+            if retired and table_name in incomplete_tables:
+                print(f"Keeping {', '.join(retired)} until every index of {table_name} is built")
+                continue
+            for index_name in retired:
+                connection.execute(text(f"DROP INDEX {index_name}"))
+                print(f"Dropped redundant index {index_name}")
+
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -20,4 +149,3 @@ def get_db():
         yield db
     finally:
         db.close()
-
@@ -0,0 +1,55 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "1"))
+REPORT_QUEUE_DEPTH = int(os.getenv("REPORT_QUEUE_DEPTH", "4"))
+
+# Each job computes a whole fleet, so only REPORT_JOB_WORKERS run at once and at most REPORT_QUEUE_DEPTH
+# more wait behind them. Jobs are keyed on the report cache key, so triggers for the same as-of
+# timestamp and data share one job.
+
+
+class QueueFullError(Exception):
+    pass
+
+
+_executor = ThreadPoolExecutor(max_workers=REPORT_JOB_WORKERS, thread_name_prefix="report-job")
+_jobs = {}
+_lock = threading.Lock()
+
+
+def pending_jobs() -> int:
+    with _lock:
+        return len(_jobs)
+
+
+def _finish(job_key):
+    with _lock:
+        _jobs.pop(job_key, None)
+
+
+def enqueue(job_key, create_report, run_report):
+    # create_report() registers the report and returns its id; run_report(report_id) computes it.
+    # Returns (report_id, created).
+    with _lock:
+        report_id = _jobs.get(job_key)
+        if report_id is not None:
+            return report_id, False
+        if len(_jobs) >= REPORT_JOB_WORKERS + REPORT_QUEUE_DEPTH:
+            raise QueueFullError(f"{len(_jobs)} report jobs are already queued or running")
+        report_id = create_report()
+        _jobs[job_key] = report_id
+
+    def run():
+        try:
+            run_report(report_id)
+        finally:
+            _finish(job_key)
+
+    try:
+        _executor.submit(run)
+    except Exception:
+        _finish(job_key)
+        raise
+    return report_id, True
@@ -1,50 +1,285 @@
-from fastapi import FastAPI, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import cProfile
+import gzip
+import io
+import pstats
 import uuid
 import os
-from . import crud, schemas, report_generation, database
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional
+from . import crud, schemas, report_generation, database, jobs, metrics, store_uptime, continuous
+from .cache import TTLCache
 
 database.Base.metadata.create_all(bind=database.engine)
+database.add_missing_columns(database.engine)
+database.create_indexes(database.engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # With CONTINUOUS_REPORTING on, the latest report is kept current in the background so a triggered
+    # report only has to copy it.
+    reporter = None
+    if continuous.CONTINUOUS_REPORTING:
+        reporter = continuous.ContinuousReporter()
+        reporter.start()
+    yield
+    if reporter is not None:
+        reporter.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 REPORTS_DIR = "generated_reports"
 os.makedirs(REPORTS_DIR, exist_ok=True)
 
-report_status = {}
+# Status lives in the reports table so any worker or replica can answer; polling clients hit this cache first.
+REPORT_STATUS_TTL_SECONDS = float(os.getenv("REPORT_STATUS_TTL_SECONDS", "2"))
+report_status_cache = TTLCache(REPORT_STATUS_TTL_SECONDS)
 
-@app.post("/trigger_report", response_model=schemas.ReportID)
-async def trigger_report_endpoint(background_tasks: BackgroundTasks):
+def get_report_status(report_id: str):
+    # Returns (status, file_path), or None for an unknown report.
+    cached = report_status_cache.get(report_id)
+    if cached is not None:
+        return cached
+    db = next(database.get_db())
+    report = crud.get_report(db, report_id)
+    db.close()
+    if report is None:
+        return None
+    status = (report.status, report.file_path)
+    report_status_cache.set(report_id, status)
+    return status
+
+def run_report(report_id: str, max_timestamp_str: str, cache_key: str, profile: bool = False):
+    if profile:
+        # Computed in-process: with pool workers the profile would mostly show this thread waiting on them.
+        profiler = cProfile.Profile()
+        profiler.runcall(
+            report_generation.generate_report_logic, report_id, REPORTS_DIR, max_timestamp_str, cache_key=cache_key, workers=1
+        )
+        profiler.dump_stats(os.path.join(REPORTS_DIR, f"{report_id}.prof"))
+    else:
+        report_generation.generate_report_logic(report_id, REPORTS_DIR, max_timestamp_str, cache_key=cache_key)
+    report_status_cache.invalidate(report_id)
+
+def create_report(cache_key: str):
     report_id = str(uuid.uuid4())
-    report_status[report_id] = "Running"
-    
     db = next(database.get_db())
-    max_timestamp_str = crud.get_max_timestamp(db)
+    crud.create_report_entry(db, report_id, cache_key)
     db.close()
+    return report_id
+
+def prepare_report(profile: bool = False):
+    # Returns the id of a reusable completed report, of the job already computing the same data,
+    # or of a newly queued job. A profiled run is always a fresh job of its own.
+    db = next(database.get_db())
+    try:
+        max_timestamp_str = crud.get_max_timestamp_cached(db)
+        if not max_timestamp_str:
+            raise HTTPException(status_code=500, detail="Could not determine max timestamp from data.")
 
-    if not max_timestamp_str:
-        raise HTTPException(status_code=500, detail="Could not determine max timestamp from data.")
+        # Nothing was ingested since a completed report for this as-of time, so hand that one back.
+        cache_key = report_generation.report_cache_key(max_timestamp_str, crud.get_data_version(db))
+        cached_report = None if profile else crud.get_cached_report(db, cache_key)
+        if cached_report and cached_report.file_path and os.path.exists(cached_report.file_path):
+            return cached_report.id
+    finally:
+        db.close()
 
-    background_tasks.add_task(report_generation.generate_report_logic, report_id, REPORTS_DIR, report_status, max_timestamp_str)
+    try:
+        report_id, _ = jobs.enqueue(
+            f"profile:{uuid.uuid4()}" if profile else cache_key,
+            lambda: create_report(cache_key),
+            lambda report_id: run_report(report_id, max_timestamp_str, cache_key, profile)
+        )
+    except jobs.QueueFullError:
+        raise HTTPException(
+            status_code=429, detail="Too many reports are queued. Please try again later.", headers={"Retry-After": "30"}
+        )
+    return report_id
+
+def mark_report_failed(report_id: str):
+    db = next(database.get_db())
+    crud.update_report_status(db, report_id, "Error")
+    db.close()
+    report_status_cache.invalidate(report_id)
+
+# Database work runs in the threadpool so a slow query never stalls the event loop.
+@app.post("/trigger_report", response_model=schemas.ReportID)
+async def trigger_report_endpoint(profile: bool = False):
+    report_id = await run_in_threadpool(prepare_report, profile)
     return {"report_id": report_id}
 
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    qualities = {}
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        params = params.strip().lower()
+        try:
+            qualities[name.strip().lower()] = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            qualities[name.strip().lower()] = 0.0
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def iter_gunzipped(file_path: str, chunk_size: int = 64 * 1024):
+    with gzip.open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def report_file_response(request: Request, report_id: str, report_file_path: str):
+    # A finished report never changes, so its id makes a strong ETag. The stored gzip bytes go out as is
+    # to clients that accept gzip, with Range support; anyone else gets the CSV decompressed on the fly.
+    headers = {"Content-Disposition": f"attachment; filename={report_id}.csv", "Vary": "Accept-Encoding"}
+    if not report_file_path.endswith(".gz"):
+        headers["ETag"] = f'"{report_id}"'
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(report_file_path, media_type='text/csv', headers=headers)
+
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        headers["ETag"] = f'"{report_id}-gzip"'
+        headers["Content-Encoding"] = "gzip"
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(report_file_path, media_type='text/csv', headers=headers)
+
+    headers["ETag"] = f'"{report_id}"'
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    headers["Accept-Ranges"] = "none"
+    return StreamingResponse(iter_gunzipped(report_file_path), media_type='text/csv', headers=headers)
+
+def parquet_file_response(request: Request, report_id: str):
+    parquet_file_path = os.path.join(REPORTS_DIR, f"{report_id}.parquet")
+    if not os.path.exists(parquet_file_path):
+        raise HTTPException(status_code=404, detail="No Parquet output for this report ID. Set REPORT_PARQUET=true to generate it.")
+    headers = {"Content-Disposition": f"attachment; filename={report_id}.parquet", "ETag": f'"{report_id}-parquet"'}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(parquet_file_path, media_type='application/vnd.apache.parquet', headers=headers)
+
 @app.get("/get_report/{report_id}")
-async def get_report_endpoint(report_id: str):
-    status = report_status.get(report_id)
-    if status is None:
+async def get_report_endpoint(request: Request, report_id: str, format: str = Query("csv", pattern="^(csv|parquet)$")):
+    report = await run_in_threadpool(get_report_status, report_id)
+    if report is None:
         raise HTTPException(status_code=404, detail="Report ID not found.")
+    status, report_file_path = report
     
     if status == "Running":
         return {"status": "Running"}
     elif status == "Complete":
-        report_file_path = os.path.join(REPORTS_DIR, f"{report_id}.csv")
-        if os.path.exists(report_file_path):
-            return FileResponse(report_file_path, media_type='text/csv', filename=f"{report_id}.csv", headers={"Content-Disposition": f"attachment; filename={report_id}.csv"})
+        if report_file_path and os.path.exists(report_file_path):
+            if format == "parquet":
+                return parquet_file_response(request, report_id)
+            return report_file_response(request, report_id, report_file_path)
         else:
-            report_status[report_id] = "Error"
+            await run_in_threadpool(mark_report_failed, report_id)
             raise HTTPException(status_code=500, detail="Report file not found but status was Complete. Please try triggering again.")
     elif status == "Error":
         raise HTTPException(status_code=500, detail="Report generation failed.")
     else:
         raise HTTPException(status_code=500, detail="Unknown report status.")
 
+def get_report_stores_page(report_id: str, after: Optional[str], store_ids: Optional[List[str]], limit: int):
+    db = next(database.get_db())
+    try:
+        rows, next_after = crud.get_report_data_page(db, report_id, after, store_ids, limit)
+        return schemas.ReportStoresPage(
+            report_id=report_id,
+            stores=[schemas.ReportResult.model_validate(row, from_attributes=True) for row in rows],
+            next_after=next_after
+        )
+    finally:
+        db.close()
+
+@app.get("/get_report/{report_id}/stores")
+async def get_report_stores_endpoint(
+    report_id: str,
+    after: Optional[str] = None,
+    store_id: Optional[List[str]] = Query(None),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    report = await run_in_threadpool(get_report_status, report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Report ID not found.")
+    status, _ = report
+
+    if status == "Running":
+        return {"status": "Running"}
+    elif status == "Error":
+        raise HTTPException(status_code=500, detail="Report generation failed.")
+    return await run_in_threadpool(get_report_stores_page, report_id, after, store_id, limit)
+
+@app.get("/get_report/{report_id}/profile", response_class=PlainTextResponse)
+async def get_report_profile_endpoint(report_id: str, limit: int = Query(40, ge=1, le=500)):
+    # Available for reports triggered with /trigger_report?profile=true.
+    profile_path = os.path.join(REPORTS_DIR, f"{report_id}.prof")
+    if not os.path.exists(profile_path):
+        raise HTTPException(status_code=404, detail="No profile for this report ID.")
+    output = io.StringIO()
+    pstats.Stats(profile_path, stream=output).sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+def get_store_uptime(store_id: str, as_of: Optional[datetime]):
+    db = next(database.get_db())
+    try:
+        found = store_uptime.get_store_uptime(db, store_id, as_of)
+    finally:
+        db.close()
+    if found is None:
+        return None
+    as_of, result = found
+    return schemas.StoreUptime(as_of=as_of, **result)
+
+# Computed on request for one store, bypassing the report queue; as_of defaults to the newest poll.
+@app.get("/stores/{store_id}/uptime", response_model=schemas.StoreUptime)
+async def store_uptime_endpoint(store_id: str, as_of: Optional[datetime] = None):
+    uptime = await run_in_threadpool(get_store_uptime, store_id, as_of)
+    if uptime is None:
+        raise HTTPException(status_code=404, detail="No status polls found for this store ID.")
+    return uptime
+
+def get_store_uptime_ranges(store_id: str, ranges):
+    db = next(database.get_db())
+    try:
+        results = store_uptime.get_uptime_for_ranges(db, store_id, ranges)
+    finally:
+        db.close()
+    if results is None:
+        return None
+    return schemas.StoreUptimeRanges(store_id=store_id, ranges=[
+        schemas.UptimeRange(start=start, end=end, uptime_seconds=uptime, downtime_seconds=downtime)
+        for start, end, uptime, downtime in results
+    ])
+
+# Any number of [start, end) ranges, paired by position: ?start=...&end=...&start=...&end=...
+@app.get("/stores/{store_id}/uptime/ranges", response_model=schemas.StoreUptimeRanges)
+async def store_uptime_ranges_endpoint(
+    store_id: str,
+    start: List[datetime] = Query(...),
+    end: List[datetime] = Query(...)
+):
+    if len(start) != len(end):
+        raise HTTPException(status_code=400, detail="Pass one end for every start.")
+    try:
+        uptime = await run_in_threadpool(get_store_uptime_ranges, store_id, list(zip(start, end)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if uptime is None:
+        raise HTTPException(status_code=404, detail="No status polls found for this store ID.")
+    return uptime
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,113 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process counters, gauges and summaries rendered in the Prometheus text format. Values are per
+# process: report pool workers hand theirs back with drain() and the parent merge()s them, while
+# ingest run from initial_setup.py is only visible in that script's process.
+
+METRICS = {
+    "ingest_rows_total": ("counter", "Rows inserted by bulk loads, by table."),
+    "ingest_seconds": ("summary", "Time spent parsing and inserting the rows of bulk loads, by table."),
+    "report_runs_total": ("counter", "Reports generated, by engine and outcome."),
+    "report_stores_total": ("counter", "Store results produced by report runs."),
+    "report_seconds": ("summary", "Wall time of a whole report run."),
+    "report_db_fetch_seconds": ("summary", "Time spent loading timezones, business hours and polls for a report."),
+    "report_compute_seconds": ("summary", "Time spent computing store results, excluding output."),
+    "report_csv_write_seconds": ("summary", "Time spent writing report rows to the CSV and Parquet files."),
+    "report_save_data_seconds": ("summary", "Time spent inserting report rows into report_data."),
+    "report_stores_per_second": ("gauge", "Store throughput of the most recent report run."),
+    "store_uptime_lookups_total": ("counter", "Single-store uptime lookups, by result cache hit or miss."),
+    "uptime_index_lookups_total": ("counter", "Uptime index lookups for range queries, by cache hit or miss."),
+    "uptime_index_build_seconds": ("summary", "Time spent building a store's uptime index."),
+    "latest_report_stores_recomputed_total": ("counter", "Stores recomputed by continuous latest-report refreshes."),
+    "latest_report_refresh_seconds": ("summary", "Wall time of a continuous latest-report refresh."),
+    "store_sweep_seconds": ("summary", "Per-store time for the shared poll sweep in calculate_uptime_downtime."),
+    "store_window_compute_seconds": ("summary", "Per-store, per-window compute time in calculate_uptime_downtime."),
+}
+
+_values = {}
+_lock = threading.Lock()
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    with _lock:
+        key = _key(name, labels)
+        count, total = _values.get(key, (0, 0.0))
+        _values[key] = (count + 1, total + seconds)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def drain() -> dict:
+    with _lock:
+        values = dict(_values)
+        _values.clear()
+    return values
+
+
+def merge(values: dict):
+    with _lock:
+        for key, value in values.items():
+            current = _values.get(key)
+            if current is None:
+                _values[key] = value
+            elif isinstance(value, tuple):
+                _values[key] = (current[0] + value[0], current[1] + value[1])
+            elif METRICS[key[0]][0] == "gauge":
+                _values[key] = value
+            else:
+                _values[key] = current + value
+
+
+def reset():
+    with _lock:
+        _values.clear()
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def render() -> str:
+    with _lock:
+        values = dict(_values)
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind == "summary":
+                count, total = value
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
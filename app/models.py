@@ -1,5 +1,5 @@
 \
-from sqlalchemy import Column, Integer, String, DateTime, Time, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, DateTime, Time, ForeignKey, Float, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -7,9 +7,15 @@ import datetime
 class StoreStatus(Base):
     __tablename__ = "store_status"
     id = Column(Integer, primary_key=True, index=True)
-    store_id = Column(String, index=True)
-    timestamp_utc = Column(DateTime, index=True)
+    # No single-column indexes: both columns lead one of the composite indexes below.
+    store_id = Column(String)
+    timestamp_utc = Column(DateTime)
     status = Column(String) 
+    __table_args__ = (
+        Index("ix_store_status_store_id_timestamp_utc", "store_id", "timestamp_utc", unique=True),
+        # Covers the fleet-wide window preload, which filters on timestamp_utc alone.
+        Index("ix_store_status_timestamp_utc_store_id_status", "timestamp_utc", "store_id", "status"),
+    )
 
 class BusinessHours(Base):
     __tablename__ = "business_hours"
@@ -30,7 +36,10 @@ class Report(Base):
     id = Column(String, primary_key=True, index=True)
     status = Column(String, default="Running")
     file_path = Column(String, nullable=True)
+    cache_key = Column(String, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
 
 class ReportData(Base):
     __tablename__ = "report_data"
@@ -44,3 +53,94 @@ class ReportData(Base):
     downtime_last_day = Column(Float) 
     downtime_last_week = Column(Float)
     report = relationship("Report")
+    __table_args__ = (
+        Index("ix_report_data_report_id_store_id", "report_id", "store_id", unique=True),
+    )
+
+class IngestState(Base):
+    __tablename__ = "ingest_state"
+    source = Column(String, primary_key=True)
+    # Newest timestamp ingested from the source; informational, nothing is filtered on it.
+    high_water_mark = Column(DateTime, nullable=True)
+    file_offset = Column(Integer, default=0)
+    # Fingerprint of the first file_offset bytes, checked before resuming (see crud._prefix_fingerprint).
+    file_fingerprint = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class StoreHourlyRollup(Base):
+    __tablename__ = "store_hourly_rollup"
+    store_id = Column(String, primary_key=True)
+    hour_utc = Column(DateTime, primary_key=True)
+    business_seconds = Column(Float)
+    uptime_seconds = Column(Float)
+    start_status = Column(String, nullable=True)
+    end_status = Column(String, nullable=True)
+    first_poll_utc = Column(DateTime, nullable=True)
+    first_status = Column(String, nullable=True)
+    __table_args__ = (
+        Index("ix_store_hourly_rollup_hour_utc", "hour_utc"),
+    )
+
+class HourlyRollupState(Base):
+    # The data version store_hourly_rollup is up to date with; it falls behind while HOURLY_ROLLUP is off.
+    __tablename__ = "hourly_rollup_state"
+    id = Column(Integer, primary_key=True)
+    data_version = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class StatusRunsState(Base):
+    # The data version store_status_run is up to date with; it falls behind while STATUS_RUNS is off.
+    __tablename__ = "status_runs_state"
+    id = Column(Integer, primary_key=True)
+    data_version = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class StoreStatusRun(Base):
+    # Consecutive polls of a store with the same status, no more than runs.RUN_MAX_GAP apart.
+    __tablename__ = "store_status_run"
+    store_id = Column(String, primary_key=True)
+    start_utc = Column(DateTime, primary_key=True)
+    end_utc = Column(DateTime)
+    status = Column(String)
+    poll_count = Column(Integer)
+    __table_args__ = (
+        Index("ix_store_status_run_end_utc", "end_utc"),
+    )
+
+class DataVersion(Base):
+    __tablename__ = "data_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)
+    # The version clear_data last bumped to; anything derived from polls at an older version is void.
+    cleared_version = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class DirtyStore(Base):
+    # Stores whose polls, business hours or timezone changed since the latest report last saw them.
+    __tablename__ = "dirty_store"
+    store_id = Column(String, primary_key=True)
+    data_version = Column(Integer, index=True)
+
+class LatestReportRow(Base):
+    __tablename__ = "latest_report"
+    store_id = Column(String, primary_key=True)
+    uptime_last_hour = Column(Float)
+    uptime_last_day = Column(Float)
+    uptime_last_week = Column(Float)
+    downtime_last_hour = Column(Float)
+    downtime_last_day = Column(Float)
+    downtime_last_week = Column(Float)
+
+class LatestReportState(Base):
+    __tablename__ = "latest_report_state"
+    id = Column(Integer, primary_key=True)
+    as_of = Column(DateTime, nullable=True)
+    data_version = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class Lease(Base):
+    # Lets one of several API processes run a background task; the holder renews it before every run.
+    __tablename__ = "lease"
+    name = Column(String, primary_key=True)
+    holder = Column(String)
+    expires_at = Column(DateTime)
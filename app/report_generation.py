@@ -1,282 +1,444 @@
+import bisect
 import pytz
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta
+from collections import namedtuple
 from sqlalchemy.orm import Session
-from . import crud, models, database
+from . import crud, database, metrics
+from .schedule import compile_schedule
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
 import csv
+import gzip
 import os
+import time as time_module
 
-DEFAULT_TIMEZONE = "America/Chicago"
-
-def get_utc_from_local_time(local_dt_naive, timezone_str):
-    try:
-        tz = pytz.timezone(timezone_str)
-        local_dt_aware = tz.localize(local_dt_naive, is_dst=None) 
-    except pytz.exceptions.AmbiguousTimeError:
-        local_dt_aware = tz.localize(local_dt_naive, is_dst=False)
-    except pytz.exceptions.NonExistentTimeError:
-        local_dt_aware = tz.localize(local_dt_naive + timedelta(hours=1), is_dst=False) 
-    except pytz.UnknownTimeZoneError:
-        tz = pytz.timezone(DEFAULT_TIMEZONE) 
-        local_dt_aware = tz.localize(local_dt_naive, is_dst=None)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
-    return local_dt_aware.astimezone(pytz.utc)
+DEFAULT_TIMEZONE = "America/Chicago"
+# Opt-in: the pool spawns fresh interpreters, which only pays off on multi-core machines with large fleets.
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "1"))
+REPORT_CHUNK_SIZE = int(os.getenv("REPORT_CHUNK_SIZE", "500"))
+REPORT_ENGINE = os.getenv("REPORT_ENGINE", "python")
+REPORT_ENGINES = ("python", "numpy", "rollup", "runs")
+# Bump when a change to the computation would alter report contents, so cached reports are not reused.
+REPORT_ENGINE_VERSION = 1
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "20"))
+REPORT_GZIP_LEVEL = int(os.getenv("REPORT_GZIP_LEVEL", "6"))
+# Writes <report_id>.parquet next to the CSV for analytics jobs; needs pyarrow.
+REPORT_PARQUET = os.getenv("REPORT_PARQUET", "false").lower() in ("1", "true", "yes")
+PARQUET_ROW_GROUP_SIZE = 50000
+REPORT_FILE_EXTENSIONS = ("csv", "csv.gz", "parquet", "prof")
+
+ReportWindow = namedtuple("ReportWindow", ["name", "duration", "unit_seconds"])
+
+
+DEFAULT_WINDOWS = (
+    ReportWindow("hour", timedelta(hours=1), 60),
+    ReportWindow("day", timedelta(days=1), 3600),
+    ReportWindow("week", timedelta(weeks=1), 3600),
+)
+
+_WINDOW_UNITS = {"m": timedelta(minutes=1), "h": timedelta(hours=1), "d": timedelta(days=1), "w": timedelta(weeks=1)}
+
+
+def parse_windows(spec: str):
+    # "15m,4h,30d" -> windows named after their spec; up to an hour is reported in minutes, longer in hours.
+    windows = []
+    for token in spec.replace("/", ",").split(","):
+        token = token.strip()
+        if not token:
+            continue
+        if token[-1] not in _WINDOW_UNITS or not token[:-1].isdigit() or int(token[:-1]) <= 0:
+            raise ValueError(f"Invalid window '{token}', expected e.g. 15m, 4h, 30d or 1w")
+        duration = int(token[:-1]) * _WINDOW_UNITS[token[-1]]
+        windows.append(ReportWindow(token, duration, 60 if duration <= timedelta(hours=1) else 3600))
+    return tuple(windows)
+
+
+def report_fieldnames(windows=DEFAULT_WINDOWS):
+    return (
+        ["store_id"]
+        + [f"uptime_last_{window.name}" for window in windows]
+        + [f"downtime_last_{window.name}" for window in windows]
+    )
 
 
 def calculate_uptime_downtime(
     store_id: str,
     current_utc_dt: datetime,
-    db: Session
+    db: Session = None,
+    timezone_str: str = None,
+    business_hours_records: list = None,
+    status_polls: list = None,
+    windows=DEFAULT_WINDOWS
 ):
-    uptime_last_hour = 0
-    downtime_last_hour = 0
-    uptime_last_day = 0
-    downtime_last_day = 0
-    uptime_last_week = 0
-    downtime_last_week = 0
-
-    store_tz_str = crud.get_store_timezone_str(db, store_id)
-    store_tz = pytz.timezone(store_tz_str)
-
-    business_hours_records = crud.get_business_hours_for_store(db, store_id)
-    
-    is_always_open = not business_hours_records
-
-    time_intervals = [
-        ("hour", current_utc_dt - timedelta(hours=1), current_utc_dt),
-        ("day", current_utc_dt - timedelta(days=1), current_utc_dt),
-        ("week", current_utc_dt - timedelta(weeks=1), current_utc_dt),
-    ]
-
-    for period_name, start_utc_calc, end_utc_calc in time_intervals:
-        total_business_seconds_in_period = 0
-        observed_uptime_seconds = 0
-        
-        status_polls = crud.get_store_status_in_window(db, store_id, start_utc_calc, end_utc_calc)
-
-        if not status_polls: 
-            temp_cursor_utc_bh_calc = start_utc_calc
-            temp_total_business_seconds = 0
-            while temp_cursor_utc_bh_calc < end_utc_calc:
-                next_minute_utc_bh = temp_cursor_utc_bh_calc + timedelta(minutes=1)
-                actual_next_utc_bh = min(next_minute_utc_bh, end_utc_calc)
-                duration_seconds_bh = (actual_next_utc_bh - temp_cursor_utc_bh_calc).total_seconds()
-                if duration_seconds_bh <= 0: break
-
-                mid_point_utc_bh = temp_cursor_utc_bh_calc + timedelta(seconds=duration_seconds_bh / 2)
-                mid_point_local_bh = mid_point_utc_bh.astimezone(store_tz)
-                is_bh_segment_active = False
-                if is_always_open:
-                    is_bh_segment_active = True
-                else:
-                    for bh in business_hours_records:
-                        if bh.day_of_week == mid_point_local_bh.weekday():
-                            if bh.start_time_local <= bh.end_time_local:
-                                if bh.start_time_local <= mid_point_local_bh.time() < bh.end_time_local:
-                                    is_bh_segment_active = True; break
-                            else: 
-                                if mid_point_local_bh.time() >= bh.start_time_local or mid_point_local_bh.time() < bh.end_time_local:
-                                    is_bh_segment_active = True; break
-                if is_bh_segment_active:
-                    temp_total_business_seconds += duration_seconds_bh
-                temp_cursor_utc_bh_calc = actual_next_utc_bh
-            
-            total_business_seconds_in_period = temp_total_business_seconds
-            observed_uptime_seconds = total_business_seconds_in_period
-        else: 
-            status_polls.sort(key=lambda x: x.timestamp_utc)
-            
-   
-            all_relevant_intervals = []
-
-
-            first_poll_ts_utc = status_polls[0].timestamp_utc.replace(tzinfo=pytz.utc)
-            if start_utc_calc < first_poll_ts_utc:
-                all_relevant_intervals.append({
-                    "start": start_utc_calc, 
-                    "end": first_poll_ts_utc, 
-                    "status": status_polls[0].status
-                })
-
-         
-            for i in range(len(status_polls) - 1):
-                current_poll = status_polls[i]
-                next_poll = status_polls[i+1]
-                current_poll_ts_utc = current_poll.timestamp_utc.replace(tzinfo=pytz.utc)
-                next_poll_ts_utc = next_poll.timestamp_utc.replace(tzinfo=pytz.utc)
-                all_relevant_intervals.append({
-                    "start": current_poll_ts_utc, 
-                    "end": next_poll_ts_utc, 
-                    "status": current_poll.status
-                })
-            
-            
-            last_poll = status_polls[-1]
-            last_poll_ts_utc = last_poll.timestamp_utc.replace(tzinfo=pytz.utc)
-            if last_poll_ts_utc < end_utc_calc:
-                 all_relevant_intervals.append({
-                    "start": last_poll_ts_utc, 
-                    "end": end_utc_calc, 
-                    "status": last_poll.status
-                })
-            elif not all_relevant_intervals and last_poll_ts_utc >= start_utc_calc: 
-                 all_relevant_intervals.append({
-                    "start": max(start_utc_calc, last_poll_ts_utc),
-                    "end": end_utc_calc, 
-                    "status": last_poll.status
-                })
-
-
-
-            for interval in all_relevant_intervals:
-                effective_interval_start = max(interval["start"], start_utc_calc)
-                effective_interval_end = min(interval["end"], end_utc_calc)
-
-                if effective_interval_start >= effective_interval_end: continue
-
-                temp_cursor_utc = effective_interval_start
-                while temp_cursor_utc < effective_interval_end:
-                    next_minute_utc = temp_cursor_utc + timedelta(minutes=1)
-                    actual_next_utc = min(next_minute_utc, effective_interval_end)
-                    duration_seconds = (actual_next_utc - temp_cursor_utc).total_seconds()
-                    if duration_seconds <= 0: break
-
-                    mid_point_utc = temp_cursor_utc + timedelta(seconds=duration_seconds / 2)
-                    mid_point_local = mid_point_utc.astimezone(store_tz)
-                    
-                    is_bh_segment = False
-                    if is_always_open:
-                        is_bh_segment = True
-                    else:
-                        for bh in business_hours_records:
-                            if bh.day_of_week == mid_point_local.weekday():
-                                if bh.start_time_local <= bh.end_time_local:
-                                    if bh.start_time_local <= mid_point_local.time() < bh.end_time_local:
-                                        is_bh_segment = True; break
-                                else: 
-                                    if mid_point_local.time() >= bh.start_time_local or mid_point_local.time() < bh.end_time_local:
-                                        is_bh_segment = True; break
-                    
-                    if is_bh_segment:
-       
-                        if interval["status"] == "active":
-                            observed_uptime_seconds += duration_seconds
-                    
-                    temp_cursor_utc = actual_next_utc
-            
-    
-            current_total_business_seconds = 0
-            temp_cursor_utc_total_bh = start_utc_calc
-            while temp_cursor_utc_total_bh < end_utc_calc:
-                next_minute_utc_total_bh = temp_cursor_utc_total_bh + timedelta(minutes=1)
-                actual_next_utc_total_bh = min(next_minute_utc_total_bh, end_utc_calc)
-                duration_seconds_total_bh = (actual_next_utc_total_bh - temp_cursor_utc_total_bh).total_seconds()
-                if duration_seconds_total_bh <= 0: break
-
-                mid_point_utc_total_bh = temp_cursor_utc_total_bh + timedelta(seconds=duration_seconds_total_bh / 2)
-                mid_point_local_total_bh = mid_point_utc_total_bh.astimezone(store_tz)
-                is_bh_segment_total = False
-                if is_always_open:
-                    is_bh_segment_total = True
-                else:
-                    for bh in business_hours_records:
-                        if bh.day_of_week == mid_point_local_total_bh.weekday():
-                            if bh.start_time_local <= bh.end_time_local:
-                                if bh.start_time_local <= mid_point_local_total_bh.time() < bh.end_time_local:
-                                    is_bh_segment_total = True; break
-                            else:
-                                if mid_point_local_total_bh.time() >= bh.start_time_local or mid_point_local_total_bh.time() < bh.end_time_local:
-                                    is_bh_segment_total = True; break
-                if is_bh_segment_total:
-                    current_total_business_seconds += duration_seconds_total_bh
-                temp_cursor_utc_total_bh = actual_next_utc_total_bh
-            total_business_seconds_in_period = current_total_business_seconds
-
-
-        if total_business_seconds_in_period > 0:
-            uptime_for_period = observed_uptime_seconds
-            uptime_for_period = min(uptime_for_period, total_business_seconds_in_period)
-            downtime_for_period = total_business_seconds_in_period - uptime_for_period
-        else: 
+    # Preloaded slices (see preload_store_data) skip the per-store queries entirely.
+    # status_polls must cover the widest window and be ordered by timestamp_utc.
+    started = time_module.perf_counter()
+    store_tz_str = timezone_str if timezone_str is not None else crud.get_store_timezone_str(db, store_id)
+    if business_hours_records is None:
+        business_hours_records = crud.get_business_hours_for_store(db, store_id)
+
+    horizon_start_utc = current_utc_dt - max(window.duration for window in windows)
+    if status_polls is None:
+        status_polls = crud.get_store_status_in_window(db, store_id, horizon_start_utc, current_utc_dt)
+
+    business_time_before = compile_schedule(
+        store_id, store_tz_str, business_hours_records, horizon_start_utc, current_utc_dt
+    ).business_time_before
+
+    poll_times = [poll.timestamp_utc.replace(tzinfo=pytz.utc) for poll in status_polls]
+
+    # One sweep over the polls: poll i holds its status until poll i + 1 (the last one until
+    # current_utc_dt). uptime_from[i] is the business uptime from poll i to the end, which every
+    # window starting at or before poll i shares.
+    uptime_from = [timedelta(0)] * (len(status_polls) + 1)
+    segment_end_business = business_time_before(current_utc_dt)
+    for i in range(len(status_polls) - 1, -1, -1):
+        segment_start_business = business_time_before(poll_times[i])
+        uptime_from[i] = uptime_from[i + 1]
+        if status_polls[i].status == "active":
+            uptime_from[i] += segment_end_business - segment_start_business
+        segment_end_business = segment_start_business
+
+    window_timings = []
+    window_seconds = []
+    window_started = time_module.perf_counter()
+    metrics.observe("store_sweep_seconds", window_started - started)
+    for window in windows:
+        start_utc = current_utc_dt - window.duration
+        start_business = business_time_before(start_utc)
+        total_business_seconds = (business_time_before(current_utc_dt) - start_business).total_seconds()
+
+        first_poll = bisect.bisect_left(poll_times, start_utc)
+        if first_poll == len(status_polls):
+            # No polls inside the window: the store is assumed up for all of it.
+            observed_uptime_seconds = total_business_seconds
+        else:
+            observed_uptime = uptime_from[first_poll]
+            if status_polls[first_poll].status == "active":
+                # The first poll in the window also speaks for the time before it.
+                observed_uptime += business_time_before(poll_times[first_poll]) - start_business
+            observed_uptime_seconds = observed_uptime.total_seconds()
+        window_seconds.append((observed_uptime_seconds, total_business_seconds))
+        window_ended = time_module.perf_counter()
+        window_timings.append((window.name, window_ended - window_started))
+        window_started = window_ended
+
+    for window_name, elapsed in window_timings:
+        metrics.observe("store_window_compute_seconds", elapsed, window=window_name)
+    return build_store_result(store_id, windows, window_seconds)
+
+
+def build_store_result(store_id: str, windows, window_seconds):
+    # window_seconds holds (observed uptime, business time) in seconds for each window.
+    uptime = {}
+    downtime = {}
+    for window, (observed_uptime_seconds, total_business_seconds) in zip(windows, window_seconds):
+        if total_business_seconds > 0:
+            uptime_for_period = min(observed_uptime_seconds, total_business_seconds)
+            downtime_for_period = total_business_seconds - uptime_for_period
+        else:
             uptime_for_period = 0
             downtime_for_period = 0
 
-        if period_name == "hour":
-            uptime_last_hour = uptime_for_period / 60  
-            downtime_last_hour = downtime_for_period / 60 
-        elif period_name == "day":
-            uptime_last_day = uptime_for_period / 3600  
-            downtime_last_day = downtime_for_period / 3600 
-        elif period_name == "week":
-            uptime_last_week = uptime_for_period / 3600  
-            downtime_last_week = downtime_for_period / 3600 
-
-    return {
-        "store_id": store_id,
-        "uptime_last_hour": round(uptime_last_hour, 2),
-        "uptime_last_day": round(uptime_last_day, 2),
-        "uptime_last_week": round(uptime_last_week, 2),
-        "downtime_last_hour": round(downtime_last_hour, 2),
-        "downtime_last_day": round(downtime_last_day, 2),
-        "downtime_last_week": round(downtime_last_week, 2),
-    }
-
-
-def generate_report_logic(report_id: str, reports_dir: str, report_status_dict: dict, current_timestamp_str: str):
-    db: Session = next(database.get_db())
+        uptime[window.name] = round(uptime_for_period / window.unit_seconds, 2)
+        downtime[window.name] = round(downtime_for_period / window.unit_seconds, 2)
+
+    result = {"store_id": store_id}
+    for window in windows:
+        result[f"uptime_last_{window.name}"] = uptime[window.name]
+    for window in windows:
+        result[f"downtime_last_{window.name}"] = downtime[window.name]
+    return result
+
+
+def preload_store_data(db: Session, current_utc_dt: datetime, windows=DEFAULT_WINDOWS):
+    horizon_start_utc = current_utc_dt - max(window.duration for window in windows)
+    with metrics.timer("report_db_fetch_seconds"):
+        timezones = crud.get_all_store_timezones(db)
+        business_hours = crud.get_all_business_hours(db)
+        status_polls = crud.get_all_store_status_in_window(db, horizon_start_utc, current_utc_dt)
+    return timezones, business_hours, status_polls
+
+
+def _calculate_store_chunk(current_utc_dt, store_inputs):
+    return [
+        calculate_uptime_downtime(
+            store_id,
+            current_utc_dt,
+            timezone_str=timezone_str,
+            business_hours_records=business_hours_records,
+            status_polls=status_polls
+        )
+        for store_id, timezone_str, business_hours_records, status_polls in store_inputs
+    ]
+
+
+def _calculate_store_chunk_in_worker(current_utc_dt, store_inputs):
+    # Pool workers send their metrics back with the results, since they live in another process.
+    results = _calculate_store_chunk(current_utc_dt, store_inputs)
+    return results, metrics.drain()
+
+
+def calculate_fleet(store_ids, current_utc_dt, timezones, business_hours, status_polls,
+                    workers: int = None, chunk_size: int = None):
+    # Yields one result per store, in the order of store_ids.
+    workers = workers or REPORT_WORKERS
+    chunk_size = chunk_size or REPORT_CHUNK_SIZE
+    store_inputs = [
+        (store_id, timezones.get(store_id, crud.DEFAULT_TIMEZONE), business_hours.get(store_id, []), status_polls.get(store_id, []))
+        for store_id in store_ids
+    ]
+    chunks = [store_inputs[i:i + chunk_size] for i in range(0, len(store_inputs), chunk_size)]
+
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from _calculate_store_chunk(current_utc_dt, chunk)
+        return
+
+    # Workers only see preloaded slices, never a DB session. "spawn" keeps them clear of the
+    # locks and connections held by the server's threads.
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=multiprocessing.get_context("spawn")) as executor:
+        for results, worker_metrics in executor.map(partial(_calculate_store_chunk_in_worker, current_utc_dt), chunks):
+            metrics.merge(worker_metrics)
+            yield from results
+
+
+def compute_report_rows(db: Session, store_ids, current_utc_dt: datetime, engine: str = None,
+                        workers: int = None, chunk_size: int = None):
+    engine = engine or REPORT_ENGINE
+    if engine not in REPORT_ENGINES:
+        raise ValueError(f"Unknown report engine '{engine}', expected one of {REPORT_ENGINES}")
+
+    if engine == "rollup":
+        # Whole hours come from store_hourly_rollup, so only the edge hours of raw polls are read.
+        from .rollup import calculate_fleet_from_rollup, ensure_hourly_rollup
+        ensure_hourly_rollup(db)
+        with metrics.timer("report_db_fetch_seconds"):
+            timezones = crud.get_all_store_timezones(db)
+            business_hours = crud.get_all_business_hours(db)
+        return calculate_fleet_from_rollup(db, store_ids, current_utc_dt, timezones, business_hours)
+
+    if engine == "runs":
+        # Polls are rebuilt from the edges of store_status_run plus the most recent raw polls, and fed
+        # to the same per-store computation as the python engine.
+        from .runs import ensure_status_runs, run_status_polls
+        ensure_status_runs(db)
+        horizon_start_utc = current_utc_dt - max(window.duration for window in DEFAULT_WINDOWS)
+        with metrics.timer("report_db_fetch_seconds"):
+            timezones = crud.get_all_store_timezones(db)
+            business_hours = crud.get_all_business_hours(db)
+            status_polls = run_status_polls(db, current_utc_dt, horizon_start_utc)
+        return calculate_fleet(
+            store_ids, current_utc_dt, timezones, business_hours, status_polls, workers=workers, chunk_size=chunk_size
+        )
+
+    if engine == "numpy":
+        from .snapshot import load_store_status_snapshot, snapshot_poll_arrays
+        from .vectorized import calculate_fleet_vectorized
+        snapshot = load_store_status_snapshot(crud.get_data_version(db))
+        if snapshot is not None:
+            # A snapshot taken at the current data version is memory-mapped instead of querying polls.
+            horizon_start_utc = current_utc_dt - max(window.duration for window in DEFAULT_WINDOWS)
+            with metrics.timer("report_db_fetch_seconds"):
+                timezones = crud.get_all_store_timezones(db)
+                business_hours = crud.get_all_business_hours(db)
+                poll_arrays = snapshot_poll_arrays(snapshot, store_ids, horizon_start_utc, current_utc_dt)
+            return calculate_fleet_vectorized(
+                store_ids, current_utc_dt, timezones, business_hours, {}, poll_arrays=poll_arrays
+            )
+        timezones, business_hours, status_polls = preload_store_data(db, current_utc_dt)
+        return calculate_fleet_vectorized(store_ids, current_utc_dt, timezones, business_hours, status_polls)
+
+    timezones, business_hours, status_polls = preload_store_data(db, current_utc_dt)
+    return calculate_fleet(
+        store_ids, current_utc_dt, timezones, business_hours, status_polls, workers=workers, chunk_size=chunk_size
+    )
+
+
+def parse_timestamp_str(timestamp_str: str) -> datetime:
+    # Parses the "%Y-%m-%d %H:%M:%S[.%f] UTC" strings returned by crud.get_max_timestamp.
+    ts_str_cleaned = timestamp_str.replace(" UTC", "")
     try:
-        crud.create_report_entry(db, report_id) 
-
-        ts_str_cleaned = current_timestamp_str.replace(" UTC", "")
-        try:
-            current_utc_dt = datetime.strptime(ts_str_cleaned, '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            current_utc_dt = datetime.strptime(ts_str_cleaned, '%Y-%m-%d %H:%M:%S')
-        
-        current_utc_dt = pytz.utc.localize(current_utc_dt) 
-
-        all_store_ids = crud.get_all_store_ids(db)
-        if not all_store_ids:
-            print("No store IDs found in the database. Report will be empty.")
-            report_file_path = os.path.join(reports_dir, f"{report_id}.csv")
-            fieldnames = [
-                "store_id", "uptime_last_hour", "uptime_last_day", "uptime_last_week",
-                "downtime_last_hour", "downtime_last_day", "downtime_last_week"
-            ]
-            with open(report_file_path, 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-            report_status_dict[report_id] = "Complete"
-            crud.update_report_status(db, report_id, "Complete", report_file_path)
-            return
-            
-        report_data_list = []
-
-        for store_id in all_store_ids:
-            data = calculate_uptime_downtime(store_id, current_utc_dt, db)
-            report_data_list.append(data)
-        
-        crud.save_report_data(db, report_id, report_data_list)
-
-        report_file_path = os.path.join(reports_dir, f"{report_id}.csv")
-        fieldnames = [
-            "store_id", "uptime_last_hour", "uptime_last_day", "uptime_last_week",
-            "downtime_last_hour", "downtime_last_day", "downtime_last_week"
-        ]
-        with open(report_file_path, 'w', newline='') as csvfile:
+        parsed = datetime.strptime(ts_str_cleaned, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError:
+        parsed = datetime.strptime(ts_str_cleaned, '%Y-%m-%d %H:%M:%S')
+    return pytz.utc.localize(parsed)
+
+
+def report_cache_key(max_timestamp_str: str, data_version: int, engine: str = None) -> str:
+    return f"{max_timestamp_str}|data-v{data_version}|{engine or REPORT_ENGINE}-v{REPORT_ENGINE_VERSION}"
+
+
+def evict_old_reports(db: Session, reports_dir: str, keep: int = None) -> int:
+    keep = REPORT_CACHE_SIZE if keep is None else keep
+    evicted = crud.evict_reports(db, keep)
+    for report_id, file_path in evicted:
+        for extension in REPORT_FILE_EXTENSIONS:
+            path = os.path.join(reports_dir, f"{report_id}.{extension}")
+            if os.path.exists(path):
+                os.remove(path)
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+    # Files left behind by reports whose rows are gone, e.g. after clear_data. Report ids have no dots,
+    # and files still being written end in .tmp, so they are left alone.
+    known_report_ids = crud.get_report_ids(db)
+    for file_name in os.listdir(reports_dir):
+        report_id, _, extension = file_name.partition(".")
+        if extension in REPORT_FILE_EXTENSIONS and report_id not in known_report_ids:
+            os.remove(os.path.join(reports_dir, file_name))
+    if evicted:
+        print(f"Evicted {len(evicted)} old reports")
+    return len(evicted)
+
+
+class ParquetRowWriter:
+    # Buffers rows and writes them out as Parquet row groups, so the file grows while rows stream in.
+
+    def __init__(self, file_path: str, fieldnames, row_group_size: int = PARQUET_ROW_GROUP_SIZE):
+        self.schema = pyarrow.schema([
+            (name, pyarrow.string() if name == "store_id" else pyarrow.float64()) for name in fieldnames
+        ])
+        self.row_group_size = row_group_size
+        self._rows = []
+        self._writer = pyarrow.parquet.ParquetWriter(file_path, self.schema)
+
+    def writerow(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._writer.write_table(pyarrow.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+def _open_report_file(report_file_path: str, temp_file_path: str):
+    # A .gz report is gzip-compressed as it is written, so it can be served to clients as is.
+    if report_file_path.endswith(".gz"):
+        return gzip.open(temp_file_path, 'wt', newline='', compresslevel=REPORT_GZIP_LEVEL)
+    return open(temp_file_path, 'w', newline='')
+
+
+def _write_rows(writers, report_rows, timings: dict):
+    # Time spent waiting on report_rows is compute; time between yields is the report_data insert.
+    resumed = time_module.perf_counter()
+    for row in report_rows:
+        computed = time_module.perf_counter()
+        timings["compute"] += computed - resumed
+        for writer in writers:
+            writer.writerow(row)
+        written = time_module.perf_counter()
+        timings["csv"] += written - computed
+        timings["rows"] += 1
+        yield row
+        resumed = time_module.perf_counter()
+        timings["save"] += resumed - written
+
+
+def write_report(db: Session, report_id: str, report_rows, report_file_path: str, windows=DEFAULT_WINDOWS,
+                 parquet_file_path: str = None) -> int:
+    # Each row goes to the CSV, the optional Parquet file and the ReportData batch as soon as it is
+    # computed, so memory stays flat. Files are built under temporary names and renamed into place,
+    # so readers never see a partial file.
+    fieldnames = report_fieldnames(windows)
+    temp_paths = {report_file_path: f"{report_file_path}.tmp"}
+    if parquet_file_path:
+        temp_paths[parquet_file_path] = f"{parquet_file_path}.tmp"
+    timings = {"compute": 0.0, "csv": 0.0, "save": 0.0, "rows": 0}
+    started = time_module.perf_counter()
+    parquet_writer = None
+    try:
+        with _open_report_file(report_file_path, temp_paths[report_file_path]) as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
-            for row_data in report_data_list:
-                writer.writerow(row_data)
-        
-        report_status_dict[report_id] = "Complete"
+            writers = [writer]
+            if parquet_file_path:
+                parquet_writer = ParquetRowWriter(temp_paths[parquet_file_path], fieldnames)
+                writers.append(parquet_writer)
+            row_count = crud.save_report_data(db, report_id, _write_rows(writers, report_rows, timings))
+            if parquet_writer:
+                parquet_writer.close()
+                parquet_writer = None
+        for final_path, temp_file_path in temp_paths.items():
+            os.replace(temp_file_path, final_path)
+    finally:
+        if parquet_writer:
+            parquet_writer.close()
+        for temp_file_path in temp_paths.values():
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+    # The final batch is inserted after the last row is handed over.
+    timings["save"] += time_module.perf_counter() - started - timings["compute"] - timings["csv"] - timings["save"]
+    metrics.observe("report_compute_seconds", timings["compute"])
+    metrics.observe("report_csv_write_seconds", timings["csv"])
+    metrics.observe("report_save_data_seconds", timings["save"])
+    metrics.inc("report_stores_total", timings["rows"])
+    if timings["compute"] > 0:
+        metrics.set_gauge("report_stores_per_second", round(timings["rows"] / timings["compute"], 1))
+    return row_count
+
+
+def generate_report_logic(report_id: str, reports_dir: str, current_timestamp_str: str,
+                          workers: int = None, chunk_size: int = None, engine: str = None, cache_key: str = None):
+    db: Session = next(database.get_db())
+    engine = engine or REPORT_ENGINE
+    started = time_module.perf_counter()
+    try:
+        # The API creates the entry when the report is triggered, so every worker can see it right away.
+        if crud.get_report(db, report_id) is None:
+            crud.create_report_entry(db, report_id, cache_key)
+        crud.mark_report_started(db, report_id)
+
+        current_utc_dt = parse_timestamp_str(current_timestamp_str)
+
+        from .continuous import CONTINUOUS_REPORTING, current_latest_rows
+        latest_rows = current_latest_rows(db, current_utc_dt) if CONTINUOUS_REPORTING else None
+        all_store_ids = crud.get_all_store_ids(db) if latest_rows is None else None
+        if latest_rows is not None:
+            # The continuously maintained latest report is already at this as-of time and data version.
+            report_rows = latest_rows
+        elif not all_store_ids:
+            print("No store IDs found in the database. Report will be empty.")
+            report_rows = iter(())
+        else:
+            report_rows = compute_report_rows(
+                db, all_store_ids, current_utc_dt, engine=engine, workers=workers, chunk_size=chunk_size
+            )
+
+        report_file_path = os.path.join(reports_dir, f"{report_id}.csv.gz")
+        parquet_file_path = None
+        if REPORT_PARQUET:
+            if pyarrow is None:
+                print("REPORT_PARQUET is set but pyarrow is not installed; writing the CSV only.")
+            else:
+                parquet_file_path = os.path.join(reports_dir, f"{report_id}.parquet")
+        write_report(db, report_id, report_rows, report_file_path, parquet_file_path=parquet_file_path)
+
         crud.update_report_status(db, report_id, "Complete", report_file_path)
+        metrics.inc("report_runs_total", engine=engine, outcome="complete")
+        metrics.observe("report_seconds", time_module.perf_counter() - started, engine=engine)
+        evict_old_reports(db, reports_dir)
 
     except Exception as e:
         print(f"Error generating report {report_id}: {e}") 
         import traceback
         traceback.print_exc()
-        report_status_dict[report_id] = "Error"
+        db.rollback()
+        crud.delete_report_data(db, report_id)
         crud.update_report_status(db, report_id, "Error")
+        metrics.inc("report_runs_total", engine=engine, outcome="error")
     finally:
         db.close()
 
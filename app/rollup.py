@@ -0,0 +1,305 @@
+import os
+import pytz
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from . import crud, models
+from .report_generation import DEFAULT_WINDOWS, REPORT_ENGINE, build_store_result
+from .schedule import compile_schedule
+
+HOUR = timedelta(hours=1)
+ROLLUP_COMMIT_EVERY = 500
+# Refresh store_hourly_rollup on every ingest. At about one poll an hour the rollup has as many rows as the
+# polls it replaces, so it is only maintained by default when the rollup engine is the one in use.
+HOURLY_ROLLUP = os.getenv("HOURLY_ROLLUP", "true" if REPORT_ENGINE == "rollup" else "false").lower() in ("1", "true", "yes")
+
+# One row per store per UTC hour, from the hour of the store's first poll to the hour of its last.
+# Each poll holds its status until the next one (the last one indefinitely); uptime_seconds is the
+# business time covered by "active" polls inside the hour. start_status/end_status are the statuses
+# in effect when the hour begins and ends, and first_poll_utc/first_status describe the first poll
+# inside the hour, which is what a report needs to stitch a window together from rows alone.
+
+
+def floor_hour(instant: datetime) -> datetime:
+    return instant.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(instant: datetime) -> datetime:
+    floored = floor_hour(instant)
+    return floored if floored == instant else floored + HOUR
+
+
+def _as_utc(naive_utc: datetime) -> datetime:
+    return naive_utc.replace(tzinfo=pytz.utc)
+
+
+def compute_store_rollup_rows(store_id: str, polls, start_status, first_hour: datetime, business_time_before):
+    # polls are ordered and none is earlier than first_hour; start_status is the status in effect
+    # just before first_hour (None if the store had no earlier poll).
+    rows = []
+    if not polls:
+        return rows
+    last_hour = floor_hour(_as_utc(polls[-1].timestamp_utc))
+
+    status = start_status
+    i = 0
+    hour = first_hour
+    while hour <= last_hour:
+        hour_end = hour + HOUR
+        row_start_status = status
+        first_poll = None
+        uptime = timedelta(0)
+        cursor = hour
+        while i < len(polls) and _as_utc(polls[i].timestamp_utc) < hour_end:
+            poll_time = _as_utc(polls[i].timestamp_utc)
+            if status == "active":
+                uptime += business_time_before(poll_time) - business_time_before(cursor)
+            if first_poll is None:
+                first_poll = polls[i]
+            status = polls[i].status
+            cursor = poll_time
+            i += 1
+        if status == "active":
+            uptime += business_time_before(hour_end) - business_time_before(cursor)
+
+        rows.append({
+            "store_id": store_id,
+            "hour_utc": hour.replace(tzinfo=None),
+            "business_seconds": (business_time_before(hour_end) - business_time_before(hour)).total_seconds(),
+            "uptime_seconds": uptime.total_seconds(),
+            "start_status": row_start_status,
+            "end_status": status,
+            "first_poll_utc": first_poll.timestamp_utc if first_poll is not None else None,
+            "first_status": first_poll.status if first_poll is not None else None,
+        })
+        hour = hour_end
+    return rows
+
+
+def refresh_store_rollup(db: Session, store_id: str, since: datetime, timezone_str: str, business_hours_records) -> int:
+    # Recomputes the hours affected by polls at or after `since` (naive UTC), or every hour when since is None.
+    # A new poll shortens the segment of the poll before it, so recomputation starts at that poll's hour.
+    StoreStatus = models.StoreStatus
+    Rollup = models.StoreHourlyRollup
+    start_status = None
+    if since is None:
+        first_hour = None
+        polls = db.query(StoreStatus.timestamp_utc, StoreStatus.status).\
+            filter(StoreStatus.store_id == store_id).\
+            order_by(StoreStatus.timestamp_utc).all()
+    else:
+        previous = db.query(StoreStatus.timestamp_utc).\
+            filter(StoreStatus.store_id == store_id).\
+            filter(StoreStatus.timestamp_utc < since).\
+            order_by(StoreStatus.timestamp_utc.desc()).first()
+        first_hour = floor_hour(previous.timestamp_utc if previous else since)
+        before = db.query(StoreStatus.status).\
+            filter(StoreStatus.store_id == store_id).\
+            filter(StoreStatus.timestamp_utc < first_hour).\
+            order_by(StoreStatus.timestamp_utc.desc()).first()
+        start_status = before.status if before else None
+        polls = db.query(StoreStatus.timestamp_utc, StoreStatus.status).\
+            filter(StoreStatus.store_id == store_id).\
+            filter(StoreStatus.timestamp_utc >= first_hour).\
+            order_by(StoreStatus.timestamp_utc).all()
+
+    delete_query = db.query(Rollup).filter(Rollup.store_id == store_id)
+    if first_hour is not None:
+        delete_query = delete_query.filter(Rollup.hour_utc >= first_hour)
+    delete_query.delete(synchronize_session=False)
+    if not polls:
+        return 0
+
+    if first_hour is None or start_status is None:
+        first_hour = floor_hour(polls[0].timestamp_utc)
+    first_hour = _as_utc(first_hour)
+    last_hour_end = floor_hour(_as_utc(polls[-1].timestamp_utc)) + HOUR
+    business_time_before = compile_schedule(
+        store_id, timezone_str, business_hours_records, first_hour, last_hour_end
+    ).business_time_before
+    rows = compute_store_rollup_rows(store_id, polls, start_status, first_hour, business_time_before)
+    if rows:
+        db.execute(Rollup.__table__.insert(), rows)
+    return len(rows)
+
+
+def refresh_hourly_rollup(db: Session, touched_stores: dict) -> int:
+    # touched_stores maps store_id -> earliest new poll (naive UTC), or None to rebuild the store.
+    if not touched_stores:
+        return 0
+    stores_with_polls = set(crud.get_all_store_ids(db))
+    timezones = crud.get_all_store_timezones(db)
+    business_hours = crud.get_all_business_hours(db)
+    refreshed_rows = 0
+    refreshed_stores = 0
+    for store_id, since in touched_stores.items():
+        if store_id not in stores_with_polls:
+            continue
+        refreshed_rows += refresh_store_rollup(
+            db,
+            store_id,
+            since,
+            timezones.get(store_id, crud.DEFAULT_TIMEZONE),
+            business_hours.get(store_id, [])
+        )
+        refreshed_stores += 1
+        if refreshed_stores % ROLLUP_COMMIT_EVERY == 0:
+            db.commit()
+    db.commit()
+    print(f"Refreshed {refreshed_rows} hourly rollup rows for {refreshed_stores} stores")
+    return refreshed_rows
+
+
+def rebuild_hourly_rollup(db: Session) -> int:
+    db.query(models.StoreHourlyRollup).delete(synchronize_session=False)
+    return refresh_hourly_rollup(db, {store_id: None for store_id in crud.get_all_store_ids(db)})
+
+
+def _set_rollup_version(db: Session, data_version: int):
+    state = db.query(models.HourlyRollupState).filter(models.HourlyRollupState.id == 1).first()
+    if state is None:
+        state = models.HourlyRollupState(id=1)
+        db.add(state)
+    state.data_version = data_version
+
+
+def rollup_is_current(db: Session) -> bool:
+    state = db.query(models.HourlyRollupState).filter(models.HourlyRollupState.id == 1).first()
+    return state is not None and state.data_version == crud.get_data_version(db)
+
+
+def refresh_hourly_rollup_after_ingest(db: Session, touched_stores: dict):
+    # Called before the ingest bumps the data version. Refreshing only the touched stores is enough when
+    # the rollup was current before this ingest; otherwise it is rebuilt.
+    if not HOURLY_ROLLUP:
+        return
+    if rollup_is_current(db):
+        refresh_hourly_rollup(db, touched_stores)
+    else:
+        rebuild_hourly_rollup(db)
+    _set_rollup_version(db, crud.get_data_version(db) + 1)
+
+
+def ensure_hourly_rollup(db: Session):
+    # The rollup engine reads store_hourly_rollup only once it reflects the current data.
+    if rollup_is_current(db):
+        return
+    print("store_hourly_rollup is behind the current data; rebuilding it")
+    rebuild_hourly_rollup(db)
+    _set_rollup_version(db, crud.get_data_version(db))
+    db.commit()
+
+
+def _window_seconds(start_utc, end_utc, business_time_before, left_polls, rollup_rows, right_polls):
+    # The window is split into a partial first hour and a partial last hour, computed from raw polls,
+    # and the whole hours in between, taken from rollup rows.
+    total_business_seconds = (business_time_before(end_utc) - business_time_before(start_utc)).total_seconds()
+    first_full_hour = ceil_hour(start_utc)
+    last_full_hour_end = floor_hour(end_utc)
+    left_end = min(first_full_hour, end_utc)
+    right_start = min(max(last_full_hour_end, first_full_hour), end_utc)
+
+    left = [poll for poll in left_polls if start_utc <= _as_utc(poll.timestamp_utc) < left_end]
+    right = [poll for poll in right_polls if right_start <= _as_utc(poll.timestamp_utc) <= end_utc]
+
+    # The first poll inside the window also speaks for the time before it.
+    first_poll = None
+    if left:
+        first_poll = (_as_utc(left[0].timestamp_utc), left[0].status)
+    else:
+        hour = first_full_hour
+        while hour < last_full_hour_end and first_poll is None:
+            row = rollup_rows.get(hour.replace(tzinfo=None))
+            if row is not None and row.first_poll_utc is not None:
+                first_poll = (_as_utc(row.first_poll_utc), row.first_status)
+            hour += HOUR
+        if first_poll is None and right:
+            first_poll = (_as_utc(right[0].timestamp_utc), right[0].status)
+    if first_poll is None:
+        # No polls inside the window: the store is assumed up for all of it.
+        return total_business_seconds, total_business_seconds
+    first_poll_time, first_status = first_poll
+
+    def business_between(a, b):
+        return business_time_before(b) - business_time_before(a)
+
+    uptime = timedelta(0)
+    status = first_status
+    cursor = start_utc
+    for poll in left:
+        poll_time = _as_utc(poll.timestamp_utc)
+        if status == "active":
+            uptime += business_between(cursor, poll_time)
+        status = poll.status
+        cursor = poll_time
+    if status == "active":
+        uptime += business_between(cursor, left_end)
+
+    hour = first_full_hour
+    while hour < last_full_hour_end:
+        hour_end = hour + HOUR
+        row = rollup_rows.get(hour.replace(tzinfo=None))
+        if hour_end <= first_poll_time:
+            if status == "active":
+                uptime += business_between(hour, hour_end)
+        elif hour <= first_poll_time:
+            # The row carried its start status up to the first poll; this window uses the first poll's instead.
+            before_first_poll = business_between(hour, first_poll_time)
+            uptime += timedelta(seconds=row.uptime_seconds)
+            if row.start_status == "active":
+                uptime -= before_first_poll
+            if first_status == "active":
+                uptime += before_first_poll
+            status = row.end_status
+        elif row is not None:
+            uptime += timedelta(seconds=row.uptime_seconds)
+            status = row.end_status
+        elif status == "active":
+            # Past the store's last poll, which keeps holding its status.
+            uptime += business_between(hour, hour_end)
+        hour = hour_end
+
+    cursor = right_start
+    for poll in right:
+        poll_time = _as_utc(poll.timestamp_utc)
+        if status == "active":
+            uptime += business_between(cursor, poll_time)
+        status = poll.status
+        cursor = poll_time
+    if status == "active":
+        uptime += business_between(cursor, end_utc)
+
+    return uptime.total_seconds(), total_business_seconds
+
+
+def calculate_fleet_from_rollup(db: Session, store_ids, current_utc_dt: datetime, timezones, business_hours,
+                                windows=DEFAULT_WINDOWS):
+    horizon_start_utc = current_utc_dt - max(window.duration for window in windows)
+    last_full_hour_end = floor_hour(current_utc_dt)
+
+    rollup_rows = crud.get_hourly_rollup_in_window(db, ceil_hour(horizon_start_utc), last_full_hour_end)
+    right_polls = crud.get_all_store_status_in_window(db, last_full_hour_end, current_utc_dt)
+    left_polls = []
+    for window in windows:
+        start_utc = current_utc_dt - window.duration
+        left_polls.append(crud.get_all_store_status_in_window(db, start_utc, min(ceil_hour(start_utc), current_utc_dt)))
+
+    for store_id in store_ids:
+        business_time_before = compile_schedule(
+            store_id,
+            timezones.get(store_id, crud.DEFAULT_TIMEZONE),
+            business_hours.get(store_id, []),
+            horizon_start_utc,
+            current_utc_dt
+        ).business_time_before
+        window_seconds = [
+            _window_seconds(
+                current_utc_dt - window.duration,
+                current_utc_dt,
+                business_time_before,
+                window_left_polls.get(store_id, []),
+                rollup_rows.get(store_id, {}),
+                right_polls.get(store_id, [])
+            )
+            for window, window_left_polls in zip(windows, left_polls)
+        ]
+        yield build_store_result(store_id, windows, window_seconds)
@@ -0,0 +1,139 @@
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from . import crud, models
+from .report_generation import REPORT_ENGINE
+
+# A run ends where the status changes or where two polls are more than RUN_MAX_GAP apart. Inside a
+# run every stretch of RUN_MAX_GAP holds a poll, which is what lets a report rebuild exact results from
+# run edges plus the raw polls of the last RUN_MAX_GAP (see run_status_polls). Changing it requires
+# rebuild_status_runs.
+RUN_MAX_GAP = timedelta(hours=2)
+RUNS_COMMIT_EVERY = 500
+# Refresh store_status_run on every poll ingest. Only the runs engine reads the table, so it is only
+# maintained by default when that engine is the one in use.
+STATUS_RUNS = os.getenv("STATUS_RUNS", "true" if REPORT_ENGINE == "runs" else "false").lower() in ("1", "true", "yes")
+
+PollRow = namedtuple("PollRow", ["timestamp_utc", "status"])
+
+
+def compute_store_runs(store_id: str, polls):
+    # polls are ordered by timestamp_utc.
+    rows = []
+    for poll in polls:
+        current = rows[-1] if rows else None
+        if current is not None and current["status"] == poll.status and \
+                poll.timestamp_utc - current["end_utc"] <= RUN_MAX_GAP:
+            current["end_utc"] = poll.timestamp_utc
+            current["poll_count"] += 1
+        else:
+            rows.append({
+                "store_id": store_id,
+                "start_utc": poll.timestamp_utc,
+                "end_utc": poll.timestamp_utc,
+                "status": poll.status,
+                "poll_count": 1,
+            })
+    return rows
+
+
+def refresh_store_runs(db: Session, store_id: str, since: datetime) -> int:
+    # Recomputes the runs affected by polls at or after `since` (naive UTC), or all of them when since is None.
+    # A new poll can extend or split the last run that starts before it, so recomputation starts there.
+    StoreStatus = models.StoreStatus
+    Run = models.StoreStatusRun
+    restart = None
+    if since is not None:
+        previous = db.query(Run.start_utc).\
+            filter(Run.store_id == store_id).\
+            filter(Run.start_utc < since).\
+            order_by(Run.start_utc.desc()).first()
+        restart = previous.start_utc if previous else None
+
+    polls_query = db.query(StoreStatus.timestamp_utc, StoreStatus.status).filter(StoreStatus.store_id == store_id)
+    delete_query = db.query(Run).filter(Run.store_id == store_id)
+    if restart is not None:
+        polls_query = polls_query.filter(StoreStatus.timestamp_utc >= restart)
+        delete_query = delete_query.filter(Run.start_utc >= restart)
+    delete_query.delete(synchronize_session=False)
+    rows = compute_store_runs(store_id, polls_query.order_by(StoreStatus.timestamp_utc).all())
+    if rows:
+        db.execute(Run.__table__.insert(), rows)
+    return len(rows)
+
+
+def refresh_status_runs(db: Session, touched_stores: dict) -> int:
+    # touched_stores maps store_id -> earliest new poll (naive UTC), or None to rebuild the store.
+    refreshed_rows = 0
+    for refreshed_stores, (store_id, since) in enumerate(touched_stores.items(), 1):
+        refreshed_rows += refresh_store_runs(db, store_id, since)
+        if refreshed_stores % RUNS_COMMIT_EVERY == 0:
+            db.commit()
+    db.commit()
+    print(f"Refreshed {refreshed_rows} status runs for {len(touched_stores)} stores")
+    return refreshed_rows
+
+
+def rebuild_status_runs(db: Session) -> int:
+    db.query(models.StoreStatusRun).delete(synchronize_session=False)
+    return refresh_status_runs(db, {store_id: None for store_id in crud.get_all_store_ids(db)})
+
+
+def _set_runs_version(db: Session, data_version: int):
+    state = db.query(models.StatusRunsState).filter(models.StatusRunsState.id == 1).first()
+    if state is None:
+        state = models.StatusRunsState(id=1)
+        db.add(state)
+    state.data_version = data_version
+
+
+def status_runs_are_current(db: Session) -> bool:
+    state = db.query(models.StatusRunsState).filter(models.StatusRunsState.id == 1).first()
+    return state is not None and state.data_version == crud.get_data_version(db)
+
+
+def refresh_status_runs_after_ingest(db: Session, touched_stores: dict, polls_changed: bool):
+    # Called before the ingest bumps the data version. Runs only depend on polls, so an ingest of business
+    # hours or timezones leaves a current table current; otherwise it is rebuilt.
+    if not STATUS_RUNS:
+        return
+    if not status_runs_are_current(db):
+        rebuild_status_runs(db)
+    elif polls_changed:
+        refresh_status_runs(db, touched_stores)
+    _set_runs_version(db, crud.get_data_version(db) + 1)
+
+
+def ensure_status_runs(db: Session):
+    # The runs engine reads store_status_run only once it reflects the current data.
+    if status_runs_are_current(db):
+        return
+    print("store_status_run is behind the current data; rebuilding it")
+    rebuild_status_runs(db)
+    _set_runs_version(db, crud.get_data_version(db))
+    db.commit()
+
+
+def run_status_polls(db: Session, current_utc_dt: datetime, horizon_start_utc: datetime) -> dict:
+    # Per store, the polls calculate_uptime_downtime needs to reproduce its raw-poll results: the first
+    # and last poll of every run in the horizon, plus every raw poll of the last RUN_MAX_GAP. A window
+    # longer than RUN_MAX_GAP that sits inside a run contains one of those recent polls, and a shorter
+    # window sees all of its polls; interior polls elsewhere only repeat the status already in effect.
+    horizon_start = horizon_start_utc.replace(tzinfo=None)
+    current = current_utc_dt.replace(tzinfo=None)
+    polls_by_store = {}
+    for run in crud.get_all_status_runs_in_window(db, horizon_start_utc, current_utc_dt):
+        store_polls = polls_by_store.setdefault(run.store_id, {})
+        for edge in (run.start_utc, run.end_utc):
+            if horizon_start <= edge <= current:
+                store_polls[edge] = run.status
+    recent_start_utc = max(current_utc_dt - RUN_MAX_GAP, horizon_start_utc)
+    for store_id, polls in crud.get_all_store_status_in_window(db, recent_start_utc, current_utc_dt).items():
+        store_polls = polls_by_store.setdefault(store_id, {})
+        for poll in polls:
+            store_polls[poll.timestamp_utc] = poll.status
+    return {
+        store_id: [PollRow(timestamp_utc, status) for timestamp_utc, status in sorted(store_polls.items())]
+        for store_id, store_polls in polls_by_store.items()
+    }
@@ -0,0 +1,141 @@
+import bisect
+import os
+import pytz
+from collections import namedtuple
+from datetime import datetime, timedelta, time
+from functools import lru_cache
+from .tz_offsets import get_zone_offsets
+
+SCHEDULE_CACHE_SIZE = int(os.getenv("SCHEDULE_CACHE_SIZE", "65536"))
+WEEK = timedelta(weeks=1)
+
+# Stands in for a BusinessHours row inside the cache, where ORM objects can't be used as keys.
+BusinessHoursRow = namedtuple("BusinessHoursRow", ["day_of_week", "start_time_local", "end_time_local"])
+
+
+def get_utc_from_local_time(local_dt_naive, timezone_str):
+    return get_zone_offsets(timezone_str).to_utc(local_dt_naive)
+
+
+def _merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def get_business_intervals_utc(business_hours_records, timezone_str, start_utc, end_utc):
+    if start_utc >= end_utc:
+        return []
+    if not business_hours_records:
+        return [(start_utc, end_utc)]
+
+    zone_offsets = get_zone_offsets(timezone_str)
+    day = zone_offsets.to_local(start_utc).date() - timedelta(days=1)
+    last_day = zone_offsets.to_local(end_utc).date() + timedelta(days=1)
+
+    intervals = []
+    while day <= last_day:
+        day_start_local = datetime.combine(day, time.min)
+        next_day_start_local = day_start_local + timedelta(days=1)
+        for bh in business_hours_records:
+            if bh.day_of_week != day.weekday():
+                continue
+            open_local = datetime.combine(day, bh.start_time_local)
+            close_local = datetime.combine(day, bh.end_time_local)
+            if bh.start_time_local <= bh.end_time_local:
+                local_spans = [(open_local, close_local)]
+            else:
+                # Overnight rows cover the start and the end of their own local day.
+                local_spans = [(day_start_local, close_local), (open_local, next_day_start_local)]
+            for span_start_local, span_end_local in local_spans:
+                if span_start_local >= span_end_local:
+                    continue
+                span_start = max(zone_offsets.to_utc(span_start_local), start_utc)
+                span_end = min(zone_offsets.to_utc(span_end_local), end_utc)
+                if span_start < span_end:
+                    intervals.append((span_start, span_end))
+        day += timedelta(days=1)
+
+    return _merge_intervals(intervals)
+
+
+class BusinessSchedule:
+    # Sorted, non-overlapping UTC business intervals with a running total, so every lookup is a bisect.
+
+    def __init__(self, intervals):
+        self.intervals = intervals
+        self.starts = [interval_start for interval_start, _ in intervals]
+        self.cumulative = []
+        running_total = timedelta(0)
+        for interval_start, interval_end in intervals:
+            self.cumulative.append(running_total)
+            running_total += interval_end - interval_start
+
+    def business_time_before(self, instant):
+        k = bisect.bisect_right(self.starts, instant) - 1
+        if k < 0:
+            return timedelta(0)
+        interval_start, interval_end = self.intervals[k]
+        return self.cumulative[k] + (min(instant, interval_end) - interval_start)
+
+    def business_seconds(self, start_utc, end_utc):
+        if start_utc >= end_utc:
+            return 0.0
+        return (self.business_time_before(end_utc) - self.business_time_before(start_utc)).total_seconds()
+
+    def intersect(self, intervals):
+        result = []
+        for start_utc, end_utc in intervals:
+            k = max(bisect.bisect_right(self.starts, start_utc) - 1, 0)
+            while k < len(self.intervals) and self.intervals[k][0] < end_utc:
+                overlap_start = max(self.intervals[k][0], start_utc)
+                overlap_end = min(self.intervals[k][1], end_utc)
+                if overlap_start < overlap_end:
+                    result.append((overlap_start, overlap_end))
+                k += 1
+        return result
+
+
+def _week_start(instant_utc: datetime) -> datetime:
+    day = instant_utc.astimezone(pytz.utc).date()
+    return pytz.utc.localize(datetime.combine(day - timedelta(days=day.weekday()), datetime.min.time()))
+
+
+def _hours_key(business_hours_records):
+    return tuple(sorted(
+        (bh.day_of_week, bh.start_time_local, bh.end_time_local) for bh in business_hours_records
+    ))
+
+
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def _compiled_week(store_id: str, timezone_str: str, week_start: datetime, hours_key: tuple):
+    # store_id only scopes the entry; the hours themselves are part of the key, so a store whose
+    # business hours change after an ingest gets a fresh entry instead of a stale one.
+    records = [BusinessHoursRow(*hours) for hours in hours_key]
+    return tuple(get_business_intervals_utc(records, timezone_str, week_start, week_start + WEEK))
+
+
+def compile_schedule(store_id: str, timezone_str: str, business_hours_records, start_utc: datetime,
+                     end_utc: datetime) -> BusinessSchedule:
+    # Covers every UTC week (Monday 00:00) touched by [start_utc, end_utc), stitched from cached weeks.
+    hours_key = _hours_key(business_hours_records)
+    intervals = []
+    week_start = _week_start(start_utc)
+    while week_start < end_utc:
+        for interval_start, interval_end in _compiled_week(store_id, timezone_str, week_start, hours_key):
+            if intervals and intervals[-1][1] == interval_start:
+                # Hours that run across the week boundary.
+                intervals[-1] = (intervals[-1][0], interval_end)
+            else:
+                intervals.append((interval_start, interval_end))
+        week_start += WEEK
+    return BusinessSchedule(intervals)
+
+
+def clear_schedule_cache():
+    _compiled_week.cache_clear()
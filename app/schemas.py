@@ -21,3 +21,20 @@ class ReportResult(BaseModel):
     class Config:
         orm_mode = True
 
+class ReportStoresPage(BaseModel):
+    report_id: str
+    stores: List[ReportResult]
+    next_after: Optional[str] = None
+
+class StoreUptime(ReportResult):
+    as_of: datetime.datetime
+
+class UptimeRange(BaseModel):
+    start: datetime.datetime
+    end: datetime.datetime
+    uptime_seconds: float
+    downtime_seconds: float
+
+class StoreUptimeRanges(BaseModel):
+    store_id: str
+    ranges: List[UptimeRange]
@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+import numpy as np
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from . import crud, models
+from .vectorized import _to_microseconds
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_FETCH_SIZE = 100000
+# Segments a snapshot may grow to before the next write folds them back into one.
+SNAPSHOT_MAX_SEGMENTS = int(os.getenv("SNAPSHOT_MAX_SEGMENTS", "16"))
+
+# A snapshot is a manifest plus segments. Each segment is a directory holding the polls one write added:
+#   store_index.npy  int32, per poll, position in the manifest's store_ids
+#   timestamp_us.npy int64 epoch microseconds (the resolution stored in timestamp_utc), per poll
+#   active.npy       bool, per poll
+# grouped by store and in timestamp order within a store. manifest-v<data version>.json lists the
+# segments, the store ids in index order, the row count, the largest store_status id covered and the max
+# timestamp. Polls are only ever inserted, or all deleted by clear_data, so a write only has to append
+# the polls with a larger id. CURRENT names the manifest readers should open and is replaced atomically
+# once a write is complete.
+
+_CURRENT = "CURRENT"
+
+
+def _read_manifest(snapshot_dir: str):
+    try:
+        with open(os.path.join(snapshot_dir, _CURRENT)) as f:
+            manifest_name = f.read().strip()
+        with open(os.path.join(snapshot_dir, manifest_name)) as f:
+            return manifest_name, json.load(f)
+    except (OSError, ValueError):
+        return None, None
+
+
+def _write_segment(db: Session, path: str, after_id: int, max_id: int, store_ids: list) -> int:
+    # Writes the polls with after_id < id <= max_id and returns how many there were. Stores seen for the
+    # first time are appended to store_ids.
+    temp_path = f"{path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    StoreStatus = models.StoreStatus
+    new_polls = db.query(StoreStatus).filter(StoreStatus.id > after_id).filter(StoreStatus.id <= max_id)
+    row_count = new_polls.count()
+    store_index = np.lib.format.open_memmap(os.path.join(temp_path, "store_index.npy"), "w+", np.int32, (row_count,))
+    timestamp_us = np.lib.format.open_memmap(os.path.join(temp_path, "timestamp_us.npy"), "w+", np.int64, (row_count,))
+    active = np.lib.format.open_memmap(os.path.join(temp_path, "active.npy"), "w+", np.bool_, (row_count,))
+
+    position = {store_id: index for index, store_id in enumerate(store_ids)}
+    written = 0
+    rows = db.query(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status).\
+        filter(StoreStatus.id > after_id).filter(StoreStatus.id <= max_id).\
+        order_by(StoreStatus.store_id, StoreStatus.timestamp_utc).yield_per(SNAPSHOT_FETCH_SIZE)
+    batch = []
+
+    def flush():
+        nonlocal written
+        end = written + len(batch)
+        indexes = []
+        for row in batch:
+            index = position.get(row.store_id)
+            if index is None:
+                index = position[row.store_id] = len(store_ids)
+                store_ids.append(row.store_id)
+            indexes.append(index)
+        store_index[written:end] = indexes
+        timestamp_us[written:end] = _to_microseconds([row.timestamp_utc for row in batch])
+        active[written:end] = [row.status == "active" for row in batch]
+        written = end
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= SNAPSHOT_FETCH_SIZE:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    if written != row_count:
+        raise RuntimeError(f"store_status changed while the snapshot was written ({written} of {row_count} rows)")
+    for array in (store_index, timestamp_us, active):
+        array.flush()
+    del store_index, timestamp_us, active
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+    return written
+
+
+def write_store_status_snapshot(db: Session, snapshot_dir: str = None) -> str:
+    # Brings the snapshot up to the current data version and returns its manifest path. Nothing is written
+    # when it is already current, and only polls added since the previous write are read otherwise.
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+    data_version = crud.get_data_version(db)
+    manifest_name, manifest = _read_manifest(snapshot_dir)
+    if manifest is not None and manifest["data_version"] == data_version:
+        print(f"Store status snapshot is already at data version {data_version}")
+        return os.path.join(snapshot_dir, manifest_name)
+
+    StoreStatus = models.StoreStatus
+    max_id = db.query(func.max(StoreStatus.id)).scalar() or 0
+    append = (
+        manifest is not None
+        and manifest["data_version"] >= crud.get_cleared_version(db)
+        and len(manifest["segments"]) < SNAPSHOT_MAX_SEGMENTS
+        and manifest["max_id"] <= max_id
+        and db.query(StoreStatus).filter(StoreStatus.id <= manifest["max_id"]).count() == manifest["rows"]
+    )
+    if append:
+        segments, store_ids, after_id, rows = manifest["segments"], manifest["store_ids"], manifest["max_id"], manifest["rows"]
+    else:
+        segments, store_ids, after_id, rows = [], [], 0, 0
+
+    written = 0
+    if max_id > after_id:
+        segment_name = f"segment-v{data_version}"
+        written = _write_segment(db, os.path.join(snapshot_dir, segment_name), after_id, max_id, store_ids)
+        segments = segments + [segment_name]
+    manifest = {
+        "data_version": data_version,
+        "rows": rows + written,
+        "max_id": max_id,
+        "max_timestamp": crud.get_max_timestamp(db),
+        "segments": segments,
+        "store_ids": store_ids,
+    }
+    manifest_name = f"manifest-v{data_version}.json"
+    manifest_temp = os.path.join(snapshot_dir, f"{manifest_name}.tmp")
+    with open(manifest_temp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_temp, os.path.join(snapshot_dir, manifest_name))
+    current_temp = os.path.join(snapshot_dir, f"{_CURRENT}.tmp")
+    with open(current_temp, "w") as f:
+        f.write(manifest_name)
+    os.replace(current_temp, os.path.join(snapshot_dir, _CURRENT))
+
+    for entry in os.listdir(snapshot_dir):
+        entry_path = os.path.join(snapshot_dir, entry)
+        if os.path.isdir(entry_path) and entry not in segments:
+            shutil.rmtree(entry_path, ignore_errors=True)
+        elif entry.startswith("manifest-") and entry != manifest_name:
+            os.remove(entry_path)
+    action = "Appended" if append else "Wrote"
+    print(f"{action} {written} polls to store status snapshot {manifest_name} "
+          f"({manifest['rows']} polls, {len(store_ids)} stores, {len(segments)} segments)")
+    return os.path.join(snapshot_dir, manifest_name)
+
+
+def load_store_status_snapshot(data_version: int = None, snapshot_dir: str = None):
+    # Returns the manifest and the memory-mapped arrays of every segment, or None when there is no
+    # snapshot or it was taken at another data version than the one given.
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    _, manifest = _read_manifest(snapshot_dir)
+    if manifest is None or (data_version is not None and manifest["data_version"] != data_version):
+        return None
+    try:
+        segments = [
+            {
+                name: np.load(os.path.join(snapshot_dir, segment, f"{name}.npy"), mmap_mode="r")
+                for name in ("store_index", "timestamp_us", "active")
+            }
+            for segment in manifest["segments"]
+        ]
+        return {"meta": manifest, "store_ids": manifest["store_ids"], "segments": segments}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def snapshot_poll_arrays(snapshot, store_ids, start_utc: datetime, end_utc: datetime):
+    # Polls with timestamp_utc in [start_utc, end_utc], indexed by position in store_ids and sorted
+    # by (store index, timestamp); the shape calculate_fleet_vectorized expects.
+    start_us, end_us = _to_microseconds([start_utc.replace(tzinfo=None), end_utc.replace(tzinfo=None)])
+    position = {store_id: index for index, store_id in enumerate(store_ids)}
+    remap = np.array([position.get(store_id, -1) for store_id in snapshot["store_ids"]], dtype=np.int64)
+
+    poll_store, timestamps, active = [np.empty(0, np.int64)], [np.empty(0, np.int64)], [np.empty(0, bool)]
+    for segment in snapshot["segments"]:
+        timestamp_us = segment["timestamp_us"]
+        in_window = np.flatnonzero((timestamp_us >= start_us) & (timestamp_us <= end_us))
+        segment_store = remap[segment["store_index"][in_window]]
+        keep = segment_store >= 0
+        poll_store.append(segment_store[keep])
+        timestamps.append(np.asarray(timestamp_us[in_window[keep]]))
+        active.append(np.asarray(segment["active"][in_window[keep]]))
+    poll_store, timestamps, active = np.concatenate(poll_store), np.concatenate(timestamps), np.concatenate(active)
+    # A later segment can hold polls older than earlier ones of the same store, so sort on both keys.
+    order = np.lexsort((timestamps, poll_store))
+    return poll_store[order], timestamps[order], active[order]
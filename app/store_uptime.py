@@ -0,0 +1,120 @@
+import os
+import pytz
+from datetime import datetime
+from sqlalchemy.orm import Session
+from . import crud, metrics
+from .cache import TTLCache
+from .report_generation import DEFAULT_WINDOWS, calculate_uptime_downtime, parse_timestamp_str
+from .schedule import BusinessHoursRow
+from .uptime_index import UptimeIndex
+
+# Both caches are keyed by data version, so an ingest makes old entries unreachable rather than stale;
+# the TTL only bounds how long entries nobody asks for again stay in memory.
+STORE_UPTIME_CACHE_SIZE = int(os.getenv("STORE_UPTIME_CACHE_SIZE", "10000"))
+STORE_UPTIME_CACHE_TTL_SECONDS = float(os.getenv("STORE_UPTIME_CACHE_TTL_SECONDS", "3600"))
+UPTIME_INDEX_CACHE_SIZE = int(os.getenv("UPTIME_INDEX_CACHE_SIZE", "1000"))
+
+# (database url, store_id, data version) -> (timezone, business hours), or () for a store without polls
+_store_inputs = TTLCache(STORE_UPTIME_CACHE_TTL_SECONDS, STORE_UPTIME_CACHE_SIZE)
+# (database url, store_id, as-of, data version) -> result row
+_results = TTLCache(STORE_UPTIME_CACHE_TTL_SECONDS, STORE_UPTIME_CACHE_SIZE)
+# (database url, store_id, data version) -> UptimeIndex over all polls
+_indexes = TTLCache(STORE_UPTIME_CACHE_TTL_SECONDS, UPTIME_INDEX_CACHE_SIZE)
+
+
+def _get_store_inputs(db: Session, database_url: str, store_id: str, data_version: int):
+    key = (database_url, store_id, data_version)
+    cached = _store_inputs.get(key)
+    if cached is not None:
+        return cached or None
+    if not crud.store_has_polls(db, store_id):
+        _store_inputs.set(key, ())
+        return None
+    business_hours = [
+        BusinessHoursRow(row.day_of_week, row.start_time_local, row.end_time_local)
+        for row in crud.get_business_hours_for_store(db, store_id)
+    ]
+    inputs = (crud.get_store_timezone_str(db, store_id), business_hours)
+    _store_inputs.set(key, inputs)
+    return inputs
+
+
+def _to_utc(instant: datetime) -> datetime:
+    if instant.tzinfo is None:
+        return pytz.utc.localize(instant)
+    return instant.astimezone(pytz.utc)
+
+
+def get_store_uptime(db: Session, store_id: str, as_of: datetime = None):
+    # Returns (as_of, result row) for one store, or None when the store has no polls at all.
+    # as_of defaults to the newest poll, the time a triggered report would use.
+    database_url = str(db.get_bind().url)
+    data_version = crud.get_data_version(db)
+    if as_of is None:
+        max_timestamp_str = crud.get_max_timestamp_cached(db)
+        if not max_timestamp_str:
+            return None
+        as_of = parse_timestamp_str(max_timestamp_str)
+    else:
+        as_of = _to_utc(as_of)
+
+    key = (database_url, store_id, as_of, data_version)
+    result = _results.get(key)
+    if result is not None:
+        metrics.inc("store_uptime_lookups_total", cache="hit")
+        return as_of, result
+    metrics.inc("store_uptime_lookups_total", cache="miss")
+
+    inputs = _get_store_inputs(db, database_url, store_id, data_version)
+    if inputs is None:
+        return None
+    timezone_str, business_hours = inputs
+    horizon_start_utc = as_of - max(window.duration for window in DEFAULT_WINDOWS)
+    status_polls = crud.get_store_status_in_window(db, store_id, horizon_start_utc, as_of)
+    result = calculate_uptime_downtime(
+        store_id,
+        as_of,
+        timezone_str=timezone_str,
+        business_hours_records=business_hours,
+        status_polls=status_polls
+    )
+    _results.set(key, result)
+    return as_of, result
+
+
+def get_uptime_index(db: Session, store_id: str):
+    # Built once per store and data version over the whole span of stored polls; None for an unknown store.
+    database_url = str(db.get_bind().url)
+    data_version = crud.get_data_version(db)
+    key = (database_url, store_id, data_version)
+    index = _indexes.get(key)
+    if index is not None:
+        metrics.inc("uptime_index_lookups_total", cache="hit")
+        return index
+    metrics.inc("uptime_index_lookups_total", cache="miss")
+
+    inputs = _get_store_inputs(db, database_url, store_id, data_version)
+    if inputs is None:
+        return None
+    timezone_str, business_hours = inputs
+    with metrics.timer("uptime_index_build_seconds"):
+        first_timestamp, last_timestamp = (_to_utc(instant) for instant in crud.get_timestamp_range(db))
+        status_polls = crud.get_store_status_in_window(db, store_id, first_timestamp, last_timestamp)
+        index = UptimeIndex(store_id, timezone_str, business_hours, status_polls, first_timestamp, last_timestamp)
+    _indexes.set(key, index)
+    return index
+
+
+def get_uptime_for_ranges(db: Session, store_id: str, ranges):
+    # ranges holds (start, end) pairs; returns a list of (start, end, uptime seconds, downtime seconds)
+    # or None for an unknown store. Raises ValueError for a range outside the stored polls.
+    index = get_uptime_index(db, store_id)
+    if index is None:
+        return None
+    results = []
+    for start, end in ranges:
+        start, end = _to_utc(start), _to_utc(end)
+        observed_uptime_seconds, total_business_seconds = index.uptime_seconds(start, end)
+        uptime_seconds = min(observed_uptime_seconds, total_business_seconds)
+        results.append((start, end, round(uptime_seconds, 2), round(total_business_seconds - uptime_seconds, 2)))
+    return results
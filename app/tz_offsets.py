@@ -0,0 +1,58 @@
+import bisect
+import pytz
+from datetime import datetime, timedelta
+from functools import lru_cache
+from .crud import DEFAULT_TIMEZONE
+
+# A store's zone is consulted for every local day of every window, and a fleet has only a few dozen
+# distinct zones, so each zone's UTC-offset transitions are flattened into lists once per process.
+
+
+class ZoneOffsets:
+
+    def __init__(self, timezone_str: str, tz):
+        self.timezone_str = timezone_str
+        if hasattr(tz, "_utc_transition_times"):
+            self.transitions = list(tz._utc_transition_times)
+            self.offsets = [info[0] for info in tz._transition_info]
+            self.dst = [info[1] for info in tz._transition_info]
+        else:
+            self.transitions = [datetime.min]
+            self.offsets = [tz.utcoffset(None)]
+            self.dst = [timedelta(0)]
+
+    def _index(self, utc_naive: datetime) -> int:
+        return max(bisect.bisect_right(self.transitions, utc_naive) - 1, 0)
+
+    def to_local(self, utc_dt: datetime) -> datetime:
+        # Aware or naive UTC in, naive local wall-clock time out.
+        utc_naive = utc_dt.astimezone(pytz.utc).replace(tzinfo=None) if utc_dt.tzinfo else utc_dt
+        return utc_naive + self.offsets[self._index(utc_naive)]
+
+    def to_utc(self, local_naive: datetime) -> datetime:
+        # Ambiguous wall-clock times resolve to standard time, like pytz's is_dst=False; times skipped
+        # by a jump resolve to the transition instant, the first moment the clock reaches them.
+        k = self._index(local_naive)
+        candidates = []
+        for j in range(max(k - 2, 0), min(k + 3, len(self.transitions))):
+            utc_naive = local_naive - self.offsets[j]
+            if self._index(utc_naive) == j:
+                candidates.append((not self.dst[j], utc_naive))
+        if candidates:
+            return pytz.utc.localize(max(candidates)[1])
+        for j in range(max(k - 1, 1), min(k + 3, len(self.transitions))):
+            if local_naive - self.offsets[j] < self.transitions[j] <= local_naive - self.offsets[j - 1]:
+                return pytz.utc.localize(self.transitions[j])
+        return pytz.utc.localize(local_naive - self.offsets[k])
+
+
+@lru_cache(maxsize=None)
+def get_zone_offsets(timezone_str: str) -> ZoneOffsets:
+    try:
+        tz = pytz.timezone(timezone_str)
+    except pytz.UnknownTimeZoneError:
+        if timezone_str == DEFAULT_TIMEZONE:
+            raise
+        print(f"Unknown timezone '{timezone_str}', falling back to {DEFAULT_TIMEZONE}")
+        return get_zone_offsets(DEFAULT_TIMEZONE)
+    return ZoneOffsets(timezone_str, tz)
@@ -0,0 +1,83 @@
+import bisect
+import pytz
+from datetime import datetime, timedelta
+from .schedule import compile_schedule
+
+
+class UptimeIndex:
+    # Running totals of business time and business uptime for one store, recorded at every instant where
+    # either rate changes: a business-hours boundary or a poll whose status differs from the previous one.
+    # Between two such points both rates are constant, so any instant is a bisect plus one step and any
+    # range a subtraction. Covers [start_utc, end_utc].
+
+    def __init__(self, store_id: str, timezone_str: str, business_hours_records, status_polls,
+                 start_utc: datetime, end_utc: datetime):
+        self.store_id = store_id
+        self.start_utc = start_utc
+        self.end_utc = end_utc
+        schedule = compile_schedule(store_id, timezone_str, business_hours_records, start_utc, end_utc)
+
+        # Every poll is kept for the first-poll rule; only status changes become points.
+        self.poll_times = [poll.timestamp_utc.replace(tzinfo=pytz.utc) for poll in status_polls]
+        self.poll_active = [poll.status == "active" for poll in status_polls]
+        change_times = []
+        change_active = []
+        for poll_time, active in zip(self.poll_times, self.poll_active):
+            if not change_active or change_active[-1] != active:
+                change_times.append(poll_time)
+                change_active.append(active)
+
+        boundaries = [instant for interval in schedule.intervals for instant in interval]
+        self.points = sorted(
+            {start_utc} | {t for t in boundaries + change_times if start_utc < t < end_utc}
+        )
+        self.in_business = []
+        self.counts_up = []
+        self.business_before = []
+        self.uptime_before = []
+        business_total = timedelta(0)
+        uptime_total = timedelta(0)
+        for k, point in enumerate(self.points):
+            interval = bisect.bisect_right(schedule.starts, point) - 1
+            in_business = interval >= 0 and point < schedule.intervals[interval][1]
+            # A status holds until the next poll; the first poll also speaks for the time before it,
+            # and a store that was never polled counts as up.
+            change = bisect.bisect_right(change_times, point) - 1
+            active = change_active[max(change, 0)] if change_active else True
+            self.in_business.append(in_business)
+            self.counts_up.append(in_business and active)
+            self.business_before.append(business_total)
+            self.uptime_before.append(uptime_total)
+            if k + 1 < len(self.points):
+                step = self.points[k + 1] - point
+                business_total += step if in_business else timedelta(0)
+                uptime_total += step if in_business and active else timedelta(0)
+
+    def _totals_before(self, instant: datetime):
+        k = bisect.bisect_right(self.points, instant) - 1
+        step = instant - self.points[k]
+        business = self.business_before[k] + (step if self.in_business[k] else timedelta(0))
+        uptime = self.uptime_before[k] + (step if self.counts_up[k] else timedelta(0))
+        return business, uptime
+
+    def uptime_seconds(self, start_utc: datetime, end_utc: datetime):
+        # Returns (observed uptime, business time) in seconds for [start_utc, end_utc), with the same
+        # rules as calculate_uptime_downtime applied to a window ending at end_utc.
+        if not (self.start_utc <= start_utc < end_utc <= self.end_utc):
+            raise ValueError(
+                f"Range must satisfy {self.start_utc.isoformat()} <= start < end <= {self.end_utc.isoformat()}"
+            )
+        start_business, _ = self._totals_before(start_utc)
+        end_business, end_uptime = self._totals_before(end_utc)
+        business = end_business - start_business
+
+        first_poll = bisect.bisect_left(self.poll_times, start_utc)
+        if first_poll == len(self.poll_times) or self.poll_times[first_poll] > end_utc:
+            # No polls inside the range: the store is assumed up for all of it.
+            return business.total_seconds(), business.total_seconds()
+        first_poll_business, first_poll_uptime = self._totals_before(self.poll_times[first_poll])
+        uptime = end_uptime - first_poll_uptime
+        if self.poll_active[first_poll]:
+            # The first poll in the range also speaks for the time before it.
+            uptime += first_poll_business - start_business
+        return uptime.total_seconds(), business.total_seconds()
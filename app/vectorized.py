@@ -0,0 +1,115 @@
+import numpy as np
+from datetime import datetime, timedelta
+from . import crud
+from .report_generation import DEFAULT_WINDOWS
+from .schedule import compile_schedule
+
+# All instants are int64 microseconds, the resolution of the stored timestamps, so sums stay exact.
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_microseconds(naive_utc_datetimes):
+    return np.array(naive_utc_datetimes, dtype="datetime64[us]").astype(np.int64)
+
+
+def build_poll_arrays(store_ids, status_polls):
+    # Arrays sorted by (store, timestamp): store index, epoch microseconds and an "active" flag.
+    store_index, timestamps, active = [], [], []
+    for index, store_id in enumerate(store_ids):
+        polls = status_polls.get(store_id, [])
+        store_index.append(np.full(len(polls), index, dtype=np.int64))
+        timestamps.append(_to_microseconds([poll.timestamp_utc for poll in polls]))
+        active.append(np.array([poll.status == "active" for poll in polls], dtype=bool))
+    if not store_ids:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, bool)
+    return np.concatenate(store_index), np.concatenate(timestamps), np.concatenate(active)
+
+
+def build_business_arrays(store_ids, timezones, business_hours, start_utc, end_utc):
+    # Per-store UTC business intervals, flattened in store order.
+    store_index, starts, ends = [], [], []
+    for index, store_id in enumerate(store_ids):
+        intervals = compile_schedule(
+            store_id, timezones.get(store_id, crud.DEFAULT_TIMEZONE), business_hours.get(store_id, []), start_utc, end_utc
+        ).intersect([(start_utc, end_utc)])
+        store_index.extend([index] * len(intervals))
+        starts.extend(interval_start.replace(tzinfo=None) for interval_start, _ in intervals)
+        ends.extend(interval_end.replace(tzinfo=None) for _, interval_end in intervals)
+    return np.array(store_index, dtype=np.int64), _to_microseconds(starts), _to_microseconds(ends)
+
+
+def calculate_fleet_vectorized(store_ids, current_utc_dt: datetime, timezones, business_hours, status_polls,
+                               windows=DEFAULT_WINDOWS, poll_arrays=None):
+    # poll_arrays, if given, replaces status_polls with ready-made build_poll_arrays output (e.g. from a snapshot).
+    store_ids = list(store_ids)
+    horizon = max(window.duration for window in windows)
+    horizon_start_utc = current_utc_dt - horizon
+    origin = _to_microseconds([horizon_start_utc.replace(tzinfo=None)])[0]
+    horizon_us = np.int64(horizon // _MICROSECOND)
+
+    # Every store gets its own stretch of one global timeline, so a single sorted array and a
+    # single cumulative business-time table serve the whole fleet.
+    span = horizon_us + 1
+    store_offset = np.arange(len(store_ids), dtype=np.int64) * span
+    store_end = store_offset + horizon_us
+
+    poll_store, poll_ts, poll_active = poll_arrays or build_poll_arrays(store_ids, status_polls)
+    poll_time = poll_store * span + (poll_ts - origin)
+
+    bh_store, bh_starts, bh_ends = build_business_arrays(
+        store_ids, timezones, business_hours, horizon_start_utc, current_utc_dt
+    )
+    bh_start_time = bh_store * span + (bh_starts - origin)
+    bh_end_time = bh_store * span + (bh_ends - origin)
+    bh_cumulative = np.concatenate(([0], np.cumsum(bh_end_time - bh_start_time)))
+
+    def business_time_before(instants):
+        if not len(bh_start_time):
+            return np.zeros(len(instants), dtype=np.int64)
+        k = np.searchsorted(bh_start_time, instants, side="right") - 1
+        safe_k = np.maximum(k, 0)
+        inside = np.clip(instants - bh_start_time[safe_k], 0, bh_end_time[safe_k] - bh_start_time[safe_k])
+        return np.where(k >= 0, bh_cumulative[safe_k] + inside, 0)
+
+    # Poll i holds its status until the next poll of the same store, or until the end of the horizon.
+    store_poll_end = np.searchsorted(poll_store, np.arange(len(store_ids)), side="right")
+    next_time = np.empty_like(poll_time)
+    next_time[:-1] = poll_time[1:]
+    last_of_store = np.ones(len(poll_time), dtype=bool)
+    last_of_store[:-1] = poll_store[1:] != poll_store[:-1]
+    next_time[last_of_store] = store_end[poll_store[last_of_store]]
+
+    poll_business_before = business_time_before(poll_time)
+    segment_uptime = np.where(poll_active, business_time_before(next_time) - poll_business_before, 0)
+    uptime_cumulative = np.concatenate(([0], np.cumsum(segment_uptime)))
+
+    end_business = business_time_before(store_end)
+    uptime_by_window = []
+    downtime_by_window = []
+    for window in windows:
+        window_start = store_end - np.int64(window.duration // _MICROSECOND)
+        start_business = business_time_before(window_start)
+        total_business = (end_business - start_business) / 1e6
+
+        first_poll = np.searchsorted(poll_time, window_start, side="left")
+        has_poll = first_poll < store_poll_end
+        safe_first = np.minimum(first_poll, max(len(poll_time) - 1, 0))
+        if len(poll_time):
+            leading = np.where(poll_active[safe_first], poll_business_before[safe_first] - start_business, 0)
+            observed = (uptime_cumulative[store_poll_end] - uptime_cumulative[first_poll] + leading) / 1e6
+        else:
+            observed = np.zeros(len(store_ids))
+        observed = np.where(has_poll, observed, total_business)
+
+        uptime = np.where(total_business > 0, np.minimum(observed, total_business), 0.0)
+        downtime = np.where(total_business > 0, total_business - uptime, 0.0)
+        uptime_by_window.append((uptime / window.unit_seconds).tolist())
+        downtime_by_window.append((downtime / window.unit_seconds).tolist())
+
+    for index, store_id in enumerate(store_ids):
+        result = {"store_id": store_id}
+        for window, uptime in zip(windows, uptime_by_window):
+            result[f"uptime_last_{window.name}"] = round(uptime[index], 2)
+        for window, downtime in zip(windows, downtime_by_window):
+            result[f"downtime_last_{window.name}"] = round(downtime[index], 2)
+        yield result
@@ -0,0 +1,88 @@
+import argparse
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+
+# Synthetic fleet in the same CSV layout as the real data/ files. The default end falls two days
+# after the US spring-forward (2023-03-12), so the trailing week crosses a DST change.
+DEFAULT_END_UTC = datetime(2023, 3, 14, 18, 0, 0)
+TIMEZONES = [
+    "America/New_York", "America/Chicago", "America/Denver", "America/Los_Angeles",
+    "America/Phoenix", "America/Anchorage", "Pacific/Honolulu",
+]
+SHIFTS = [
+    ("09:00:00", "17:00:00"),
+    ("10:00:00", "22:00:00"),
+    ("06:30:00", "14:30:00"),
+    ("18:00:00", "02:00:00"),  # overnight
+    ("22:00:00", "06:00:00"),  # overnight
+    ("00:00:00", "23:59:59"),
+]
+
+
+def generate_fleet(output_dir: str, stores: int, hours: int, seed: int = 7, end_utc: datetime = DEFAULT_END_UTC):
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        "store_status": os.path.join(output_dir, "store_status.csv"),
+        "business_hours": os.path.join(output_dir, "business_hours.csv"),
+        "timezones": os.path.join(output_dir, "timezones.csv"),
+    }
+    store_ids = [f"{rng.getrandbits(63):019d}" for _ in range(stores)]
+    start_utc = end_utc - timedelta(hours=hours)
+    poll_count = 0
+
+    with open(paths["timezones"], "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["store_id", "timezone_str"])
+        for store_id in store_ids:
+            # About one store in ten has no row and falls back to the default zone.
+            if rng.random() >= 0.1:
+                writer.writerow([store_id, rng.choice(TIMEZONES)])
+
+    with open(paths["business_hours"], "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["store_id", "dayOfWeek", "start_time_local", "end_time_local"])
+        for store_id in store_ids:
+            # About one store in five has no rows and is treated as open 24/7.
+            if rng.random() < 0.2:
+                continue
+            shift = rng.choice(SHIFTS)
+            for day in range(7):
+                if rng.random() < 0.1:
+                    continue
+                writer.writerow([store_id, day, *shift])
+                if rng.random() < 0.05:
+                    writer.writerow([store_id, day, *rng.choice(SHIFTS)])
+
+    with open(paths["store_status"], "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["store_id", "timestamp_utc", "status"])
+        for store_id in store_ids:
+            uptime_ratio = rng.choice([0.99, 0.95, 0.9, 0.7])
+            status = "active"
+            poll = start_utc + timedelta(seconds=rng.uniform(0, 3600))
+            while poll <= end_utc:
+                # Hourly-ish polls with jitter; some are lost, and outages tend to persist.
+                if rng.random() >= 0.05:
+                    if status == "active":
+                        status = "inactive" if rng.random() > uptime_ratio else "active"
+                    else:
+                        status = "active" if rng.random() < 0.5 else "inactive"
+                    writer.writerow([store_id, poll.strftime("%Y-%m-%d %H:%M:%S.%f UTC"), status])
+                    poll_count += 1
+                poll += timedelta(seconds=rng.uniform(2700, 4500))
+
+    print(f"Generated {stores} stores, {poll_count} polls over {hours} hours in {output_dir}")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic store fleet as CSV files.")
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--hours", type=int, default=24 * 8)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output-dir", default=os.path.join("benchmarks", "data"))
+    args = parser.parse_args()
+    generate_fleet(args.output_dir, args.stores, args.hours, args.seed)
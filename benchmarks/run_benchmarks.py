@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import platform
+import pytz
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(ROOT_DIR, "benchmarks")
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# Metrics where a larger number is better; every other metric is a duration or a size.
+HIGHER_IS_BETTER = {"ingest_store_status_rows_per_sec", "ingest_business_hours_rows_per_sec",
+                    "ingest_timezones_rows_per_sec"}
+HIGHER_IS_BETTER_PREFIXES = ("python_report_rows_speedup_",)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS; pool workers count through RUSAGE_CHILDREN.
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def parse_worker_counts(value: str) -> list:
+    # "1,cpu" -> [1, os.cpu_count()]; 1 is always included, since speedups are measured against it.
+    counts = {1}
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            counts.add((os.cpu_count() or 1) if item == "cpu" else int(item))
+    return sorted(counts)
+
+
+def run(stores: int, hours: int, seed: int, workers: int, sweep_workers: list, work_dir: str) -> dict:
+    # The app reads DATABASE_URL and SNAPSHOT_DIR at import time, so they point into work_dir first.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, 'benchmark.db')}"
+    os.environ["SNAPSHOT_DIR"] = os.path.join(work_dir, "snapshots")
+    sys.path.insert(0, ROOT_DIR)
+    sys.path.insert(0, BENCHMARK_DIR)
+    from generate_fleet import generate_fleet
+    from app import crud, database, models, report_generation, rollup, runs, snapshot
+
+    paths = generate_fleet(os.path.join(work_dir, "data"), stores, hours, seed)
+    models.Base.metadata.create_all(bind=database.engine)
+    db = next(database.get_db())
+    metrics = {}
+    try:
+        count, elapsed = timed(crud.bulk_insert_store_timezones, db, paths["timezones"])
+        metrics["ingest_timezones_rows_per_sec"] = round(count / elapsed, 1)
+        count, elapsed = timed(crud.bulk_insert_business_hours, db, paths["business_hours"])
+        metrics["ingest_business_hours_rows_per_sec"] = round(count / elapsed, 1)
+        # Includes the status run refresh when STATUS_RUNS is on, and the hourly rollup refresh when
+        # HOURLY_ROLLUP is on.
+        count, elapsed = timed(crud.bulk_insert_store_status, db, paths["store_status"])
+        metrics["ingest_store_status_rows_per_sec"] = round(count / elapsed, 1)
+        metrics["polls"] = count
+        # Built up front so runs_report_rows_seconds only measures reading it.
+        _, metrics["status_runs_build_seconds"] = timed(runs.ensure_status_runs, db)
+        metrics["status_runs"] = db.query(models.StoreStatusRun).count()
+        _, metrics["snapshot_write_seconds"] = timed(snapshot.write_store_status_snapshot, db)
+        # Built up front so rollup_report_rows_seconds only measures reading it.
+        _, metrics["rollup_build_seconds"] = timed(rollup.ensure_hourly_rollup, db)
+
+        max_timestamp_str = crud.get_max_timestamp(db)
+        current_utc_dt = pytz.utc.localize(datetime.strptime(max_timestamp_str, "%Y-%m-%d %H:%M:%S.%f UTC"))
+        store_ids = crud.get_all_store_ids(db)
+
+        (timezones, business_hours, status_polls), metrics["preload_seconds"] = timed(
+            report_generation.preload_store_data, db, current_utc_dt
+        )
+        _, elapsed = timed(lambda: list(report_generation.calculate_fleet(
+            store_ids, current_utc_dt, timezones, business_hours, status_polls, workers=1
+        )))
+        metrics["python_compute_us_per_store"] = round(elapsed / len(store_ids) * 1e6, 1)
+        for engine in report_generation.REPORT_ENGINES:
+            _, metrics[f"{engine}_report_rows_seconds"] = timed(lambda: list(report_generation.compute_report_rows(
+                db, store_ids, current_utc_dt, engine=engine, workers=workers
+            )))
+        # The same python report at each worker count, to check how close the pool gets to linear speedup.
+        for count in sweep_workers:
+            _, metrics[f"python_report_rows_seconds_workers_{count}"] = timed(lambda: list(
+                report_generation.compute_report_rows(db, store_ids, current_utc_dt, engine="python", workers=count)
+            ))
+        for count in sweep_workers:
+            metrics[f"python_report_rows_speedup_workers_{count}"] = \
+                metrics["python_report_rows_seconds_workers_1"] / metrics[f"python_report_rows_seconds_workers_{count}"]
+    finally:
+        db.close()
+
+    reports_dir = os.path.join(work_dir, "reports")
+    os.makedirs(reports_dir, exist_ok=True)
+    _, metrics["end_to_end_report_seconds"] = timed(
+        report_generation.generate_report_logic, "benchmark", reports_dir, max_timestamp_str, workers=workers
+    )
+    metrics["peak_rss_mb"] = peak_rss_mb()
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in metrics.items()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    if baseline.get("params") != results["params"]:
+        print("Baseline was recorded with different parameters; skipping the comparison.")
+        return regressions
+    for name, value in results["metrics"].items():
+        previous = baseline["metrics"].get(name)
+        if not previous or name in ("polls", "status_runs"):
+            continue
+        change = (value - previous) / previous
+        higher_is_better = name in HIGHER_IS_BETTER or name.startswith(HIGHER_IS_BETTER_PREFIXES)
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        print(f"{name:40s} {previous:>14} -> {value:>14} ({change:+.1%}){flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest and report generation on a synthetic fleet.")
+    parser.add_argument("--stores", type=int, default=500)
+    parser.add_argument("--hours", type=int, default=24 * 8)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--sweep-workers", default="1,cpu",
+        help="Comma-separated worker counts to time the python report at; 'cpu' is the number of CPUs."
+    )
+    parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "results.json"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a metric fails.")
+    args = parser.parse_args()
+
+    sweep_workers = parse_worker_counts(args.sweep_workers)
+    params = {"stores": args.stores, "hours": args.hours, "seed": args.seed, "workers": args.workers,
+              "sweep_workers": sweep_workers}
+    with tempfile.TemporaryDirectory() as work_dir:
+        metrics = run(args.stores, args.hours, args.seed, args.workers, sweep_workers, work_dir)
+    results = {
+        "params": params,
+        "metrics": metrics,
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "recorded_at": datetime.utcnow().isoformat(timespec="seconds"),
+    }
+    print(json.dumps(results["metrics"], indent=2))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
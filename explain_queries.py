@@ -0,0 +1,74 @@
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app import crud, database, models
+
+
+def capture_statements(engine, run):
+    # Runs the crud call and returns the (sql, parameters) it sent, so the plan is for the exact query.
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def explain(db: Session, statement: str, parameters):
+    dialect = db.get_bind().dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [" | ".join(str(column) for column in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the query plans of the report hot paths.")
+    parser.add_argument("--store-id", help="Store used for the per-store window query (default: any store).")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    database.add_missing_columns(database.engine)
+    database.create_indexes(database.engine)
+    db: Session = next(database.get_db())
+    try:
+        max_ts = db.query(models.StoreStatus.timestamp_utc).order_by(models.StoreStatus.timestamp_utc.desc()).first()
+        end_utc = max_ts[0] if max_ts else datetime.utcnow()
+        start_utc = end_utc - timedelta(weeks=1)
+        store_id = args.store_id or (crud.get_all_store_ids(db) or ["0"])[0]
+
+        queries = [
+            ("get_store_status_in_window", lambda: crud.get_store_status_in_window(db, store_id, start_utc, end_utc)),
+            ("get_max_timestamp", lambda: crud.get_max_timestamp(db)),
+            ("get_all_store_ids", lambda: crud.get_all_store_ids(db)),
+            ("get_all_store_timezones", lambda: crud.get_all_store_timezones(db)),
+            ("get_all_business_hours", lambda: crud.get_all_business_hours(db)),
+            ("get_all_store_status_in_window", lambda: crud.get_all_store_status_in_window(db, start_utc, end_utc)),
+            ("get_hourly_rollup_in_window", lambda: crud.get_hourly_rollup_in_window(db, start_utc, end_utc)),
+            ("get_all_status_runs_in_window", lambda: crud.get_all_status_runs_in_window(db, start_utc, end_utc)),
+        ]
+        print(f"Database: {database.engine.url} (profile: {database.DATABASE_PROFILE})")
+        if database.engine.dialect.name == "sqlite":
+            for pragma in ("journal_mode", "mmap_size", "cache_size"):
+                print(f"PRAGMA {pragma} = {db.execute(text(f'PRAGMA {pragma}')).scalar()}")
+        for name, run in queries:
+            for statement, parameters in capture_statements(database.engine, run):
+                print(f"\n== {name}")
+                print(" ".join(statement.split()))
+                for line in explain(db, statement, parameters):
+                    print(f"  {line}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
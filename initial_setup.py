@@ -1,6 +1,7 @@
 \
+import argparse
 import os
-from app import crud, database, models
+from app import crud, database, models, snapshot
 from sqlalchemy.orm import Session
 
 
@@ -30,8 +31,12 @@ def check_files_exist():
         print("Setup aborted.")
     return files_ok
 
-def main():
-    print("Starting initial data setup...")
+def write_snapshot(db: Session):
+    print(f"Writing the columnar store status snapshot to {snapshot.SNAPSHOT_DIR}...")
+    snapshot.write_store_status_snapshot(db)
+
+def main(incremental: bool = False):
+    print("Starting incremental data refresh..." if incremental else "Starting initial data setup...")
 
     if not check_files_exist():
         return
@@ -39,28 +44,48 @@ def main():
 
     print("Creating database tables...")
     models.Base.metadata.create_all(bind=database.engine)
+    database.add_missing_columns(database.engine)
+    database.create_indexes(database.engine)
     print("Database tables created (if they didn't exist).")
 
     db: Session = next(database.get_db())
 
     try:
-       
+        # Timezones and business hours go first so the hourly rollup refreshed by the
+        # store status load is computed against the final schedules.
+        if incremental:
+            print(f"Updating changed timezones from {TIMEZONES_CSV}...")
+            changed_timezones = crud.upsert_store_timezones(db, TIMEZONES_CSV)
+            print(f"Timezones inserted or updated for {changed_timezones} stores.")
+
+            print(f"Updating changed business hours from {BUSINESS_HOURS_CSV}...")
+            changed_stores = crud.upsert_business_hours(db, BUSINESS_HOURS_CSV)
+            print(f"Business hours replaced for {changed_stores} stores.")
+
+            print(f"Appending new store status data from {STORE_STATUS_CSV}...")
+            crud.incremental_insert_store_status(db, STORE_STATUS_CSV)
+            write_snapshot(db)
+
+            print("\nIncremental data refresh complete!")
+            return
+
         print("Clearing existing data from tables...")
         crud.clear_data(db)
         print("Existing data cleared.")
 
 
-        print(f"Loading store status data from {STORE_STATUS_CSV}...")
-        crud.bulk_insert_store_status(db, STORE_STATUS_CSV)
-        print("Store status data loaded.")
+        print(f"Loading timezone data from {TIMEZONES_CSV}...")
+        crud.bulk_insert_store_timezones(db, TIMEZONES_CSV)
+        print("Timezone data loaded.")
 
         print(f"Loading business hours data from {BUSINESS_HOURS_CSV}...")
         crud.bulk_insert_business_hours(db, BUSINESS_HOURS_CSV)
         print("Business hours data loaded.")
 
-        print(f"Loading timezone data from {TIMEZONES_CSV}...")
-        crud.bulk_insert_store_timezones(db, TIMEZONES_CSV)
-        print("Timezone data loaded.")
+        print(f"Loading store status data from {STORE_STATUS_CSV}...")
+        crud.bulk_insert_store_status(db, STORE_STATUS_CSV)
+        print("Store status data loaded.")
+        write_snapshot(db)
         
         print("\\nInitial data setup complete!")
         
@@ -77,6 +102,13 @@ def main():
         db.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the CSV data into the store monitoring database.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Append new polls and upsert changed business hours and timezones instead of clearing and reloading."
+    )
+    args = parser.parse_args()
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
         print(f"Created '{DATA_DIR}' directory. Please place your CSV files there and rename them as specified in README.md.")
@@ -85,5 +117,5 @@ if __name__ == "__main__":
         print(f"  - {os.path.basename(BUSINESS_HOURS_CSV)}")
         print(f"  - {os.path.basename(TIMEZONES_CSV)} (renamed from bq-results-*.csv)")
     else:
-        main()
+        main(incremental=args.incremental)
 
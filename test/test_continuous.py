@@ -0,0 +1,114 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import continuous, crud, models, report_generation
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def setup_module(module):
+    models.Base.metadata.create_all(bind=engine)
+
+
+def teardown_module(module):
+    models.Base.metadata.drop_all(bind=engine)
+
+
+def write_csv(tmp_path, name, lines):
+    path = tmp_path / name
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def full_report(db):
+    as_of = report_generation.parse_timestamp_str(crud.get_max_timestamp(db))
+    rows = list(report_generation.compute_report_rows(db, sorted(crud.get_all_store_ids(db)), as_of, workers=1))
+    return as_of, rows
+
+
+def test_latest_report_recomputes_only_dirty_and_slid_stores(tmp_path):
+    db = TestingSessionLocal()
+    crud.clear_data(db)
+    # Store 2 is only open on Mondays, 9-10 New York, so moving the as-of time on a Wednesday cannot change it.
+    crud.bulk_insert_business_hours(db, write_csv(tmp_path, "business_hours.csv", [
+        "store_id,dayOfWeek,start_time_local,end_time_local", "2,0,09:00:00,10:00:00",
+    ]))
+    crud.bulk_insert_store_timezones(db, write_csv(tmp_path, "timezones.csv", ["store_id,timezone_str", "2,America/New_York"]))
+    status_lines = [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 11:00:00.000000 UTC,active",
+        "1,2023-01-25 11:30:00.000000 UTC,inactive",
+        "2,2023-01-20 15:00:00.000000 UTC,inactive",
+    ]
+    status_csv = write_csv(tmp_path, "store_status.csv", status_lines)
+    crud.incremental_insert_store_status(db, status_csv)
+
+    assert continuous.refresh_latest_report(db) == 2
+    as_of, expected = full_report(db)
+    assert list(continuous.current_latest_rows(db, as_of)) == expected
+    assert continuous.refresh_latest_report(db) == 0
+
+    write_csv(tmp_path, "store_status.csv", status_lines + ["1,2023-01-25 11:45:00.000000 UTC,active"])
+    crud.incremental_insert_store_status(db, status_csv)
+    assert continuous.current_latest_rows(db, as_of) is None
+    assert continuous.refresh_latest_report(db) == 1
+    as_of, expected = full_report(db)
+    assert list(continuous.current_latest_rows(db, as_of)) == expected
+
+    # A business hours change marks the store dirty even though the as-of time stays put.
+    crud.upsert_business_hours(db, write_csv(tmp_path, "business_hours.csv", [
+        "store_id,dayOfWeek,start_time_local,end_time_local", "2,2,00:00:00,23:59:59",
+    ]))
+    assert continuous.refresh_latest_report(db) == 1
+    assert list(continuous.current_latest_rows(db, as_of)) == full_report(db)[1]
+    db.close()
+
+
+def test_only_one_process_holds_the_reporter_lease():
+    db = TestingSessionLocal()
+    assert crud.try_acquire_lease(db, "test-lease", "worker-a", 60)
+    assert not crud.try_acquire_lease(db, "test-lease", "worker-b", 60)
+    assert crud.try_acquire_lease(db, "test-lease", "worker-a", 60)
+
+    # An expired lease goes to whoever asks next, and a released one is free at once.
+    assert crud.try_acquire_lease(db, "test-lease", "worker-a", -1)
+    assert crud.try_acquire_lease(db, "test-lease", "worker-b", 60)
+    crud.release_lease(db, "test-lease", "worker-a")
+    assert not crud.try_acquire_lease(db, "test-lease", "worker-a", 60)
+    crud.release_lease(db, "test-lease", "worker-b")
+    assert crud.try_acquire_lease(db, "test-lease", "worker-a", 60)
+    db.close()
+
+
+def test_refresh_that_loses_the_race_leaves_the_latest_report_alone(tmp_path, monkeypatch):
+    db = TestingSessionLocal()
+    crud.clear_data(db)
+    status_csv = write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status", "1,2023-01-25 11:00:00.000000 UTC,active",
+    ])
+    crud.incremental_insert_store_status(db, status_csv)
+    assert continuous.refresh_latest_report(db) == 1
+    as_of, expected = full_report(db)
+
+    write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 11:00:00.000000 UTC,active",
+        "1,2023-01-25 12:00:00.000000 UTC,inactive",
+    ])
+    crud.incremental_insert_store_status(db, status_csv)
+    compute_rows = continuous._compute_rows
+
+    def compute_while_another_process_refreshes(db, *args):
+        rows = list(compute_rows(db, *args))
+        table = models.LatestReportState.__table__
+        db.execute(table.update().where(table.c.id == 1).values(data_version=-1))
+        db.commit()
+        return rows
+
+    monkeypatch.setattr(continuous, "_compute_rows", compute_while_another_process_refreshes)
+    assert continuous.refresh_latest_report(db) == 0
+    rows = db.query(models.LatestReportRow).all()
+    assert [row.store_id for row in rows] == ["1"]
+    assert rows[0].uptime_last_hour == expected[0]["uptime_last_hour"]
+    assert db.query(models.LatestReportState).one().data_version == -1
+    db.close()
@@ -0,0 +1,308 @@
+import os
+import pytest
+from datetime import datetime, time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import crud, metrics, models, rollup, runs
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def setup_module(module):
+    models.Base.metadata.create_all(bind=engine)
+
+
+def teardown_module(module):
+    models.Base.metadata.drop_all(bind=engine)
+
+
+def write_csv(tmp_path, name, lines):
+    path = tmp_path / name
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def rollup_snapshot(db):
+    return [
+        (row.store_id, row.hour_utc, row.business_seconds, row.uptime_seconds, row.start_status, row.end_status)
+        for row in db.query(models.StoreHourlyRollup).order_by(
+            models.StoreHourlyRollup.store_id, models.StoreHourlyRollup.hour_utc
+        )
+    ]
+
+
+def runs_snapshot(db):
+    return [
+        (row.store_id, row.start_utc, row.end_utc, row.status, row.poll_count)
+        for row in db.query(models.StoreStatusRun).order_by(models.StoreStatusRun.store_id, models.StoreStatusRun.start_utc)
+    ]
+
+
+def fresh_db():
+    db = TestingSessionLocal()
+    crud.clear_data(db)
+    return db
+
+
+def test_bulk_inserts_stream_in_chunks_and_skip_malformed_rows(tmp_path):
+    status_csv = write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status",
+        *[f"{i % 3},2023-01-25 {i % 24:02d}:00:00.123456 UTC,active" for i in range(25)],
+        "4,not-a-timestamp,active",
+        ",2023-01-25 10:00:00 UTC,active",
+    ])
+    hours_csv = write_csv(tmp_path, "business_hours.csv", [
+        "store_id,dayOfWeek,start_time_local,end_time_local",
+        "1,0,09:00:00,17:00:00",
+        "1,1,22:00:00,02:00:00",
+        "2,0,bad,17:00:00",
+    ])
+    timezones_csv = write_csv(tmp_path, "timezones.csv", [
+        "store_id,timezone_str",
+        "1,America/New_York",
+        "2,",
+    ])
+    db = fresh_db()
+
+    # Row 24 repeats the (store_id, timestamp_utc) pair of row 0.
+    assert crud.bulk_insert_store_status(db, status_csv, chunk_size=10) == 24
+    assert crud.bulk_insert_business_hours(db, hours_csv, chunk_size=10) == 2
+    assert crud.bulk_insert_store_timezones(db, timezones_csv, chunk_size=10) == 2
+
+    assert db.query(models.StoreStatus).count() == 24
+    assert crud.get_max_timestamp(db) == "2023-01-25 23:00:00.123456 UTC"
+    overnight = db.query(models.BusinessHours).filter(models.BusinessHours.day_of_week == 1).one()
+    assert (overnight.start_time_local, overnight.end_time_local) == (time(22), time(2))
+    assert crud.get_store_timezone_str(db, "2") == crud.DEFAULT_TIMEZONE
+    db.close()
+
+
+def test_incremental_ingest_appends_only_new_polls_and_upserts_dimensions(tmp_path, monkeypatch):
+    monkeypatch.setattr(rollup, "HOURLY_ROLLUP", True)
+    monkeypatch.setattr(runs, "STATUS_RUNS", True)
+    status_lines = [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 09:00:00.000000 UTC,active",
+        "1,2023-01-25 10:00:00.000000 UTC,active",
+    ]
+    status_csv = write_csv(tmp_path, "store_status.csv", status_lines)
+    hours_csv = write_csv(tmp_path, "business_hours.csv", [
+        "store_id,dayOfWeek,start_time_local,end_time_local",
+        "1,0,09:00:00,17:00:00",
+        "2,0,09:00:00,17:00:00",
+    ])
+    timezones_csv = write_csv(tmp_path, "timezones.csv", ["store_id,timezone_str", "1,America/New_York"])
+    db = fresh_db()
+    crud.bulk_insert_store_status(db, status_csv)
+    crud.bulk_insert_business_hours(db, hours_csv)
+    crud.bulk_insert_store_timezones(db, timezones_csv)
+
+    write_csv(tmp_path, "store_status.csv", status_lines + [
+        "1,2023-01-25 11:00:00.000000 UTC,inactive",
+        "2,2023-01-25 11:30:00.000000 UTC,active",
+    ])
+    assert crud.incremental_insert_store_status(db, status_csv) == 2
+    assert crud.incremental_insert_store_status(db, status_csv) == 0
+    refreshed_rollup = rollup_snapshot(db)
+    assert [(row[0], row[1]) for row in refreshed_rollup] == [
+        ("1", datetime(2023, 1, 25, 9)), ("1", datetime(2023, 1, 25, 10)), ("1", datetime(2023, 1, 25, 11)),
+        ("2", datetime(2023, 1, 25, 11)),
+    ]
+    assert rollup.rollup_is_current(db)
+    rollup.rebuild_hourly_rollup(db)
+    assert rollup_snapshot(db) == refreshed_rollup
+    assert runs_snapshot(db) == [
+        ("1", datetime(2023, 1, 25, 9), datetime(2023, 1, 25, 10), "active", 2),
+        ("1", datetime(2023, 1, 25, 11), datetime(2023, 1, 25, 11), "inactive", 1),
+        ("2", datetime(2023, 1, 25, 11, 30), datetime(2023, 1, 25, 11, 30), "active", 1),
+    ]
+    assert crud.get_ingest_state(db, "store_status").high_water_mark == datetime(2023, 1, 25, 11, 30)
+
+    # A rewritten file is rescanned from the top, and pairs already stored are skipped.
+    write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 11:00:00.000000 UTC,inactive",
+        "3,2023-01-25 12:00:00.000000 UTC,active",
+    ])
+    assert crud.incremental_insert_store_status(db, status_csv) == 1
+    assert db.query(models.StoreStatus).count() == 5
+    refreshed_runs = runs_snapshot(db)
+    runs.rebuild_status_runs(db)
+    assert runs_snapshot(db) == refreshed_runs
+
+    write_csv(tmp_path, "business_hours.csv", [
+        "store_id,dayOfWeek,start_time_local,end_time_local",
+        "1,0,09:00:00,17:00:00",
+        "2,0,10:00:00,18:00:00",
+        "2,1,10:00:00,18:00:00",
+    ])
+    assert crud.upsert_business_hours(db, hours_csv) == 1
+    assert len(crud.get_business_hours_for_store(db, "2")) == 2
+
+    write_csv(tmp_path, "timezones.csv", ["store_id,timezone_str", "1,America/Denver", "3,Asia/Kolkata"])
+    assert crud.upsert_store_timezones(db, timezones_csv) == 2
+    assert crud.get_all_store_timezones(db) == {"1": "America/Denver", "3": "Asia/Kolkata"}
+    db.close()
+
+
+def test_incremental_ingest_rescans_a_rewritten_file_that_grew(tmp_path, capsys):
+    db = fresh_db()
+    status_csv = write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 09:00:00.000000 UTC,active",
+        "2,2023-01-25 09:00:00.000000 UTC,active",
+        "3,2023-01-25 09:00:00.000000 UTC,active",
+    ])
+    assert crud.incremental_insert_store_status(db, status_csv) == 3
+
+    # A fresh export, larger than the first and in another order: resuming at the old offset would
+    # start in the middle of it.
+    write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status",
+        "4,2023-01-25 09:00:00.000000 UTC,inactive",
+        "5,2023-01-25 09:00:00.000000 UTC,active",
+        "3,2023-01-25 09:00:00.000000 UTC,active",
+        "6,2023-01-25 09:00:00.000000 UTC,active",
+        "2,2023-01-25 09:00:00.000000 UTC,active",
+        "1,2023-01-25 09:00:00.000000 UTC,active",
+        "7,2023-01-25 09:00:00.000000 UTC,inactive",
+    ])
+    capsys.readouterr()
+    assert crud.incremental_insert_store_status(db, status_csv) == 4
+    assert db.query(models.StoreStatus).count() == 7
+    assert "rescanning" in capsys.readouterr().out
+
+    # Appending to the rewritten file resumes where the rescan stopped.
+    with open(status_csv, "a") as f:
+        f.write("8,2023-01-25 09:00:00.000000 UTC,active\n")
+    assert crud.incremental_insert_store_status(db, status_csv) == 1
+    assert "rescanning" not in capsys.readouterr().out
+    assert crud.get_ingest_state(db, "store_status").file_offset == os.path.getsize(status_csv)
+    db.close()
+
+
+def test_status_runs_are_only_maintained_when_enabled_and_rebuilt_when_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(runs, "STATUS_RUNS", False)
+    db = fresh_db()
+    status_csv = write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 09:00:00.000000 UTC,active",
+        "1,2023-01-25 10:00:00.000000 UTC,active",
+    ])
+    crud.bulk_insert_store_status(db, status_csv)
+    assert runs_snapshot(db) == []
+    assert not runs.status_runs_are_current(db)
+
+    runs.ensure_status_runs(db)
+    assert runs_snapshot(db) == [("1", datetime(2023, 1, 25, 9), datetime(2023, 1, 25, 10), "active", 2)]
+    assert runs.status_runs_are_current(db)
+    db.close()
+
+
+def test_only_csv_loads_record_ingest_timings(tmp_path):
+    db = fresh_db()
+    metrics.reset()
+    crud.bulk_insert_store_status(db, write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status", "1,2023-01-25 09:00:00.000000 UTC,active",
+    ]))
+    crud.create_report_entry(db, "timed", cache_key="key")
+    columns = [column.name for column in models.ReportData.__table__.columns if column.name not in ("id", "report_id")]
+    crud.save_report_data(db, "timed", iter([{column: "1" if column == "store_id" else 0 for column in columns}]))
+    text = metrics.render()
+    assert 'ingest_seconds_count{table="store_status"} 1' in text
+    assert 'ingest_rows_total{table="store_status"} 1' in text
+    assert "report_data" not in text
+    metrics.reset()
+    db.close()
+
+
+def test_rescanning_a_rewritten_file_does_not_duplicate_polls(tmp_path):
+    db = fresh_db()
+    lines = [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 09:00:00.000000 UTC,active",
+        "2,2023-01-25 09:00:00.000000 UTC,active",
+    ]
+    status_csv = write_csv(tmp_path, "store_status.csv", lines)
+    assert crud.incremental_insert_store_status(db, status_csv) == 2
+
+    write_csv(tmp_path, "store_status.csv", [lines[0], lines[2], lines[1], "3,2023-01-25 09:00:00.000000 UTC,active"])
+    assert crud.incremental_insert_store_status(db, status_csv) == 1
+    assert db.query(models.StoreStatus).count() == 3
+    db.close()
+
+
+def test_ingest_refuses_to_run_without_the_poll_key_index(tmp_path):
+    unindexed = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=unindexed)
+    with unindexed.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_store_status_store_id_timestamp_utc")
+    db = sessionmaker(bind=unindexed)()
+    status_csv = write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status", "1,2023-01-25 09:00:00.000000 UTC,active",
+    ])
+    for ingest in (crud.bulk_insert_store_status, crud.incremental_insert_store_status):
+        with pytest.raises(RuntimeError, match="ix_store_status_store_id_timestamp_utc"):
+            ingest(db, status_csv)
+    assert db.query(models.StoreStatus).count() == 0
+    db.close()
+    unindexed.dispose()
+
+
+def test_ingest_bumps_data_version_and_old_reports_are_evicted(tmp_path):
+    db = fresh_db()
+    version = crud.get_data_version(db)
+    status_csv = write_csv(tmp_path, "store_status.csv", [
+        "store_id,timestamp_utc,status",
+        "1,2023-01-25 09:00:00.000000 UTC,active",
+    ])
+    crud.bulk_insert_store_status(db, status_csv)
+    assert crud.get_data_version(db) == version + 1
+    assert crud.incremental_insert_store_status(db, status_csv) == 0
+    assert crud.get_data_version(db) == version + 1
+
+    for i in range(4):
+        crud.create_report_entry(db, f"r{i}", cache_key="key")
+        db.query(models.Report).filter(models.Report.id == f"r{i}").update(
+            {"created_at": datetime(2023, 1, 25, i), "status": "Complete" if i < 3 else "Running"}
+        )
+        db.add(models.ReportData(report_id=f"r{i}", store_id="1"))
+    db.commit()
+    assert crud.get_cached_report(db, "key").id == "r2"
+    assert crud.get_cached_report(db, "other") is None
+
+    assert sorted(report.id for report in crud.evict_reports(db, keep=1)) == ["r0", "r1"]
+    assert crud.get_report_ids(db) == {"r2", "r3"}
+    assert {row.report_id for row in db.query(models.ReportData)} == {"r2", "r3"}
+    db.close()
+
+
+def test_cached_max_timestamp_follows_ingest(tmp_path):
+    db = fresh_db()
+    crud.bulk_insert_store_status(db, write_csv(tmp_path, "a.csv", [
+        "store_id,timestamp_utc,status", "1,2023-01-25 09:00:00.000000 UTC,active",
+    ]))
+    assert crud.get_max_timestamp_cached(db) == "2023-01-25 09:00:00.000000 UTC"
+    crud.bulk_insert_store_status(db, write_csv(tmp_path, "b.csv", [
+        "store_id,timestamp_utc,status", "1,2023-01-25 10:00:00.000000 UTC,active",
+    ]))
+    assert crud.get_max_timestamp_cached(db) == "2023-01-25 10:00:00.000000 UTC"
+    db.close()
+
+
+def test_report_data_pages_by_store_id():
+    db = fresh_db()
+    crud.create_report_entry(db, "r1")
+    crud.save_report_data(db, "r1", (
+        {"store_id": store_id, "uptime_last_hour": 1, "uptime_last_day": 1, "uptime_last_week": 1,
+         "downtime_last_hour": 0, "downtime_last_day": 0, "downtime_last_week": 0}
+        for store_id in ["c", "a", "e", "b", "d"]
+    ))
+    rows, next_after = crud.get_report_data_page(db, "r1", limit=2)
+    assert ([row.store_id for row in rows], next_after) == (["a", "b"], "b")
+    rows, next_after = crud.get_report_data_page(db, "r1", after="d", limit=2)
+    assert ([row.store_id for row in rows], next_after) == (["e"], None)
+    rows, _ = crud.get_report_data_page(db, "r1", store_ids=["e", "b", "x"])
+    assert [row.store_id for row in rows] == ["b", "e"]
+    db.close()
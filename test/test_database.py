@@ -0,0 +1,100 @@
+from sqlalchemy import text
+from app import database
+
+
+def test_tuned_sqlite_profile_enables_wal_and_mmap(tmp_path):
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'tuned.db'}", "tuned")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA mmap_size")).scalar() == database.SQLITE_MMAP_SIZE
+    engine.dispose()
+
+    plain = database.make_engine(f"sqlite:///{tmp_path / 'plain.db'}", "plain")
+    with plain.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+    plain.dispose()
+
+    memory = database.make_engine("sqlite://", "tuned")
+    with memory.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "memory"
+    memory.dispose()
+
+
+def test_add_missing_columns_upgrades_tables_created_by_older_models(tmp_path):
+    from app import models
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'old.db'}", "plain")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE reports (id VARCHAR NOT NULL PRIMARY KEY, status VARCHAR, file_path VARCHAR, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO reports (id, status) VALUES ('old', 'Complete')"))
+        conn.execute(text("CREATE TABLE store_status (id INTEGER PRIMARY KEY, store_id VARCHAR, timestamp_utc DATETIME, status VARCHAR)"))
+        conn.execute(text("CREATE INDEX ix_store_status_store_id ON store_status (store_id)"))
+        conn.execute(text("CREATE INDEX ix_store_status_timestamp_utc ON store_status (timestamp_utc)"))
+    models.Base.metadata.create_all(bind=engine)
+    database.add_missing_columns(engine)
+    database.create_indexes(engine)
+
+    with engine.connect() as conn:
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(reports)"))}
+        assert {"cache_key", "started_at", "finished_at"} <= columns
+        assert conn.execute(text("SELECT status, cache_key FROM reports WHERE id = 'old'")).one() == ("Complete", None)
+        indexes = {row[1] for row in conn.execute(text("PRAGMA index_list(store_status)"))}
+        assert not indexes & {"ix_store_status_store_id", "ix_store_status_timestamp_utc"}
+        assert {"ix_store_status_store_id_timestamp_utc", "ix_store_status_timestamp_utc_store_id_status"} <= indexes
+    database.add_missing_columns(engine)
+    engine.dispose()
+
+
+def create_old_store_status(engine, polls):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE store_status (id INTEGER PRIMARY KEY, store_id VARCHAR, timestamp_utc DATETIME, status VARCHAR)"))
+        conn.execute(text("CREATE INDEX ix_store_status_store_id ON store_status (store_id)"))
+        conn.execute(text("CREATE INDEX ix_store_status_timestamp_utc ON store_status (timestamp_utc)"))
+        for store_id, timestamp_utc, status in polls:
+            conn.execute(
+                text("INSERT INTO store_status (store_id, timestamp_utc, status) VALUES (:store_id, :timestamp_utc, :status)"),
+                {"store_id": store_id, "timestamp_utc": timestamp_utc, "status": status}
+            )
+
+
+def store_status_indexes(engine):
+    with engine.connect() as conn:
+        return {row[1] for row in conn.execute(text("PRAGMA index_list(store_status)"))}
+
+
+def test_create_indexes_deletes_duplicate_polls_before_the_unique_index(tmp_path):
+    from app import models
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'duplicates.db'}", "plain")
+    create_old_store_status(engine, [
+        ("1", "2023-01-25 11:00:00", "active"),
+        ("1", "2023-01-25 11:00:00", "inactive"),
+        ("1", "2023-01-25 12:00:00", "active"),
+        ("2", "2023-01-25 11:00:00", "active"),
+        ("1", "2023-01-25 11:00:00", "active"),
+    ])
+    models.Base.metadata.create_all(bind=engine)
+    database.create_indexes(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, store_id, status FROM store_status ORDER BY id")).all()
+    assert [tuple(row) for row in rows] == [(1, "1", "active"), (3, "1", "active"), (4, "2", "active")]
+    indexes = store_status_indexes(engine)
+    assert "ix_store_status_store_id_timestamp_utc" in indexes
+    assert not indexes & {"ix_store_status_store_id", "ix_store_status_timestamp_utc"}
+    engine.dispose()
+
+
+def test_create_indexes_keeps_retired_indexes_when_the_replacement_fails(tmp_path, monkeypatch):
+    from app import models
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'duplicates.db'}", "plain")
+    create_old_store_status(engine, [("1", "2023-01-25 11:00:00", "active"), ("1", "2023-01-25 11:00:00", "active")])
+    models.Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(database, "_delete_duplicate_keys", lambda connection, table, index: None)
+    database.create_indexes(engine)
+
+    indexes = store_status_indexes(engine)
+    assert "ix_store_status_store_id_timestamp_utc" not in indexes
+    assert {"ix_store_status_store_id", "ix_store_status_timestamp_utc"} <= indexes
+    assert "ix_store_status_timestamp_utc_store_id_status" in indexes
+    engine.dispose()
@@ -0,0 +1,27 @@
+import threading
+from app import jobs
+
+
+def test_same_key_is_coalesced_and_a_full_queue_is_rejected(monkeypatch):
+    monkeypatch.setattr(jobs, "REPORT_QUEUE_DEPTH", 1)
+    release = threading.Event()
+    created = []
+
+    def create_report(name):
+        created.append(name)
+        return name
+
+    first = jobs.enqueue("a", lambda: create_report("r-a"), lambda report_id: release.wait(5))
+    again = jobs.enqueue("a", lambda: create_report("r-a2"), lambda report_id: None)
+    queued = jobs.enqueue("b", lambda: create_report("r-b"), lambda report_id: None)
+    assert (first, again, queued) == (("r-a", True), ("r-a", False), ("r-b", True))
+    try:
+        jobs.enqueue("c", lambda: create_report("r-c"), lambda report_id: None)
+        assert False, "expected the queue to be full"
+    except jobs.QueueFullError:
+        pass
+    assert created == ["r-a", "r-b"]
+
+    release.set()
+    jobs._executor.submit(lambda: None).result(timeout=5)
+    assert jobs.pending_jobs() == 0
@@ -3,6 +3,7 @@ from app.main import app
 from app import crud, database, models
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+import gzip
 import os
 import time
 import shutil
@@ -84,8 +85,8 @@ def test_trigger_report():
     assert "report_id" in json_response
     report_id = json_response["report_id"]
     assert isinstance(report_id, str)
-    from app.main import report_status as main_report_status
-    assert main_report_status.get(report_id) == "Running"
+    from app.main import get_report_status
+    assert get_report_status(report_id)[0] == "Running"
 
 
 def test_get_report_running_and_complete():
@@ -116,10 +117,10 @@ def test_get_report_running_and_complete():
     assert final_status_response.headers["content-type"] == "text/csv"
     assert "attachment; filename=" in final_status_response.headers["content-disposition"]
     
-    report_file_path = os.path.join(REPORTS_TEST_DIR, f"{report_id}.csv")
+    report_file_path = os.path.join(REPORTS_TEST_DIR, f"{report_id}.csv.gz")
     assert os.path.exists(report_file_path)
     
-    with open(report_file_path, 'r') as f:
+    with gzip.open(report_file_path, 'rt') as f:
         header = f.readline().strip()
         assert header == "store_id,uptime_last_hour,uptime_last_day,uptime_last_week,downtime_last_hour,downtime_last_day,downtime_last_week"
 
@@ -129,3 +130,46 @@ def test_get_report_not_found():
     assert response.status_code == 404
     assert response.json() == {"detail": "Report ID not found."}
 
+
+
+def test_report_download_negotiates_gzip_etag_and_range(monkeypatch):
+    from app import main as main_app
+    report_id = "download-test"
+    csv_text = "store_id,uptime_last_hour\n" + "".join(f"{i},60.0\n" for i in range(200))
+    report_file_path = os.path.join(REPORTS_TEST_DIR, f"{report_id}.csv.gz")
+    with gzip.open(report_file_path, "wt") as f:
+        f.write(csv_text)
+    gzipped = open(report_file_path, "rb").read()
+    # The status is stubbed rather than written, so the test never touches a real database.
+    monkeypatch.setattr(main_app, "get_report_status", lambda requested_id: ("Complete", report_file_path) if requested_id == report_id else None)
+
+    plain = client.get(f"/get_report/{report_id}", headers={"Accept-Encoding": "identity"})
+    assert plain.status_code == 200
+    assert "content-encoding" not in plain.headers
+    assert plain.text == csv_text
+
+    compressed = client.get(f"/get_report/{report_id}", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.text == csv_text
+    etag = compressed.headers["etag"]
+    assert etag != plain.headers["etag"]
+
+    not_modified = client.get(f"/get_report/{report_id}", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert not_modified.status_code == 304
+
+    with client.stream("GET", f"/get_report/{report_id}", headers={"Accept-Encoding": "gzip", "Range": "bytes=10-"}) as partial:
+        assert partial.status_code == 206
+        assert b"".join(partial.iter_raw()) == gzipped[10:]
+
+    assert client.get(f"/get_report/{report_id}?format=parquet").status_code == 404
+
+
+def test_profiled_report_computes_in_process(monkeypatch):
+    from app import main as main_app, report_generation
+    calls = []
+    monkeypatch.setattr(report_generation, "generate_report_logic", lambda *args, **kwargs: calls.append(kwargs))
+    main_app.run_report("profile-test", "2023-01-25 10:00:00.000000 UTC", "key", profile=True)
+    assert calls[0]["workers"] == 1
+    profile_path = os.path.join(REPORTS_TEST_DIR, "profile-test.prof")
+    assert os.path.exists(profile_path)
+    os.remove(profile_path)
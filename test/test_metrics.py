@@ -0,0 +1,20 @@
+from app import metrics
+
+
+def test_worker_metrics_merge_into_the_prometheus_text():
+    metrics.reset()
+    metrics.inc("report_stores_total", 3)
+    metrics.observe("store_window_compute_seconds", 0.5, window="hour")
+    worker_values = metrics.drain()
+    assert metrics.render() == "\n"
+
+    metrics.observe("store_window_compute_seconds", 0.25, window="hour")
+    metrics.merge(worker_values)
+    metrics.set_gauge("report_stores_per_second", 12.5)
+    text = metrics.render()
+    assert "# TYPE store_window_compute_seconds summary" in text
+    assert 'store_window_compute_seconds_count{window="hour"} 2' in text
+    assert 'store_window_compute_seconds_sum{window="hour"} 0.750000' in text
+    assert "report_stores_total 3" in text
+    assert "report_stores_per_second 12.5" in text
+    metrics.reset()
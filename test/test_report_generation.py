@@ -0,0 +1,393 @@
+from datetime import datetime, time, timedelta
+import gzip
+import pyarrow.parquet
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import crud, models, report_generation, store_uptime
+from app.schedule import get_business_intervals_utc
+from app.uptime_index import UptimeIndex
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+NOW_UTC = pytz.utc.localize(datetime(2023, 1, 25, 12, 0, 0))
+
+
+def setup_module(module):
+    models.Base.metadata.create_all(bind=engine)
+
+
+def teardown_module(module):
+    models.Base.metadata.drop_all(bind=engine)
+
+
+def make_db(polls=(), business_hours=(), timezone_str=None, store_id="1"):
+    db = TestingSessionLocal()
+    db.query(models.StoreStatus).delete()
+    db.query(models.BusinessHours).delete()
+    db.query(models.StoreTimezone).delete()
+    for ts, status in polls:
+        db.add(models.StoreStatus(store_id=store_id, timestamp_utc=ts, status=status))
+    for day, start, end in business_hours:
+        db.add(models.BusinessHours(store_id=store_id, day_of_week=day, start_time_local=start, end_time_local=end))
+    if timezone_str:
+        db.add(models.StoreTimezone(store_id=store_id, timezone_str=timezone_str))
+    db.commit()
+    return db
+
+
+def business_seconds(records, timezone_str, start, end):
+    intervals = get_business_intervals_utc(records, timezone_str, start, end)
+    return sum((b - a).total_seconds() for a, b in intervals)
+
+
+def test_always_open_store_splits_hour_by_poll_status():
+    db = make_db(polls=[
+        (datetime(2023, 1, 25, 11, 0), "active"),
+        (datetime(2023, 1, 25, 11, 30), "inactive"),
+    ])
+    result = report_generation.calculate_uptime_downtime("1", NOW_UTC, db)
+    db.close()
+    assert result["uptime_last_hour"] == 30
+    assert result["downtime_last_hour"] == 30
+
+
+def test_store_without_polls_is_assumed_up_during_business_hours():
+    # 2023-01-25 is a Wednesday (day_of_week=2); 09:00-17:00 New York is 14:00-22:00 UTC.
+    db = make_db(business_hours=[(2, time(9), time(17))], timezone_str="America/New_York")
+    result = report_generation.calculate_uptime_downtime("1", pytz.utc.localize(datetime(2023, 1, 26, 0, 0)), db)
+    db.close()
+    assert result["uptime_last_day"] == 8
+    assert result["downtime_last_day"] == 0
+    assert result["uptime_last_hour"] == 0
+
+
+def test_overnight_business_hours_cover_both_ends_of_the_local_day():
+    records = [models.BusinessHours(day_of_week=2, start_time_local=time(22), end_time_local=time(2))]
+    start = pytz.utc.localize(datetime(2023, 1, 23))
+    end = pytz.utc.localize(datetime(2023, 1, 30))
+    assert business_seconds(records, "UTC", start, end) == 4 * 3600
+
+
+def test_business_hours_inside_dst_gap_start_at_the_transition():
+    # 2023-03-12 is a Sunday; New York clocks jump from 02:00 to 03:00.
+    records = [models.BusinessHours(day_of_week=6, start_time_local=time(2, 30), end_time_local=time(5))]
+    start = pytz.utc.localize(datetime(2023, 3, 11))
+    end = pytz.utc.localize(datetime(2023, 3, 14))
+    assert business_seconds(records, "America/New_York", start, end) == 2 * 3600
+
+
+def test_preloaded_store_data_matches_per_store_queries():
+    db = make_db(
+        polls=[
+            (datetime(2023, 1, 24, 15, 0), "inactive"),
+            (datetime(2023, 1, 25, 11, 20), "active"),
+            (datetime(2023, 1, 25, 11, 50), "inactive"),
+        ],
+        business_hours=[(1, time(8), time(20)), (2, time(5), time(13))],
+        timezone_str="America/Chicago",
+    )
+    timezones, business_hours, status_polls = report_generation.preload_store_data(db, NOW_UTC)
+    preloaded = report_generation.calculate_uptime_downtime(
+        "1",
+        NOW_UTC,
+        timezone_str=timezones["1"],
+        business_hours_records=business_hours["1"],
+        status_polls=status_polls["1"],
+    )
+    queried = report_generation.calculate_uptime_downtime("1", NOW_UTC, db)
+    db.close()
+    assert preloaded == queried
+
+
+def test_custom_trailing_windows_share_one_pass():
+    db = make_db(polls=[
+        (datetime(2023, 1, 25, 11, 0), "active"),
+        (datetime(2023, 1, 25, 11, 50), "inactive"),
+    ])
+    windows = report_generation.parse_windows("15m/4h")
+    result = report_generation.calculate_uptime_downtime("1", NOW_UTC, db, windows=windows)
+    db.close()
+    assert list(result) == report_generation.report_fieldnames(windows)
+    # The first poll inside a window also speaks for the time before it.
+    assert (result["uptime_last_15m"], result["downtime_last_15m"]) == (0, 15)
+    assert (result["uptime_last_4h"], result["downtime_last_4h"]) == (3.83, 0.17)
+
+
+def test_process_pool_keeps_store_order():
+    db = make_db(polls=[(datetime(2023, 1, 25, 11, 30), "inactive")])
+    timezones, business_hours, status_polls = report_generation.preload_store_data(db, NOW_UTC)
+    db.close()
+    store_ids = [str(i) for i in range(6)]
+    serial = list(report_generation.calculate_fleet(
+        store_ids, NOW_UTC, timezones, business_hours, status_polls, workers=1, chunk_size=2
+    ))
+    pooled = list(report_generation.calculate_fleet(
+        store_ids, NOW_UTC, timezones, business_hours, status_polls, workers=2, chunk_size=2
+    ))
+    assert [row["store_id"] for row in pooled] == store_ids
+    assert pooled == serial
+
+
+def test_numpy_engine_matches_python_engine():
+    from app import vectorized
+
+    db = make_db(
+        polls=[
+            (datetime(2023, 1, 19, 4, 0), "active"),
+            (datetime(2023, 1, 24, 22, 15), "inactive"),
+            (datetime(2023, 1, 25, 11, 20), "active"),
+            (datetime(2023, 1, 25, 11, 50), "inactive"),
+        ],
+        business_hours=[(1, time(20), time(4)), (2, time(5), time(13))],
+        timezone_str="America/Denver",
+    )
+    db.add(models.StoreStatus(store_id="2", timestamp_utc=datetime(2023, 1, 25, 9, 0), status="inactive"))
+    db.commit()
+    windows = report_generation.DEFAULT_WINDOWS + report_generation.parse_windows("15m")
+    timezones, business_hours, status_polls = report_generation.preload_store_data(db, NOW_UTC, windows)
+    db.close()
+    store_ids = ["1", "2", "3"]
+    python_rows = [
+        report_generation.calculate_uptime_downtime(
+            store_id,
+            NOW_UTC,
+            timezone_str=timezones.get(store_id, report_generation.DEFAULT_TIMEZONE),
+            business_hours_records=business_hours.get(store_id, []),
+            status_polls=status_polls.get(store_id, []),
+            windows=windows,
+        )
+        for store_id in store_ids
+    ]
+    numpy_rows = list(vectorized.calculate_fleet_vectorized(
+        store_ids, NOW_UTC, timezones, business_hours, status_polls, windows
+    ))
+    assert numpy_rows == python_rows
+
+
+def test_rollup_engine_matches_python_engine():
+    from app import crud, rollup
+
+    db = make_db(
+        polls=[
+            (datetime(2023, 1, 18, 13, 5, 30), "inactive"),
+            (datetime(2023, 1, 23, 7, 45), "active"),
+            (datetime(2023, 1, 24, 9, 20), "inactive"),
+            (datetime(2023, 1, 24, 11, 10), "active"),
+            (datetime(2023, 1, 25, 11, 20), "inactive"),
+            (datetime(2023, 1, 25, 11, 55), "active"),
+        ],
+        business_hours=[(1, time(2), time(23)), (2, time(21), time(6)), (0, time(0), time(12))],
+        timezone_str="America/Los_Angeles",
+    )
+    db.add(models.StoreStatus(store_id="2", timestamp_utc=datetime(2023, 1, 25, 11, 40), status="active"))
+    db.commit()
+    crud.bump_data_version(db)
+    store_ids = ["1", "2"]
+    # The rollup was not maintained for these polls, so the engine rebuilds it before reading it.
+    assert not rollup.rollup_is_current(db)
+    for as_of in (NOW_UTC, NOW_UTC + timedelta(minutes=7, seconds=30)):
+        python_rows = list(report_generation.compute_report_rows(db, store_ids, as_of, engine="python", workers=1))
+        rollup_rows = list(report_generation.compute_report_rows(db, store_ids, as_of, engine="rollup"))
+        assert rollup_rows == python_rows
+    assert rollup.rollup_is_current(db)
+    db.close()
+
+
+def test_runs_engine_matches_python_engine():
+    from app import runs
+
+    # Same status for hours, a gap longer than RUN_MAX_GAP, and polls at most an hour apart near the end.
+    polls = [(datetime(2023, 1, 18, 12) + timedelta(minutes=50 * i), "active") for i in range(100)]
+    polls += [(datetime(2023, 1, 23, 9), "active"), (datetime(2023, 1, 24, 10), "inactive")]
+    polls += [(datetime(2023, 1, 24, 10, 40) + timedelta(minutes=55 * i), "inactive") for i in range(25)]
+    polls += [(datetime(2023, 1, 25, 11, 50), "active")]
+    db = make_db(polls=polls, business_hours=[(2, time(9), time(17)), (3, time(20), time(4))], timezone_str="America/New_York")
+    runs.rebuild_status_runs(db)
+    assert db.query(models.StoreStatusRun).count() == 4
+    for as_of in (NOW_UTC, NOW_UTC - timedelta(minutes=12), NOW_UTC - timedelta(hours=3, minutes=5), NOW_UTC - timedelta(days=1, hours=5)):
+        python_rows = list(report_generation.compute_report_rows(db, ["1"], as_of, engine="python", workers=1))
+        runs_rows = list(report_generation.compute_report_rows(db, ["1"], as_of, engine="runs", workers=1))
+        assert runs_rows == python_rows
+    db.close()
+
+
+def test_compiled_schedule_stitches_cached_weeks_across_dst():
+    from app import schedule
+
+    # 2023-03-12 (a Sunday) New York springs forward; 2023-03-13 starts a new UTC week.
+    records = [
+        models.BusinessHours(day_of_week=6, start_time_local=time(22), end_time_local=time(3)),
+        models.BusinessHours(day_of_week=0, start_time_local=time(0), end_time_local=time(1)),
+    ]
+    start = pytz.utc.localize(datetime(2023, 3, 8))
+    end = pytz.utc.localize(datetime(2023, 3, 16))
+    schedule.clear_schedule_cache()
+    compiled = schedule.compile_schedule("1", "America/New_York", records, start, end)
+    assert compiled.intersect([(start, end)]) == get_business_intervals_utc(
+        records, "America/New_York", start, end
+    )
+    a = pytz.utc.localize(datetime(2023, 3, 12, 12))
+    b = pytz.utc.localize(datetime(2023, 3, 13, 12))
+    assert compiled.business_seconds(a, b) == business_seconds(records, "America/New_York", a, b)
+    # A store without hours is one interval, even across the week boundary.
+    assert schedule.compile_schedule("2", "UTC", [], start, end).intersect([(start, end)]) == [(start, end)]
+    schedule.compile_schedule("1", "America/New_York", records, start, end)
+    assert schedule._compiled_week.cache_info().hits == 2
+
+
+def test_zone_offsets_match_pytz_around_transitions():
+    from app import tz_offsets
+
+    zone_offsets = tz_offsets.get_zone_offsets("America/New_York")
+    new_york = pytz.timezone("America/New_York")
+    # Ambiguous 01:30 on 2023-11-05 resolves to standard time; 02:30 on 2023-03-12 never happened.
+    assert zone_offsets.to_utc(datetime(2023, 11, 5, 1, 30)) == pytz.utc.localize(datetime(2023, 11, 5, 6, 30))
+    assert zone_offsets.to_utc(datetime(2023, 3, 12, 2, 30)) == pytz.utc.localize(datetime(2023, 3, 12, 7, 0))
+    instant = pytz.utc.localize(datetime(2023, 3, 12, 6, 45))
+    for _ in range(8):
+        assert zone_offsets.to_local(instant) == instant.astimezone(new_york).replace(tzinfo=None)
+        instant += timedelta(minutes=15)
+    assert tz_offsets.get_zone_offsets("Not/AZone") is tz_offsets.get_zone_offsets(report_generation.DEFAULT_TIMEZONE)
+
+
+def test_report_rows_stream_to_csv_and_report_data(tmp_path):
+    db = make_db()
+    rows = [
+        {"store_id": str(i), "uptime_last_hour": 60, "uptime_last_day": 24, "uptime_last_week": 168,
+         "downtime_last_hour": 0, "downtime_last_day": 0, "downtime_last_week": 0}
+        for i in range(5)
+    ]
+    report_file_path = str(tmp_path / "r1.csv")
+    assert report_generation.write_report(db, "r1", iter(rows), report_file_path) == 5
+    assert open(report_file_path).read().splitlines()[0] == ",".join(report_generation.report_fieldnames())
+    assert db.query(models.ReportData).filter(models.ReportData.report_id == "r1").count() == 5
+
+    def failing_rows():
+        yield rows[0]
+        raise RuntimeError("engine failed")
+
+    try:
+        report_generation.write_report(db, "r2", failing_rows(), str(tmp_path / "r2.csv"))
+    except RuntimeError:
+        pass
+    try:
+        report_generation.write_report(db, "r3", failing_rows(), str(tmp_path / "r3.csv.gz"),
+                                       parquet_file_path=str(tmp_path / "r3.parquet"))
+    except RuntimeError:
+        pass
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["r1.csv"]
+
+    report_generation.write_report(db, "r4", iter(rows), str(tmp_path / "r4.csv.gz"),
+                                   parquet_file_path=str(tmp_path / "r4.parquet"))
+    db.close()
+    with gzip.open(tmp_path / "r4.csv.gz", "rt") as f:
+        assert f.read() == open(report_file_path).read()
+    assert pyarrow.parquet.read_table(tmp_path / "r4.parquet").to_pylist() == [
+        {name: float(value) if name != "store_id" else value for name, value in row.items()} for row in rows
+    ]
+
+
+def test_numpy_engine_reads_polls_from_a_current_snapshot(tmp_path, monkeypatch):
+    from app import crud, snapshot
+
+    db = make_db(polls=[
+        (datetime(2023, 1, 24, 20, 0), "inactive"),
+        (datetime(2023, 1, 25, 11, 15, 0, 250000), "active"),
+    ])
+    db.add(models.StoreStatus(store_id="0", timestamp_utc=datetime(2023, 1, 25, 11, 40), status="inactive"))
+    db.add(models.StoreStatus(store_id="0", timestamp_utc=datetime(2023, 1, 10), status="inactive"))
+    db.commit()
+    crud.bump_data_version(db)
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", str(tmp_path))
+    snapshot.write_store_status_snapshot(db)
+    loaded = snapshot.load_store_status_snapshot(crud.get_data_version(db))
+    assert loaded["store_ids"] == ["0", "1"] and len(loaded["segments"][0]["timestamp_us"]) == 4
+    assert snapshot.load_store_status_snapshot(crud.get_data_version(db) + 1) is None
+
+    store_ids = ["1", "0", "2"]
+    python_rows = list(report_generation.compute_report_rows(db, store_ids, NOW_UTC, engine="python", workers=1))
+    numpy_rows = list(report_generation.compute_report_rows(db, store_ids, NOW_UTC, engine="numpy"))
+    assert numpy_rows == python_rows
+
+    # New polls, including one older than polls already in the snapshot, go into an appended segment.
+    db.add(models.StoreStatus(store_id="2", timestamp_utc=datetime(2023, 1, 25, 9), status="inactive"))
+    db.add(models.StoreStatus(store_id="1", timestamp_utc=datetime(2023, 1, 25, 10), status="inactive"))
+    db.commit()
+    crud.bump_data_version(db)
+    snapshot.write_store_status_snapshot(db)
+    loaded = snapshot.load_store_status_snapshot(crud.get_data_version(db))
+    assert [len(segment["timestamp_us"]) for segment in loaded["segments"]] == [4, 2]
+    assert loaded["store_ids"] == ["0", "1", "2"]
+    python_rows = list(report_generation.compute_report_rows(db, store_ids, NOW_UTC, engine="python", workers=1))
+    numpy_rows = list(report_generation.compute_report_rows(db, store_ids, NOW_UTC, engine="numpy"))
+    assert numpy_rows == python_rows
+
+    # A write at an unchanged data version leaves the snapshot alone; one after clear_data starts over.
+    manifest_path = snapshot.write_store_status_snapshot(db)
+    assert snapshot.write_store_status_snapshot(db) == manifest_path
+    crud.clear_data(db)
+    db.add(models.StoreStatus(store_id="3", timestamp_utc=datetime(2023, 1, 25, 9), status="active"))
+    db.commit()
+    crud.bump_data_version(db)
+    snapshot.write_store_status_snapshot(db)
+    loaded = snapshot.load_store_status_snapshot(crud.get_data_version(db))
+    assert loaded["store_ids"] == ["3"] and [len(segment["timestamp_us"]) for segment in loaded["segments"]] == [1]
+    assert [entry.name for entry in tmp_path.iterdir() if entry.is_dir()] == [f"segment-v{crud.get_data_version(db)}"]
+    db.close()
+
+
+def test_single_store_uptime_is_memoized_per_as_of_and_data_version(monkeypatch):
+    db = make_db(polls=[
+        (datetime(2023, 1, 25, 11, 0), "active"),
+        (datetime(2023, 1, 25, 11, 30), "inactive"),
+    ], timezone_str="America/New_York")
+    expected = report_generation.calculate_uptime_downtime("1", NOW_UTC, db)
+
+    as_of, result = store_uptime.get_store_uptime(db, "1")
+    assert as_of == pytz.utc.localize(datetime(2023, 1, 25, 11, 30))
+    assert store_uptime.get_store_uptime(db, "1", NOW_UTC.replace(tzinfo=None)) == (NOW_UTC, expected)
+    assert store_uptime.get_store_uptime(db, "unknown") is None
+
+    calls = []
+    monkeypatch.setattr(crud, "get_store_status_in_window", lambda *args: calls.append(args) or [])
+    assert store_uptime.get_store_uptime(db, "1", NOW_UTC)[1] == expected
+    assert calls == []
+    crud.bump_data_version(db)
+    # A new data version misses the memo; with no polls the store counts as up.
+    assert store_uptime.get_store_uptime(db, "1", NOW_UTC)[1]["uptime_last_hour"] == 60
+    assert len(calls) == 1
+    db.close()
+
+
+def test_uptime_index_answers_report_windows_and_arbitrary_ranges():
+    polls = [
+        (datetime(2023, 1, 18, 15, 0), "active"),
+        (datetime(2023, 1, 20, 16, 0), "inactive"),
+        (datetime(2023, 1, 20, 17, 0), "inactive"),
+        (datetime(2023, 1, 23, 15, 30), "active"),
+        (datetime(2023, 1, 25, 11, 0), "active"),
+        (datetime(2023, 1, 25, 11, 30), "inactive"),
+    ]
+    db = make_db(polls=polls, business_hours=[(day, time(9), time(17)) for day in range(5)], timezone_str="America/New_York")
+    start_utc = NOW_UTC - timedelta(weeks=2)
+    index = UptimeIndex(
+        "1", "America/New_York", crud.get_business_hours_for_store(db, "1"),
+        crud.get_store_status_in_window(db, "1", start_utc, NOW_UTC), start_utc, NOW_UTC
+    )
+
+    for now in (NOW_UTC, NOW_UTC - timedelta(hours=20), NOW_UTC - timedelta(days=2, minutes=15)):
+        expected = report_generation.calculate_uptime_downtime("1", now, db)
+        window_seconds = [index.uptime_seconds(now - window.duration, now) for window in report_generation.DEFAULT_WINDOWS]
+        assert report_generation.build_store_result("1", report_generation.DEFAULT_WINDOWS, window_seconds) == expected
+
+    # Wednesday to Friday, 9-17 New York: up until the Friday 16:00 UTC (11:00 local) poll.
+    start, end = pytz.utc.localize(datetime(2023, 1, 18, 14)), pytz.utc.localize(datetime(2023, 1, 20, 22))
+    assert index.uptime_seconds(start, end) == (18 * 3600, 24 * 3600)
+    try:
+        index.uptime_seconds(NOW_UTC - timedelta(weeks=3), NOW_UTC)
+        assert False, "a range outside the index should be rejected"
+    except ValueError:
+        pass
+    db.close()